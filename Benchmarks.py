@@ -0,0 +1,222 @@
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import numpy as np
+from typing import Callable, Dict, List
+from Definitions import ValidationLevel, validation as validationContext, validationLevel
+
+startupBudget = 0.5                             # Maximal import time of the command line tool, in seconds
+lazyModules = ['matplotlib', 'scipy']           # Modules that should only be imported when actually used
+
+def startupTime(module: str = 'HashCodeDelivery', repeat: int = 3) -> Dict:
+    """
+    Measures the import time of a module, in a fresh interpreter
+    :param module:  Module to import
+    :param repeat:  Number of measurements. The fastest one is reported
+    :return: Import time (seconds), and which of the lazy modules were loaded by the import
+    """
+    script = ("import json, sys, time\n"
+              "t = time.perf_counter()\n"
+              f"import {module}\n"
+              "t = time.perf_counter() - t\n"
+              f"print(json.dumps({{'time': t, 'loaded': [m for m in {lazyModules!r} if m in sys.modules]}}))\n")
+    directory = os.path.dirname(os.path.abspath(__file__))
+    results = []
+    for i in range(repeat):
+        output = subprocess.run([sys.executable, '-c', script], cwd=directory, capture_output=True, text=True,
+                                check=True).stdout
+        results.append(json.loads(output))
+    return min(results, key=lambda result: result['time'])
+
+def generateInstance(filename: str, nCustomers: int, nWarehouses: int = 10, nProducts: int = 400, nDrones: int = 30,
+                     nRows: int = 400, nColumns: int = 600, nTurns: int = 112993, maxPayload: int = 200,
+                     seed: int = 0) -> None:
+    """
+    Write a random input file, with similar statistics as busy_day.in. Warehouses stock is enough for all orders
+    :param filename:    Output input file
+    :param nCustomers:  Number of customers (orders)
+    :param seed:        Random seed
+    :return:
+    """
+    rng = np.random.default_rng(seed)
+    weights = rng.integers(1, maxPayload // 2, nProducts)
+    itemsPerOrder = rng.integers(1, 15, nCustomers)
+    items = rng.integers(0, nProducts, itemsPerOrder.sum())
+    demand = np.bincount(items, minlength=nProducts)
+    stock = rng.multinomial(1, np.ones(nWarehouses) / nWarehouses, size=demand.sum()).T @ \
+        np.repeat(np.eye(nProducts, dtype=np.int64), demand, axis=0)    # Each ordered item in a random warehouse
+    lines = [f'{nRows} {nColumns} {nDrones} {nTurns} {maxPayload}', str(nProducts), ' '.join(map(str, weights)),
+             str(nWarehouses)]
+    for i in range(nWarehouses):
+        lines += [f'{rng.integers(nRows)} {rng.integers(nColumns)}', ' '.join(map(str, stock[i]))]
+    lines.append(str(nCustomers))
+    offsets = np.concatenate(([0], np.cumsum(itemsPerOrder)))
+    for i in range(nCustomers):
+        lines += [f'{rng.integers(nRows)} {rng.integers(nColumns)}', str(itemsPerOrder[i]),
+                  ' '.join(map(str, items[offsets[i]:offsets[i + 1]]))]
+    with open(filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+class PhaseTimer:
+    """
+    Accumulates the number of calls and total time of a phase
+    """
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+
+    def wrap(self, function: Callable) -> Callable:
+        def timed(*args, **kwargs):
+            t = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.total += time.perf_counter() - t
+                self.calls += 1
+        return timed
+
+    def result(self) -> Dict:
+        return {'calls': self.calls, 'total': self.total, 'mean': self.total / self.calls if self.calls else 0.0}
+
+def benchmarkModel(inputFilename: str, model: str, param: str = '', maxTurns: int = None,
+                   validation: ValidationLevel = ValidationLevel.Strict) -> Dict:
+    """
+    Time the phases of a single model run (event driven engine)
+    :param inputFilename:   Input file
+    :param model:           Model name
+    :param param:           Model parameter (customer picking of Model4, or Batched for Model3)
+    :param maxTurns:        Limit the simulation to this number of turns (scores are then relative to this limit)
+    :param validation:      Validation level of the run (see Definitions.validation())
+    :return: Phase timings, in seconds
+    """
+    with validationContext(validation):
+        return _benchmarkModel(inputFilename, model, param, maxTurns)
+
+def _benchmarkModel(inputFilename: str, model: str, param: str, maxTurns: int) -> Dict:
+    from Parser import Parser, ProblemInstance
+    from Simulations import createSimulation
+
+    ## Parsing - from text, and from the binary cache
+    t = time.perf_counter()
+    Parser(inputFilename, cache = False)
+    parse = time.perf_counter() - t
+    ProblemInstance.load(inputFilename)     # Make sure cache exists
+    t = time.perf_counter()
+    instance = ProblemInstance.load(inputFilename)
+    sim = createSimulation(model, param, inputFilename, instance)
+    parseCached = time.perf_counter() - t
+    if maxTurns is not None:
+        sim.params.nTurns = min(sim.params.nTurns, maxTurns)
+
+    ## Simulation phases
+    timers = {phase: PhaseTimer() for phase in ['timeStepZero', 'timeStep', 'sampleDrone', 'scoring', 'endOfTurn']}
+    sim._timeStepZero = timers['timeStepZero'].wrap(sim._timeStepZero)
+    sim._timeStep = timers['timeStep'].wrap(sim._timeStep)
+    sim._d.sampleDrone = timers['sampleDrone'].wrap(sim._d.sampleDrone)
+    for customer in sim._customersByIndex:      # Completion callbacks are bound when the simulation is created
+        if customer.onComplete is not None:
+            customer.onComplete = timers['scoring'].wrap(customer.onComplete)
+    sim._endOfTurn = timers['endOfTurn'].wrap(sim._endOfTurn)
+    t = time.perf_counter()
+    sim.runEventDriven()
+    run = time.perf_counter() - t
+    with tempfile.TemporaryDirectory() as directory:
+        t = time.perf_counter()
+        sim.writeCommands(os.path.join(directory, 'output.dat'))
+        writeCommands = time.perf_counter() - t
+
+    commands = sim._d.getCommands()
+    ret = {'validation': validationLevel().value, 'parse': parse, 'parseCached': parseCached, 'run': run,
+           'writeCommands': writeCommands, 'turns': sim.params.nTurns, 'processedTurns': timers['timeStep'].calls,
+           'turnsPerSec': sim._time / run if run > 0 else 0.0, 'points': float(sim._points), 'commands': len(commands),
+           'commandsDigest': hashlib.sha1('\n'.join(commands).encode()).hexdigest()}
+    for phase, timer in timers.items():
+        ret[phase] = timer.result()
+    return ret
+
+def runBenchmarks(outputFilename: str, instances: Dict[str, str] = None, models: List[str] = None,
+                  maxTurns: int = None, printouts = True, fast = True) -> Dict:
+    """
+    Benchmark all models on several instances, and write the results as JSON. Models run in strict validation mode,
+    and then in fast mode (see Definitions.validation()), which is reported under 'fast', with its speedup and
+    whether it produced the same commands
+    :param outputFilename:  JSON output file
+    :param instances:       Instance name -> input file. Default is SmallInput.dat, busy_day.in and two synthetic
+                            instances (2x and 4x busy_day.in customers)
+    :param models:          Configuration names (e.g., Model0, Model3Batched, Model4ClosestCurrent). Default is all
+    :param maxTurns:        Limit each simulation to this number of turns
+    :param printouts:       Print a summary line for each run
+    :param fast:            Whether to run the models in fast validation mode too
+    :return: Results - instance -> model -> phase timings
+    """
+    from Portfolio import configurations, configurationName
+    directory = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmpDirectory:
+        if instances is None:
+            instances = {'SmallInput': os.path.join(directory, 'SmallInput.dat'),
+                         'busy_day': os.path.join(directory, 'busy_day.in')}
+            for scale in [2, 4]:
+                instances['synthetic' + str(scale) + 'x'] = os.path.join(tmpDirectory, f'synthetic{scale}x.in')
+                generateInstance(instances['synthetic' + str(scale) + 'x'], 1250 * scale, seed = scale)
+        results: Dict = {}
+        for name, inputFilename in instances.items():
+            results[name] = {}
+            for configuration in configurations():
+                if models is not None and configurationName(configuration) not in models:
+                    continue
+                result = benchmarkModel(inputFilename, configuration[0], configuration[1], maxTurns)
+                results[name][configurationName(configuration)] = result
+                if printouts:
+                    print(name, configurationName(configuration), 'run: %.3f' % result['run'],
+                          'timeStep mean: %.6f' % result['timeStep']['mean'], 'points:', result['points'])
+                if not fast:
+                    continue
+                fastResult = benchmarkModel(inputFilename, configuration[0], configuration[1], maxTurns,
+                                            ValidationLevel.Fast)
+                result['fast'] = {'run': fastResult['run'], 'turnsPerSec': fastResult['turnsPerSec'],
+                                  'speedup': result['run'] / fastResult['run'] if fastResult['run'] > 0 else 0.0,
+                                  'sameCommands': fastResult['commandsDigest'] == result['commandsDigest']}
+                if printouts:
+                    print(name, configurationName(configuration), 'fast run: %.3f' % fastResult['run'],
+                          'speedup: %.3f' % result['fast']['speedup'], 'same commands:',
+                          result['fast']['sameCommands'])
+    with open(outputFilename, 'w') as f:
+        json.dump(results, f, indent=2)
+    return results
+
+class TestStartup(unittest.TestCase):
+    def test_startup_time(self):
+        result = startupTime()
+        print("Import time of HashCodeDelivery: ", result['time'])
+        self.assertEqual(result['loaded'], [])
+        self.assertLess(result['time'], startupBudget)
+
+class TestBenchmarks(unittest.TestCase):
+    def test_benchmark(self):
+        with tempfile.TemporaryDirectory() as directory:
+            inputFilename = os.path.join(directory, 'synthetic.in')
+            generateInstance(inputFilename, 20, nWarehouses = 3, nProducts = 10, nDrones = 3, nTurns = 2000)
+            outputFilename = os.path.join(directory, 'benchmarks.json')
+            runBenchmarks(outputFilename, {'synthetic': inputFilename}, ['Model0', 'Model4ClosestCurrent'],
+                          printouts = False)
+            with open(outputFilename) as f:
+                results = json.load(f)
+        self.assertEqual(list(results['synthetic'].keys()), ['Model0', 'Model4ClosestCurrent'])
+        for result in results['synthetic'].values():
+            self.assertGreater(result['timeStep']['calls'], 0)
+            self.assertGreater(result['scoring']['calls'], 0)
+            self.assertGreater(result['points'], 0)
+            self.assertEqual(result['validation'], ValidationLevel.Strict.value)
+            self.assertTrue(result['fast']['sameCommands'])
+        self.assertEqual(validationLevel(), ValidationLevel.Strict)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:       # Run the benchmark suite: Benchmarks.py <JSON output file> [maximal number of turns]
+        runBenchmarks(sys.argv[1], maxTurns = int(sys.argv[2]) if len(sys.argv) > 2 else None)
+        sys.exit()
+    unittest.main()
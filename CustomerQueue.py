@@ -0,0 +1,109 @@
+from Definitions import Product
+from OrderInventory import Inventory
+from WarehouseCustomer import Customer
+import heapq
+import unittest
+from typing import Callable, Dict, Iterator, List, Set, Tuple
+
+Key = Callable[[Customer], float]       # Priority of a customer (lower first)
+
+class CustomerQueue:
+    """
+    Customers ordered by a priority key (e.g., distance from a warehouse, weighted by the customer remaining order
+    weight). Customers are kept in a heap, and are re-keyed lazily - customers that were invalidated (e.g., received a
+    delivery) are given a new heap entry on the next iteration, and their old entries are dropped when they are reached.
+    Completed customers drop out of the queue. Ties are broken by customer index
+    """
+    def __init__(self, customers: List[Customer], key: Key):
+        """
+        :param customers:   Customers to order (completed customers are ignored)
+        :param key:         Customer priority
+        """
+        self.__key = key
+        self.__customers: Dict[int, Customer] = {}      # Customer index -> customer
+        self.__versions: Dict[int, int] = {}            # Customer index -> version of its valid heap entry
+        self.__heap: List[Tuple[float, int, int]] = []  # (key, customer index, version)
+        self.__invalid: Set[int] = set()                # Indices of customers to re-key
+        for customer in customers:
+            if customer.isComplete():
+                continue
+            self.__customers[customer.index()] = customer
+            self.__versions[customer.index()] = 0
+            self.__heap.append((key(customer), customer.index(), 0))
+        heapq.heapify(self.__heap)
+
+    def __len__(self):
+        return len(self.__versions)
+
+    def invalidate(self, customer: Customer) -> None:
+        """
+        Mark the key of a customer as out of date (e.g., its remaining order has changed)
+        :param customer:
+        :return:
+        """
+        if customer.index() in self.__versions:
+            self.__invalid.add(customer.index())
+
+    def __refresh(self) -> None:
+        for i in self.__invalid:
+            customer = self.__customers[i]
+            if customer.isComplete():
+                del self.__customers[i]
+                del self.__versions[i]
+                continue
+            self.__versions[i] += 1
+            heapq.heappush(self.__heap, (self.__key(customer), i, self.__versions[i]))
+        self.__invalid.clear()
+
+    def iterOrdered(self) -> Iterator[Customer]:
+        """
+        Iterate over the customers, from the lowest key. The customers are popped from the heap as the iteration
+        advances, and are pushed back when it ends, so stopping the iteration early costs only the visited customers.
+        An iteration should be closed (e.g., by close()) before the queue is used again
+        :return: Iterator of customers
+        """
+        self.__refresh()
+        visited: List[Tuple[float, int, int]] = []
+        try:
+            while self.__heap:
+                entry = heapq.heappop(self.__heap)
+                if self.__versions.get(entry[1]) != entry[2]:     # Out of date entry
+                    continue
+                visited.append(entry)
+                yield self.__customers[entry[1]]
+        finally:
+            for entry in visited:
+                heapq.heappush(self.__heap, entry)
+
+class TestCustomerQueue(unittest.TestCase):
+    def setUp(self):
+        self.product = Product(0, 1)
+        self.customers = []
+        for i, n in enumerate([3, 1, 2, 2]):
+            order = Inventory()
+            order.append(self.product, n)
+            self.customers.append(Customer((0, 0), order, index = i))
+        self.queue = CustomerQueue(self.customers, key = lambda customer: customer.order().weight())
+
+    def __ordered(self) -> List[int]:
+        return [customer.index() for customer in self.queue.iterOrdered()]
+
+    def test_order(self):
+        self.assertEqual(self.__ordered(), [1, 2, 3, 0])
+        iterator = self.queue.iterOrdered()
+        self.assertEqual(next(iterator).index(), 1)
+        iterator.close()
+        self.assertEqual(self.__ordered(), [1, 2, 3, 0])
+
+    def test_rekey(self):
+        self.customers[0].remove(self.product, 2)
+        self.assertEqual(self.__ordered(), [1, 2, 3, 0])    # Not invalidated
+        self.queue.invalidate(self.customers[0])
+        self.assertEqual(self.__ordered(), [0, 1, 2, 3])
+        self.customers[1].remove(self.product, 1)
+        self.queue.invalidate(self.customers[1])
+        self.assertEqual(self.__ordered(), [0, 2, 3])
+        self.assertEqual(len(self.queue), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,8 @@
 from typing import List, Tuple
+from enum import Enum
+from contextlib import contextmanager
 import unittest
-import numpy as np
-from scipy.spatial import distance as dst
+import math
 
 class Product:
     def __init__(self, index, weight):
@@ -31,7 +32,45 @@ def distance(orig: Location, dest: Location) -> int:
     :param dest: Destination in [c, r]
     :return: Distance in number of turns (Euclidean rounded up to nearest integer)
     """
-    return int(np.ceil(dst.euclidean(orig, dest)))
+    return math.ceil(math.sqrt((orig[0] - dest[0]) ** 2 + (orig[1] - dest[1]) ** 2))
+
+class ValidationLevel(Enum):
+    Strict = "strict"       # All invariants are checked (default)
+    Fast = "fast"           # Invariants that the planner already guarantees are not re-checked on the hot paths
+
+class Validation:
+    """
+    Global validation level of the invariant checks (see validation()). Hot paths check Validation.strict, which is
+    cheaper than comparing levels. Set only by validation(), which restores the previous level
+    """
+    strict = True
+
+@contextmanager
+def validation(level: ValidationLevel):
+    """
+    Context in which the invariant checks run at a given validation level. The previous level is restored when the
+    context exits (also on exceptions). In fast mode, these checks are skipped, since the planner proves them before
+    setting a mission (loads are fitted to the drone capacity, and products are booked at the warehouse and the
+    customer):
+    - Drone capacity and inventory checks of loads and unloads
+    - Product and booking checks of warehouse and customer bookings and booked removals
+    - Mission timing and consistency checks of drone sampling (mission existence and type are always checked)
+    - Item count checks of order removals (removed products must still be in the order). Removing more items than
+      exist removes all of them - an invalid plan is silently absorbed
+    Invalid plans may then corrupt the simulation state, rather than raise RuntimeError
+    :param level:   Validation level
+    :return:
+    """
+    strict = ValidationLevel(level) == ValidationLevel.Strict
+    previous = Validation.strict
+    Validation.strict = strict
+    try:
+        yield
+    finally:
+        Validation.strict = previous
+
+def validationLevel() -> ValidationLevel:
+    return ValidationLevel.Strict if Validation.strict else ValidationLevel.Fast
 
 class TestDefinition(unittest.TestCase):
     def setUp(self):
@@ -40,6 +79,22 @@ class TestDefinition(unittest.TestCase):
     def test_append_to_inventory (self):
         pass
 
+    def test_validation_level(self):
+        self.assertEqual(validationLevel(), ValidationLevel.Strict)
+        with validation(ValidationLevel.Fast):
+            self.assertFalse(Validation.strict)
+            with validation('strict'):
+                self.assertTrue(Validation.strict)
+            self.assertEqual(validationLevel(), ValidationLevel.Fast)
+        self.assertTrue(Validation.strict)
+        with self.assertRaises(ValueError):
+            with validation('lenient'):
+                pass
+        with self.assertRaises(RuntimeError):
+            with validation(ValidationLevel.Fast):
+                raise RuntimeError("Restored on exceptions")
+        self.assertTrue(Validation.strict)
+
 if __name__ == '__main__':
     unittest.main()
 
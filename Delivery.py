@@ -1,6 +1,6 @@
 from Drone import Drone, DroneStatus
 import unittest
-from Definitions import Product, Location
+from Definitions import Product, Location, Validation, ValidationLevel, validation
 from OrderInventory import Inventory, Order
 from WarehouseCustomer import Warehouse, Customer
 import numpy as np
@@ -31,19 +31,25 @@ class Mission:
         self.loadPhase = True           # Used in combo loading-delver mission
 
 class Delivery:
-    def __init__(self):
+    def __init__(self, sampleEveryStep = True):
         self.__mission: Dict[Drone, Mission] = {}   # Mission controller for each drone
         self.__cmd: List[str] = []                  # List of delivery commands
+        self.sampleEveryStep = sampleEveryStep      # False when drones are only sampled at their task completion times
 
     def __verifyMission(self, drone: Drone, time: int, missionType: MissionType) -> None:
         if drone not in self.__mission:
             raise RuntimeError("Drone mission has not been instantiated properly")
         if self.__mission[drone].missionType != missionType:
             raise RuntimeError("Trying to sample drone wrong mission")
+        if not Validation.strict:       # Sample timing is guaranteed by the simulation engines
+            return
         if time < self.__mission[drone].time:
             raise RuntimeError("Cannot sample a drone before its mission started")
-        if time != drone.time() and time - drone.time() != 1:
-            raise RuntimeError("During a mission drone must be sampled at each time step")
+        if self.sampleEveryStep:
+            if time != drone.time() and time - drone.time() != 1:
+                raise RuntimeError("During a mission drone must be sampled at each time step")
+        elif drone.task.status != DroneStatus.Idle and time > drone.task.time + drone.task.duration:
+            raise RuntimeError("During a mission drone must be sampled when its current task completes")
 
     def isInMission(self, drone: Drone) -> bool:
         if drone in self.__mission:
@@ -280,6 +286,16 @@ class TestDelivery(unittest.TestCase):
             delivery.sampleDrone(self.drone, time)
             time += 1
 
+    def test_mission_guards(self):
+        for level in ValidationLevel:
+            with validation(level):
+                delivery = Delivery()
+                self.assertRaises(RuntimeError, delivery.load, self.drone, 0)       # No mission
+                productsToLoad = Inventory()
+                productsToLoad.append(self.product0, 1)
+                delivery.setLoadMission(self.drone, self.warehouse, productsToLoad, 0)
+                self.assertRaises(RuntimeError, delivery.deliver, self.drone, 0)    # Wrong mission type
+
     @staticmethod
     def __distance (orig,dest):
         return np.ceil(np.sqrt(np.power(orig[0] - dest[0], 2) + np.power(orig[1] - dest[1], 2)))
@@ -0,0 +1,147 @@
+from Definitions import Location, distance
+import unittest
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Tuple
+
+def pairwiseDistances(orig: np.ndarray, dest: np.ndarray) -> np.ndarray:
+    """
+    Calculates the Euclidean distances between two arrays of locations, ceiled to integer
+    :param orig:    Array of locations (n x 2)
+    :param dest:    Array of locations (m x 2)
+    :return: Matrix of distances (n x m) in number of turns
+    """
+    diff = orig[:, None, :] - dest[None, :, :]
+    return np.ceil(np.sqrt((diff * diff).sum(axis=2))).astype(np.int32)
+
+class DistanceTable:
+    """
+    Distances between all warehouses and customers of a problem instance, calculated once. Warehouses and customers
+    are referred by their index. Customer-customer distances (C x C may be large) are calculated a row at a time, for
+    the customers they are needed for, and the most recently used rows are cached - at most maxCustomerRows x C int32
+    distances (e.g., 40MB for the default 1024 rows of 10,000 customers)
+    """
+    def __init__(self, warehouseLocations: List[Location], customerLocations: List[Location],
+                 maxCustomerRows: int = 1024):
+        """
+        :param warehouseLocations:
+        :param customerLocations:
+        :param maxCustomerRows:     Maximal number of cached customer-customer distance rows
+        """
+        self.warehouseLocations = np.array(warehouseLocations, dtype=np.int64).reshape(-1, 2)
+        self.customerLocations = np.array(customerLocations, dtype=np.int64).reshape(-1, 2)
+        self.warehouseCustomer = pairwiseDistances(self.warehouseLocations, self.customerLocations)     # W x C
+        self.warehouseWarehouse = pairwiseDistances(self.warehouseLocations, self.warehouseLocations)   # W x W
+        self.maxCustomerRows = maxCustomerRows
+        self.__customerRows: Dict[int, np.ndarray] = OrderedDict()     # Customer -> distances to all customers (LRU)
+
+        # Sites (warehouse and customer locations) for lookups from an arbitrary location
+        self.__sites: Dict[Location, Tuple[bool, int]] = {}     # Location -> (is warehouse, index)
+        for i, location in reversed(list(enumerate(customerLocations))):
+            self.__sites[tuple(location)] = (False, i)
+        for i, location in reversed(list(enumerate(warehouseLocations))):
+            self.__sites[tuple(location)] = (True, i)
+        self.__toWarehouses: Dict[Location, List[int]] = {}    # Cache of distances from a location to all warehouses
+
+    def __deepcopy__(self, memo):
+        return self     # Distances never change - simulation copies (e.g., temporary drones) share the same table
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_DistanceTable__customerRows'] = OrderedDict()   # Caches are recalculated on demand (e.g., after a
+        state['_DistanceTable__toWarehouses'] = {}              # simulation checkpoint is loaded)
+        return state
+
+    def customerCustomer(self, index: int) -> np.ndarray:
+        """
+        Distances from a customer to all customers. Calculated on demand, and cached (least recently used rows are
+        dropped)
+        :param index:   Customer index
+        :return: Array of distances (int32), by customer index - should not be modified
+        """
+        row = self.__customerRows.get(index)
+        if row is not None:
+            self.__customerRows.move_to_end(index)
+            return row
+        row = pairwiseDistances(self.customerLocations[index:index + 1], self.customerLocations)[0]
+        self.__customerRows[index] = row
+        if len(self.__customerRows) > self.maxCustomerRows:
+            self.__customerRows.popitem(last=False)
+        return row
+
+    def toWarehouses(self, location: Location) -> List[int]:
+        """
+        Distances from a location (e.g., of a drone) to all warehouses
+        :param location:    Origin location
+        :return: List of distances, by warehouse index
+        """
+        if location not in self.__toWarehouses:
+            site = self.__sites.get(location)
+            if site is not None and site[0]:
+                dists = self.warehouseWarehouse[site[1]]
+            elif site is not None:
+                dists = self.warehouseCustomer[:, site[1]]
+            else:
+                dists = pairwiseDistances(np.array([location], dtype=np.int64), self.warehouseLocations)[0]
+            self.__toWarehouses[location] = dists.tolist()
+        return self.__toWarehouses[location]
+
+    def toCustomers(self, location: Location) -> np.ndarray:
+        """
+        Distances from a location (e.g., of a drone) to all customers
+        :param location:    Origin location
+        :return: Array of distances, by customer index
+        """
+        site = self.__sites.get(location)
+        if site is not None and site[0]:
+            return self.warehouseCustomer[site[1]]
+        elif site is not None:
+            return self.customerCustomer(site[1])
+        return pairwiseDistances(np.array([location], dtype=np.int64), self.customerLocations)[0]
+
+    def distance(self, orig: Location, dest: Location) -> int:
+        """
+        Distance between two locations. Table lookup if the destination is a warehouse or a customer
+        :param orig:    Origin location
+        :param dest:    Destination location
+        :return: Distance in number of turns
+        """
+        site = self.__sites.get(dest)
+        if site is None:
+            return distance(orig, dest)
+        if site[0]:
+            return self.toWarehouses(orig)[site[1]]
+        return int(self.toCustomers(orig)[site[1]])
+
+class TestDistanceTable(unittest.TestCase):
+    def setUp(self):
+        self.warehouses = [(0, 0), (5, 5)]
+        self.customers = [(1, 1), (3, 3), (5, 6), (0, 0)]
+        self.table = DistanceTable(self.warehouses, self.customers)
+
+    def test_matrices(self):
+        for i, warehouse in enumerate(self.warehouses):
+            for j, customer in enumerate(self.customers):
+                self.assertEqual(self.table.warehouseCustomer[i, j], distance(warehouse, customer))
+        for i, customer0 in enumerate(self.customers):
+            for j, customer1 in enumerate(self.customers):
+                self.assertEqual(self.table.customerCustomer(i)[j], distance(customer0, customer1))
+
+    def test_row_cache(self):
+        table = DistanceTable(self.warehouses, self.customers, maxCustomerRows = 2)
+        rows = [table.customerCustomer(i) for i in [0, 1, 0, 2]]     # Row 1 is the least recently used, and dropped
+        self.assertIs(table.customerCustomer(0), rows[0])
+        self.assertIs(table.customerCustomer(2), rows[3])
+        self.assertIsNot(table.customerCustomer(1), rows[1])
+        self.assertEqual(table.customerCustomer(1).tolist(), rows[1].tolist())
+        self.assertEqual(rows[0].dtype, np.int32)
+
+    def test_lookups(self):
+        for orig in self.warehouses + self.customers + [(7, 2)]:
+            self.assertEqual(self.table.toWarehouses(orig), [distance(orig, w) for w in self.warehouses])
+            self.assertEqual(self.table.toCustomers(orig).tolist(), [distance(orig, c) for c in self.customers])
+            for dest in self.warehouses + self.customers + [(9, 9)]:
+                self.assertEqual(self.table.distance(orig, dest), distance(orig, dest))
+
+if __name__ == '__main__':
+    unittest.main()
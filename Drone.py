@@ -1,7 +1,11 @@
-from Definitions import Location, Product, distance
+from Definitions import Location, Product, Validation, distance
 from OrderInventory import Inventory, Order
+from Distances import DistanceTable
+import copy
 import unittest
+import numpy as np
 from enum import Enum, auto
+from typing import List
 
 class DroneStatus(Enum):
     Idle = auto()
@@ -9,55 +13,252 @@ class DroneStatus(Enum):
     Load = auto()
     Unload = auto()
 
+class DroneFleet:
+    """
+    State of a fleet of drones, as a structure of arrays with an entry (row) per drone - locations, inner clocks,
+    current tasks, payload weights and inventories (drones x products matrix). Drone objects are views over their
+    entries, and fleet-wide queries are vectorized over all drones
+    """
+    def __init__(self, nDrones: int, nProducts: int = 0):
+        self.rows = np.zeros(nDrones, dtype=np.int64)               # Drone locations
+        self.columns = np.zeros(nDrones, dtype=np.int64)
+        self.clocks = np.zeros(nDrones, dtype=np.int64)             # Drone inner clocks
+        self.maxWeights = np.zeros(nDrones, dtype=np.int64)
+        self.statuses = np.full(nDrones, DroneStatus.Idle.value, dtype=np.int8)     # Current task status
+        self.taskTimes = np.full(nDrones, -1, dtype=np.int64)       # Start time of current task
+        self.taskDurations = np.full(nDrones, -1, dtype=np.int64)   # Duration of current task
+        self.destRows = np.zeros(nDrones, dtype=np.int64)           # Destination of current task
+        self.destColumns = np.zeros(nDrones, dtype=np.int64)
+        self.taskProducts: List[Order] = [Order() for i in range(nDrones)]     # Products to load/unload in current task
+        self.taskWeights = np.zeros(nDrones, dtype=np.int64)        # Weight of current task products
+        self.payloads = np.zeros(nDrones, dtype=np.int64)           # Weight of drone inventories
+        self.inventories = np.zeros((nDrones, nProducts), dtype=np.int64)  # Items of each product, by product index
+        self.productWeights = np.zeros(nProducts, dtype=np.int64)   # Weights by product index
+        self.drones: List['Drone'] = [None] * nDrones               # Drone views, by row
+
+    def __len__(self):
+        return len(self.drones)
+
+    def _reserveProducts(self, size: int) -> None:
+        """
+        Make sure inventories can be indexed by product indices up to size - 1
+        :param size:
+        :return:
+        """
+        if size <= self.inventories.shape[1]:
+            return
+        size = max(size, 2 * self.inventories.shape[1])
+        inventories = np.zeros((len(self.drones), size), dtype=np.int64)
+        inventories[:, :self.inventories.shape[1]] = self.inventories
+        weights = np.zeros(size, dtype=np.int64)
+        weights[:len(self.productWeights)] = self.productWeights
+        self.inventories = inventories
+        self.productWeights = weights
+
+    def _copyRow(self, row: int) -> 'DroneFleet':
+        """
+        A fleet of a single drone, with a copy of the state of a drone in the current fleet
+        :param row:     Drone row
+        :return:
+        """
+        ret = DroneFleet(1, self.inventories.shape[1])
+        for name in ['rows', 'columns', 'clocks', 'maxWeights', 'statuses', 'taskTimes', 'taskDurations', 'destRows',
+                     'destColumns', 'taskWeights', 'payloads', 'inventories']:
+            getattr(ret, name)[0] = getattr(self, name)[row]
+        ret.productWeights[:] = self.productWeights
+        ret.taskProducts[0] = self.taskProducts[row].copy()
+        return ret
+
+    def taskEnds(self) -> np.ndarray:
+        return self.taskTimes + self.taskDurations
+
+    def ready(self, time: int) -> np.ndarray:
+        """
+        Drones that are idle, or whose current task completes by a given time
+        :param time:    Current time
+        :return: Boolean mask, by drone row
+        """
+        return (self.statuses == DroneStatus.Idle.value) | (self.taskEnds() <= time)
+
+    def idleLocations(self) -> np.ndarray:
+        """
+        Locations of the idle drones (as of their last refresh)
+        :return: Matrix of drone rows, and their locations (n x 3)
+        """
+        idle = np.flatnonzero(self.statuses == DroneStatus.Idle.value)
+        return np.stack([idle, self.rows[idle], self.columns[idle]], axis=1)
+
+    def statusCounts(self) -> np.ndarray:
+        """
+        Number of drones in each status
+        :return: Counts, by drone status value
+        """
+        return np.bincount(self.statuses, minlength=len(DroneStatus) + 1)
+
+    def refresh(self, time: int) -> None:
+        """
+        Refresh all drones to a given time (see Drone.refreshDroneStatus). Only drones whose task completes are visited
+        :param time:    Current time
+        :return:
+        """
+        if (self.clocks > time).any():
+            raise RuntimeError("Tyring to sample drone in past time to its current inner clock")
+        for row in np.flatnonzero((self.statuses != DroneStatus.Idle.value) & (self.taskEnds() <= time)).tolist():
+            self.drones[row].refreshDroneStatus(time)
+        self.clocks[:] = time
+
+class FleetInventory(Inventory):
+    """
+    Inventory of a drone - a view over the drone row of its fleet inventory matrix. The inventory weight is kept in the
+    fleet payload array
+    """
+    def __init__(self, fleet: DroneFleet, row: int):
+        self._products = {}
+        self.__fleet = fleet
+        self.__row = row
+
+    @property
+    def _counts(self) -> np.ndarray:
+        return self.__fleet.inventories[self.__row]
+
+    @property
+    def _weights(self) -> np.ndarray:
+        return self.__fleet.productWeights
+
+    def _reserve(self, size: int) -> None:
+        self.__fleet._reserveProducts(size)
+
+    def _newOrder(self):
+        return Inventory.__new__(Inventory)     # Results of vectorized operations are not part of the fleet
+
+    def _countsChanged(self) -> None:
+        self.__fleet.payloads[self.__row] = self._counts @ self._weights
+
+    def clear(self) -> None:
+        Order.clear(self)
+        self.__fleet.payloads[self.__row] = 0
+
+    def append(self, product: Product, n: int) -> None:
+        Order.append(self, product, n)
+        self.__fleet.payloads[self.__row] += product.weight * n
+
+    def remove(self, product: Product, n: int) -> int:
+        removed = Order.remove(self, product, n)
+        self.__fleet.payloads[self.__row] -= product.weight * removed
+        return removed
+
+    def weight(self) -> int:
+        return int(self.__fleet.payloads[self.__row])
+
 class DroneTask:
-    def __init__(self):
-        self.status = DroneStatus.Idle  # Current status
-        self.time = -1                  # Start time of current drone task
-        self.duration = -1              # Duration of current task
-        self.dest = (0, 0)              # Destination of current task
-        self.products = Order()         # Dictionary for frequency of each product to load/unload in current task
+    """
+    Current task of a drone - a view over the drone row of its fleet
+    """
+    __statuses = {status.value: status for status in DroneStatus}
+
+    def __init__(self, fleet: DroneFleet, row: int):
+        self.__fleet = fleet
+        self.__row = row
+
+    @property
+    def status(self) -> DroneStatus:     # Current status
+        return self.__statuses[int(self.__fleet.statuses[self.__row])]
+
+    @status.setter
+    def status(self, status: DroneStatus) -> None:
+        self.__fleet.statuses[self.__row] = status.value
+
+    @property
+    def time(self) -> int:      # Start time of current drone task
+        return int(self.__fleet.taskTimes[self.__row])
+
+    @property
+    def duration(self) -> int:  # Duration of current task
+        return int(self.__fleet.taskDurations[self.__row])
+
+    @property
+    def dest(self) -> Location:     # Destination of current task
+        return int(self.__fleet.destRows[self.__row]), int(self.__fleet.destColumns[self.__row])
+
+    @property
+    def products(self) -> Order:    # Frequency of each product to load/unload in current task
+        return self.__fleet.taskProducts[self.__row]
+
+    @property
+    def weight(self) -> int:        # Weight of products to load/unload in current task
+        return int(self.__fleet.taskWeights[self.__row])
+
+    def __setProducts(self, product: Product, n: int) -> None:
+        self.products.append(product, n)
+        self.__fleet.taskWeights[self.__row] += product.weight * n
+
+    def __clearProducts(self) -> None:
+        self.products.clear()
+        self.__fleet.taskWeights[self.__row] = 0
+
+    def __set(self, status: DroneStatus, time: int, duration: int) -> None:
+        self.__fleet.statuses[self.__row] = status.value
+        self.__fleet.taskTimes[self.__row] = time
+        self.__fleet.taskDurations[self.__row] = duration
 
     def setIdle(self):
-        self.status = DroneStatus.Idle
-        self.time = -1
-        self.duration = -1
-        self.products = Order()
+        self.__set(DroneStatus.Idle, -1, -1)
+        self.__clearProducts()
 
     def setTravel(self, time: int, duration: int, dest: Location):
-        self.status = DroneStatus.Traveling
-        self.time = time
-        self.duration = duration
-        self.dest = dest
-        self.products = Order()
+        self.__set(DroneStatus.Traveling, time, duration)
+        self.__fleet.destRows[self.__row], self.__fleet.destColumns[self.__row] = dest
+        self.__clearProducts()
 
     def setLoad(self, time: int, product: Product, nToLoad: int):
-        self.status = DroneStatus.Load
         if self.time != -1 and self.time != time:
             raise RuntimeError("Since load duration is 1, cannot set loading at two different times")
-        self.time = time
-        self.duration = 1
-        self.products.append(product, nToLoad)
+        self.__set(DroneStatus.Load, time, 1)
+        self.__setProducts(product, nToLoad)
 
     def setUnload(self, time: int, product: Product, nToUnoad: int):
-        self.status = DroneStatus.Unload
         if self.time != -1 and self.time != time:
             raise RuntimeError("Since unload duration is 1, cannot set unloading at two different times")
-        self.time = time
-        self.duration = 1
-        self.products.append(product, nToUnoad)
+        self.__set(DroneStatus.Unload, time, 1)
+        self.__setProducts(product, nToUnoad)
 
 class Drone:
-    def __init__(self, location0: Location, maxWeight: int, inventory: Inventory = None, index = -1):
+    """
+    A drone - a view over a row of a drone fleet. A drone that is created without a fleet has a fleet of its own
+    """
+    def __init__(self, location0: Location, maxWeight: int, inventory: Inventory = None, index = -1,
+                 distances: DistanceTable = None, fleet: DroneFleet = None):
         if inventory is None:
             inventory = Inventory()
         if inventory.weight() > maxWeight:
             raise RuntimeError("Drone is instantiated with a too heavy inventory")
-        self.__location = location0
-        self.__inventory = inventory
-        self.maxWeight = maxWeight
-        self.task = DroneTask()
-        self.__droneTime = 0
+        row = index
+        if fleet is None:
+            fleet = DroneFleet(1)
+            row = 0
+        self.__bind(fleet, row, index, distances)
+        fleet.rows[row], fleet.columns[row] = location0
+        fleet.maxWeights[row] = maxWeight
+        for product in inventory:
+            self.__inventory.append(product, inventory[product])
+
+    def __bind(self, fleet: DroneFleet, row: int, index: int, distances: DistanceTable) -> None:
+        self.__fleet = fleet
+        self.__row = row                # Row in the fleet
         self.__index = index
+        self.__distances = distances    # Precomputed distances. If not given, distances are calculated on each travel
+        self.__inventory = FleetInventory(fleet, row)
+        self.__planned: Inventory = None    # Trial loads of a planning transaction (see beginPlanning())
+        self.task = DroneTask(fleet, row)
+        fleet.drones[row] = self
+
+    def __deepcopy__(self, memo):
+        ret = Drone.__new__(Drone)      # A drone with a fleet of its own, and a copy of the current drone state
+        ret.__bind(self.__fleet._copyRow(self.__row), 0, self.__index, self.__distances)
+        ret.__inventory._products = dict(self.__inventory._products)   # Products of the copied row (in their order)
+        if self.__planned is not None:
+            ret.__planned = self.__planned.copy()
+        return ret
 
     # def __repr__(self):
     #     return {'__location': self.__location, '__inventory': self.__inventory, 'maxWeight': self.maxWeight,
@@ -70,32 +271,44 @@ class Drone:
     def __hash__(self):
         return hash(self.__index)
 
+    @property
+    def maxWeight(self) -> int:
+        return int(self.__fleet.maxWeights[self.__row])
+
+    @maxWeight.setter
+    def maxWeight(self, maxWeight: int) -> None:
+        self.__fleet.maxWeights[self.__row] = maxWeight
+
     def refreshDroneStatus(self, time: int) -> None:
         """
         Refreshes the status of the drone at a given time, based on its current operation
         :param time:    Current time
         :return:
         """
-        if time < self.__droneTime:
+        fleet = self.__fleet
+        row = self.__row
+        if time < fleet.clocks[row]:
             raise RuntimeError("Tyring to sample drone in past time to its current inner clock")
-        self.__droneTime = time
+        fleet.clocks[row] = time
+        status = fleet.statuses[row]
+        if status == DroneStatus.Idle.value or time < fleet.taskTimes[row] + fleet.taskDurations[row]:
+            return
 
         # Traveling mission complete
-        if self.task.status == DroneStatus.Traveling and time >= self.task.time + self.task.duration:
-            self.__location = self.task.dest
-            self.task.setIdle()
+        if status == DroneStatus.Traveling.value:
+            fleet.rows[row] = fleet.destRows[row]
+            fleet.columns[row] = fleet.destColumns[row]
 
         # Loading mission complete
-        elif self.task.status == DroneStatus.Load and time >= self.task.time + self.task.duration:
+        elif status == DroneStatus.Load.value:
             for product in self.task.products:
                 self.__inventory.append(product, self.task.products[product])     # Append products to drone inventory
-            self.task.setIdle()
 
         # Unloading mission complete
-        elif self.task.status == DroneStatus.Unload and time >= self.task.time + self.task.duration:
+        elif status == DroneStatus.Unload.value:
             for product in self.task.products:
                 self.__inventory.remove(product, self.task.products[product])     # Remove product from drone inventory
-            self.task.setIdle()
+        self.task.setIdle()
 
     def status(self, time: int) -> DroneStatus:
         """
@@ -113,14 +326,14 @@ class Drone:
         :return: location
         """
         self.refreshDroneStatus(time)
-        return self.__location
+        return int(self.__fleet.rows[self.__row]), int(self.__fleet.columns[self.__row])
 
     def time(self) -> int:
         """
         Return drone inner clock
         :return: time
         """
-        return self.__droneTime
+        return int(self.__fleet.clocks[self.__row])
 
     def inventory(self, time: int) -> Inventory:
         """
@@ -131,9 +344,57 @@ class Drone:
         self.refreshDroneStatus(time)
         return self.__inventory
 
+    def weight(self, time: int) -> int:
+        """
+        Weight of the drone inventory at a given time, including trial loads of a planning transaction
+        :param time:    Current time
+        :return:
+        """
+        weight = self.inventory(time).weight()
+        if self.__planned is not None:
+            weight += self.__planned.weight()
+        return weight
+
     def index(self) -> int:
         return self.__index
 
+    def beginPlanning(self) -> None:
+        """
+        Start a planning transaction. Until the transaction is committed or discarded, loads are recorded as trial
+        loads, which are considered by weight() and the weight limit, but do not change the drone
+        :return:
+        """
+        if self.__planned is not None:
+            raise RuntimeError("Planning has already begun")
+        self.__planned = Inventory()
+
+    def plannedLoad(self) -> Inventory:
+        """
+        Trial loads of the current planning transaction
+        :return:
+        """
+        if self.__planned is None:
+            raise RuntimeError("Planning has not begun")
+        return self.__planned
+
+    def commitPlanning(self, time: int) -> None:
+        """
+        End a planning transaction, and load its trial loads
+        :param time:    Time at loading start
+        :return:
+        """
+        planned = self.plannedLoad()
+        self.__planned = None
+        for product in planned:
+            self.load(product, planned[product], time)
+
+    def discardPlanning(self) -> None:
+        """
+        End a planning transaction, and drop its trial loads
+        :return:
+        """
+        self.__planned = None
+
     def travel(self, dest: Location, time: int) -> None:
         """
         Send the drone to a location
@@ -144,7 +405,12 @@ class Drone:
         """
         self.refreshDroneStatus(time)
         if self.task.status == DroneStatus.Idle:
-            self.task.setTravel(time, distance(self.__location, dest), dest)
+            location = self.location(time)
+            if self.__distances is not None:
+                d = self.__distances.distance(location, dest)
+            else:
+                d = distance(location, dest)
+            self.task.setTravel(time, d, dest)
         elif self.task.status != DroneStatus.Traveling:
             raise RuntimeError("Cannot order a drone to travel if it is doing something else")
         elif self.task.dest != dest:
@@ -160,7 +426,11 @@ class Drone:
         :return:
         """
         self.refreshDroneStatus(time)
-        self.checkWeightLimit(product, nToLoad)    # Throw if trying to exceed drone capacity
+        if Validation.strict:
+            self.checkWeightLimit(product, nToLoad)    # Throw if trying to exceed drone capacity
+        if self.__planned is not None:
+            self.__planned.append(product, nToLoad)
+            return
         if self.task.status == DroneStatus.Idle or self.task.status == DroneStatus.Load:
             self.task.setLoad(time, product, nToLoad)
         elif self.task.status != DroneStatus.Load:
@@ -176,7 +446,8 @@ class Drone:
         :return:
         """
         self.refreshDroneStatus(time)
-        self.checkInventory(product, nToUnload)     # Throw if trying to unload more than what is in the inventory
+        if Validation.strict:
+            self.checkInventory(product, nToUnload)     # Throw if trying to unload more than what is in the inventory
         if self.task.status == DroneStatus.Idle or self.task.status == DroneStatus.Unload:
             self.task.setUnload(time, product, nToUnload)
         elif self.task.status != DroneStatus.Unload:
@@ -198,8 +469,9 @@ class Drone:
     def checkWeightLimit(self, product: Product, nToLoad: int) -> None:
         wTask = 0
         if self.task.status == DroneStatus.Load:
-            for productTask in self.task.products:
-                wTask += productTask.weight * self.task.products[productTask]
+            wTask += self.task.weight
+        if self.__planned is not None:
+            wTask += self.__planned.weight()
         if self.__inventory.weight () + wTask + product.weight * nToLoad > self.maxWeight:
             raise RuntimeError ("Cannot load product due to drone capacity weight limit")
 
@@ -245,6 +517,52 @@ class TestDrone(unittest.TestCase):
         self.drone.unload(product0, 1, 3)
         self.assertEqual(self.drone.inventory(4).weight(), 0)
 
+    def test_planning(self):
+        product0 = Product(0, 5)
+        self.drone.beginPlanning()
+        self.drone.load(product0, 2, 0)
+        self.assertEqual(self.drone.weight(0), 10)
+        self.assertRaises(RuntimeError, self.drone.load, product0, 2, 0)     # Trial loads count for the weight limit
+        self.drone.discardPlanning()
+        self.assertEqual(self.drone.weight(0), 0)
+        self.assertEqual(self.drone.task.status, DroneStatus.Idle)
+        self.drone.beginPlanning()
+        self.drone.load(product0, 2, 0)
+        self.drone.commitPlanning(0)
+        self.assertEqual(self.drone.inventory(1).weight(), 10)
+
+class TestDroneFleet(unittest.TestCase):
+    def test_fleet_views(self):
+        product0 = Product(0, 5)
+        product1 = Product(1, 3)
+        fleet = DroneFleet(3, 2)
+        drones = [Drone((0, 0), 20, index = i, fleet = fleet) for i in range(3)]
+        drones[0].load(product0, 2, 0)
+        drones[0].load(product1, 1, 0)
+        self.assertEqual(drones[0].task.weight, 13)     # Task weight is cached
+        self.assertRaises(RuntimeError, drones[0].load, product0, 2, 0)
+        drones[1].travel((3, 4), 0)
+        self.assertEqual(fleet.ready(0).tolist(), [False, False, True])
+        self.assertEqual(fleet.ready(1).tolist(), [True, False, True])
+        fleet.refresh(5)
+        self.assertEqual(fleet.payloads.tolist(), [13, 0, 0])
+        self.assertEqual(fleet.taskWeights.tolist(), [0, 0, 0])
+        self.assertEqual(drones[0].inventory(5).weight(), 13)
+        self.assertEqual(fleet.idleLocations().tolist(), [[0, 0, 0], [1, 3, 4], [2, 0, 0]])
+        self.assertEqual(fleet.statusCounts()[DroneStatus.Idle.value], 3)
+
+        # A copy is independent of the fleet
+        droneCopy = copy.deepcopy(drones[0])
+        droneCopy.inventory(5).append(product1, 2)
+        self.assertEqual(droneCopy.inventory(5).weight(), 19)
+        self.assertEqual(drones[0].inventory(5).weight(), 13)
+        self.assertEqual(fleet.inventories[0].tolist(), [2, 1])
+        self.assertEqual(list(droneCopy.inventory(5)), [product0, product1])
+        self.assertTrue(droneCopy.inventory(5).exist(product0))
+        droneCopy.unload(product0, 1, 5)
+        self.assertEqual(droneCopy.inventory(6).count(product0), 1)
+        self.assertEqual(drones[0].inventory(6).count(product0), 2)
+
 if __name__ == '__main__':
     unittest.main()
 
@@ -0,0 +1,124 @@
+from Parser import ProblemInstance
+from Portfolio import Configuration, Worker, configurationName, initWorker, writeCommands
+from Simulations import CustomerPicking, createSimulation
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+from typing import List, Optional, Tuple
+
+Run = Tuple[Configuration, Optional[int]]   # Configuration, and random seed (None for the deterministic model)
+
+def graspConfigurations() -> List[Configuration]:
+    """
+    Configurations with randomized greedy choices (see Simulations.randomize()) - Model3 and Model4 with each customer
+    picking
+    :return:
+    """
+    ret: List[Configuration] = [('Model3', '')]
+    ret += [('Model4', customerPicking.value) for customerPicking in CustomerPicking]
+    return ret
+
+class GraspResult:
+    def __init__(self, configuration: Configuration, seed: Optional[int], points: float, wallTime: float,
+                 commands: List[str], stoppedTurn: int = None):
+        self.configuration = configuration
+        self.seed = seed
+        self.points = points
+        self.wallTime = wallTime
+        self.commands = commands
+        self.stoppedTurn = stoppedTurn      # Turn in which the run was stopped early (None if it ran to its end)
+
+def _runSeed(run: Run) -> GraspResult:
+    configuration, seed = run
+    t = time.perf_counter()
+    sim = createSimulation(configuration[0], configuration[1], Worker.inputFilename, Worker.instance)
+    if seed is not None:
+        sim.randomize(seed, Worker.topK)
+    stoppedTurn = None
+
+    def earlyStop(turn: int) -> bool:       # Stop once the run cannot reach the best score of a completed run
+        nonlocal stoppedTurn
+        if sim.scoreUpperBound(turn) < Worker.best.value:
+            stoppedTurn = turn
+            return True
+        return False
+
+    sim.earlyStop = earlyStop
+    sim.runEventDriven(timeBudget = Worker.timeBudget)
+    if stoppedTurn is not None:
+        return GraspResult(configuration, seed, sim._points, time.perf_counter() - t, [], stoppedTurn)
+    with Worker.best.get_lock():
+        Worker.best.value = max(Worker.best.value, sim._points)
+    return GraspResult(configuration, seed, sim._points, time.perf_counter() - t, sim._d.getCommands())
+
+def runGrasp(inputFilename: str, outputFilename: str, configs: List[Configuration] = None, nSeeds: int = 8,
+             topK: int = 3, processes: int = None, printouts = True, timeBudget: float = None) -> List[GraspResult]:
+    """
+    Multi-start greedy search (GRASP) - run randomized configurations with several seeds in parallel, and write the
+    commands of the best scoring run. The deterministic configurations run first, so their scores are available for
+    early stopping - a run stops once its score upper bound (see Simulations.scoreUpperBound()) is below the best score
+    of the runs completed so far. Runs that can still tie the best score run to their end
+    :param inputFilename:   Input file
+    :param outputFilename:  Output file, for the best run commands
+    :param configs:         Configurations to run. Default is the randomized configurations (see graspConfigurations())
+    :param nSeeds:          Number of random seeds of each configuration (in addition to its deterministic run)
+    :param topK:            Number of best candidates of each greedy choice to pick from
+    :param processes:       Number of worker processes. Default is the number of CPUs
+    :param printouts:       Whether to print a score and wall time table
+    :param timeBudget:      Wall clock budget of each run, in seconds (see Simulations.run()). Default is no budget
+    :return: Results of all runs - deterministic runs, followed by the runs of each seed
+    """
+    if configs is None:
+        configs = graspConfigurations()
+    if processes is None:
+        processes = os.cpu_count()
+    runs: List[Run] = [(configuration, None) for configuration in configs]
+    runs += [(configuration, seed) for seed in range(nSeeds) for configuration in configs]
+    instance = ProblemInstance.load(inputFilename)      # Parsed once, and shared with all workers
+    best = multiprocessing.Value('d', -1.)
+    with multiprocessing.Pool(min(processes, len(runs)), initWorker,
+                              (inputFilename, instance, timeBudget, topK, best)) as pool:
+        results = pool.map(_runSeed, runs, chunksize=1)
+    completed = [result for result in results if result.stoppedTurn is None]
+    winner = max(completed, key=lambda result: result.points)
+    writeCommands(outputFilename, winner.commands)
+    if printouts:
+        print(f'{"Configuration":<32}{"Seed":>6}{"Points":>10}{"Time [s]":>12}{"Stopped":>10}')
+        for result in results:
+            seed = '-' if result.seed is None else str(result.seed)
+            stopped = '-' if result.stoppedTurn is None else str(result.stoppedTurn)
+            print(f'{configurationName(result.configuration):<32}{seed:>6}{result.points:>10.0f}'
+                  f'{result.wallTime:>12.2f}{stopped:>10}')
+        print("Best: " + configurationName(winner.configuration) + ", seed: " + str(winner.seed) + ", points: " +
+              str(winner.points))
+    return results
+
+class TestGrasp(unittest.TestCase):
+    def test_randomized(self):
+        commands = []
+        for seed in [0, 0]:
+            sim = createSimulation('Model4', CustomerPicking.WeightedClosestCurrent.value, 'SmallInput.dat')
+            sim.randomize(seed, topK = 3)
+            sim.runEventDriven()
+            commands.append(sim._d.getCommands())
+        self.assertEqual(commands[0], commands[1])      # Same seed, same commands
+
+    def test_grasp(self):
+        with tempfile.TemporaryDirectory() as directory:
+            outputFilename = os.path.join(directory, 'output.dat')
+            configs = [('Model3', ''), ('Model4', CustomerPicking.WeightedClosestCurrent.value)]
+            results = runGrasp('SmallInput.dat', outputFilename, configs, nSeeds = 3, processes = 2, printouts = False)
+            self.assertEqual(len(results), 8)
+            best = max(results, key=lambda result: result.points)
+            self.assertIsNone(best.stoppedTurn)
+            with open(outputFilename) as f:
+                self.assertEqual(f.read().split('\n')[1:-1], best.commands)
+            for result in results[:2]:      # Deterministic runs
+                sim = createSimulation(result.configuration[0], result.configuration[1], 'SmallInput.dat')
+                sim.runEventDriven()
+                self.assertLessEqual(sim._points, best.points)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,18 +10,23 @@ if __name__ == '__main__':
         model = sys.argv[1]
     if len(sys.argv) > 2:
         param = sys.argv[2]
+    timeBudget = None       # Wall clock budget of the simulation (of each run, in Portfolio and Grasp), in seconds
+    if len(sys.argv) > 3:
+        timeBudget = float(sys.argv[3])
     outputFilename = "output" + model
-    sim = Model0(inputFilename)
-    if model == 'Model1':
-        sim = Model1(inputFilename)
-    elif model == 'Model2':
-        sim = Model2(inputFilename)
-    elif model == 'Model3':
-        sim = Model3(inputFilename)
-    elif model == 'Model4':
+    if model == 'Portfolio':        # Run all models in parallel, and keep the best
+        from Portfolio import runPortfolio
+        runPortfolio(inputFilename, outputFilename + ".dat", timeBudget = timeBudget)
+        sys.exit()
+    if model == 'Grasp':            # Run randomized models with several seeds in parallel, and keep the best
+        from Grasp import runGrasp
+        runGrasp(inputFilename, outputFilename + ".dat", timeBudget = timeBudget)
+        sys.exit()
+    if model == 'Model4' or (model == 'Model3' and param == 'Batched'):
         outputFilename += param
-        sim = Model4(inputFilename, CustomerPicking(param))
-    sim.run(printouts = SimulationPrintouts.Progress)
+    sim = createSimulation(model, param, inputFilename)
+    sim.runEventDriven(printouts = SimulationPrintouts.Progress, timeBudget = timeBudget)
     sim.writeCommands(outputFilename + ".dat")
-
-
+    if timeBudget is not None:
+        print("Time budget:", timeBudget, "Phase times:", sim.phaseTimes, "Degraded turns:", sim.degradedTurns,
+              "Exhausted at turn:", sim.exhaustedTurn)
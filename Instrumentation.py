@@ -0,0 +1,191 @@
+import json
+import os
+import tempfile
+import time as timer
+import unittest
+from typing import Dict, IO, List, Tuple
+
+class _Probe:
+    """
+    Instrumented method - counts the calls of a method, and times them on sampled turns. Set as an instance attribute
+    that shadows the method (or a callback). The method is looked up on the target class, so a probe can be pickled
+    together with its target (e.g., in a simulation checkpoint)
+    """
+    def __init__(self, instrumentation: 'Instrumentation', name: str, target: object, method: str):
+        self.instrumentation = instrumentation
+        self.name = name
+        self.target = target
+        self.method = method
+
+    def __call__(self, *args, **kwargs):
+        instrumentation = self.instrumentation
+        instrumentation.counters[self.name] += 1
+        function = getattr(type(self.target), self.method)
+        if not instrumentation.sampling:
+            return function(self.target, *args, **kwargs)
+        start = timer.perf_counter_ns()
+        try:
+            return function(self.target, *args, **kwargs)
+        finally:
+            instrumentation.timers[self.name] += timer.perf_counter_ns() - start
+
+class Instrumentation:
+    """
+    Hot path instrumentation of a simulation run (see Simulations.run()) - call counters and monotonic timers of:
+    - timeStep:             Model specific time step (planning)
+    - sampleDrone:          Drone sampling (execution of drone tasks)
+    - scoring:              Order completion (scoring)
+    - booking:              Warehouse and customer bookings
+    - maximalPossibleLoad:  Drone load optimization
+    Calls are counted on all turns, and timed on one of every sampleRate processed turns. Timers are inclusive (e.g.,
+    planning time includes the bookings and load optimizations it makes). Methods are instrumented by probes, which are
+    set when a run starts and removed when it ends, so runs without instrumentation have no overhead. Snapshots of the
+    counters, timers and throughput are appended to a JSONL file every snapshot interval, and when the run ends
+    """
+    names = ['timeStep', 'sampleDrone', 'scoring', 'booking', 'maximalPossibleLoad']
+
+    def __init__(self, sampleRate: int = 1, snapshotFilename: str = None, snapshotInterval: float = 1.):
+        """
+        :param sampleRate:          Time calls on one of every sampleRate processed turns
+        :param snapshotFilename:    JSONL file to append snapshots to. Snapshots are only kept in memory if not given
+        :param snapshotInterval:    Wall clock time between snapshots, in seconds
+        """
+        if sampleRate < 1:
+            raise RuntimeError("Sample rate should be positive")
+        self.sampleRate = sampleRate
+        self.snapshotFilename = snapshotFilename
+        self.snapshotInterval = snapshotInterval
+        self.counters: Dict[str, int] = {name: 0 for name in self.names}
+        self.timers: Dict[str, int] = {name: 0 for name in self.names}      # Nanoseconds, on sampled turns
+        self.sampling = False       # Whether calls of the current turn are timed
+        self.turns = 0              # Number of processed turns
+        self.sampledTurns = 0
+        self.snapshots: List[Dict] = []
+        self.__file: IO = None
+        self.__probes: List[Tuple[object, str, Dict]] = []     # (holder, attribute, previous instance attribute)
+        self.__start = 0.
+        self.__last: Tuple[float, int, int] = (0., 0, 0)       # Time, turn and planning calls of the last snapshot
+        self.__nextSnapshot = 0.
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_Instrumentation__file'] = None      # Reopened on the next snapshot
+        return state
+
+    def __probe(self, name: str, holder: object, attribute: str, target: object, method: str) -> None:
+        previous = {attribute: holder.__dict__[attribute]} if attribute in holder.__dict__ else {}
+        self.__probes.append((holder, attribute, previous))
+        setattr(holder, attribute, _Probe(self, name, target, method))
+
+    def attach(self, simulation) -> None:
+        """
+        Set probes on the hot path methods of a simulation, and start the clock
+        :param simulation:  Simulation (see Simulations)
+        :return:
+        """
+        if self.__probes:
+            raise RuntimeError("Instrumentation is already attached")
+        self.__probe('timeStep', simulation, '_timeStep', simulation, '_timeStep')
+        self.__probe('sampleDrone', simulation._d, 'sampleDrone', simulation._d, 'sampleDrone')
+        self.__probe('maximalPossibleLoad', simulation, '_maximalPossibleLoad', simulation, '_maximalPossibleLoad')
+        for warehouse in simulation.params.warehouses:
+            self.__probe('booking', warehouse, 'book', warehouse, 'book')
+        for customer in simulation._customersByIndex:
+            self.__probe('booking', customer, 'book', customer, 'book')
+            if customer.onComplete is not None:
+                self.__probe('scoring', customer, 'onComplete', simulation, '_orderCompleted')
+        self.__start = timer.perf_counter()
+        self.__last = (self.__start, 0, 0)
+        self.__nextSnapshot = self.__start + self.snapshotInterval
+
+    def detach(self, turn: int) -> None:
+        """
+        Remove the probes, and take a final snapshot
+        :param turn:    Last processed turn
+        :return:
+        """
+        for holder, attribute, previous in reversed(self.__probes):
+            if attribute in previous:
+                setattr(holder, attribute, previous[attribute])
+            else:
+                delattr(holder, attribute)
+        self.__probes.clear()
+        self.sampling = False
+        self.snapshot(turn)
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def beginTurn(self, turn: int) -> None:
+        """
+        Called at the start of each processed turn
+        :param turn:    Current turn
+        :return:
+        """
+        self.sampling = self.turns % self.sampleRate == 0
+        self.turns += 1
+        self.sampledTurns += self.sampling
+        if timer.perf_counter() >= self.__nextSnapshot:
+            self.snapshot(turn)
+
+    def snapshot(self, turn: int) -> Dict:
+        """
+        Record the counters, timers and throughput (since the last snapshot)
+        :param turn:    Current turn
+        :return: The snapshot
+        """
+        now = timer.perf_counter()
+        lastTime, lastTurn, lastCalls = self.__last
+        interval = max(now - lastTime, 1e-9)
+        ret = {'turn': turn, 'elapsed': now - self.__start, 'processedTurns': self.turns,
+               'sampledTurns': self.sampledTurns, 'turnsPerSec': (turn - lastTurn) / interval,
+               'planningCallsPerSec': (self.counters['timeStep'] - lastCalls) / interval,
+               'counters': dict(self.counters), 'timers': {name: t * 1e-9 for name, t in self.timers.items()}}
+        self.__last = (now, turn, self.counters['timeStep'])
+        self.__nextSnapshot = now + self.snapshotInterval
+        self.snapshots.append(ret)
+        if self.snapshotFilename is not None:
+            if self.__file is None:
+                self.__file = open(self.snapshotFilename, 'a')
+            self.__file.write(json.dumps(ret) + '\n')
+            self.__file.flush()
+        return ret
+
+class TestInstrumentation(unittest.TestCase):
+    def test_run(self):
+        from Simulations import Model4, CustomerPicking
+        for engine in ['run', 'runEventDriven']:
+            reference = Model4('SmallInput.dat', CustomerPicking.WeightedClosestCurrent)
+            getattr(reference, engine)()
+            sim = Model4('SmallInput.dat', CustomerPicking.WeightedClosestCurrent)
+            with tempfile.TemporaryDirectory() as directory:
+                snapshotFilename = os.path.join(directory, 'snapshots.jsonl')
+                instrumentation = Instrumentation(sampleRate = 2, snapshotFilename = snapshotFilename)
+                getattr(sim, engine)(instrumentation = instrumentation)
+                with open(snapshotFilename) as f:
+                    snapshots = [json.loads(line) for line in f]
+            self.assertEqual(sim._d.getCommands(), reference._d.getCommands())
+            self.assertEqual(snapshots, json.loads(json.dumps(instrumentation.snapshots)))
+            self.assertEqual(snapshots[-1]['counters']['scoring'], len(sim._completedOrders))
+            self.assertEqual(snapshots[-1]['processedTurns'], instrumentation.turns)
+            self.assertEqual(snapshots[-1]['sampledTurns'], (instrumentation.turns + 1) // 2)
+            for name in Instrumentation.names:
+                self.assertGreater(instrumentation.counters[name], 0)
+            self.assertNotIn('book', sim.params.warehouses[0].__dict__)     # Probes are removed
+            self.assertNotIn('_timeStep', sim.__dict__)
+
+    def test_checkpoint(self):
+        from Simulations import Model4, CustomerPicking, resumeSimulation
+        reference = Model4('SmallInput.dat', CustomerPicking.WeightedClosestCurrent)
+        reference.run()
+        sim = Model4('SmallInput.dat', CustomerPicking.WeightedClosestCurrent)
+        with tempfile.TemporaryDirectory() as directory:
+            checkpointFilename = os.path.join(directory, 'checkpoint.pkl')
+            sim.run(checkpointFilename = checkpointFilename, checkpointInterval = 5, instrumentation = Instrumentation())
+            resumed = resumeSimulation(checkpointFilename)      # Instrumented from the checkpoint on
+        self.assertEqual(resumed._d.getCommands(), reference._d.getCommands())
+        self.assertNotIn('book', resumed.params.warehouses[0].__dict__)
+        self.assertIs(resumed._customersByIndex[0].onComplete.__func__, Model4._orderCompleted)
+
+if __name__ == '__main__':
+    unittest.main()
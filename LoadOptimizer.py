@@ -0,0 +1,208 @@
+from Definitions import Product
+from OrderInventory import Inventory, Order
+import unittest
+import numpy as np
+from typing import Callable, Dict, List, Tuple
+
+Value = Callable[[Product], float]      # Value of a single item of a product
+
+class _OrderKnapsack:
+    """
+    Bounded knapsack over the items of a single order. Item counts are split to pieces of 1, 2, 4, ... items (binary
+    splitting), and the pieces are solved as a 0/1 knapsack by dynamic programming over the capacity
+    """
+    def __init__(self, order: Order, capacity: int, value: Value):
+        self.pieces: List[Tuple[Product, int]] = []     # (product, number of items)
+        for product in order:
+            n = order[product]
+            if product.weight > 0:
+                n = min(n, capacity // product.weight)  # Items beyond the capacity are never taken
+            k = 1
+            while n > 0:
+                self.pieces.append((product, min(k, n)))
+                n -= min(k, n)
+                k *= 2
+        self.best = np.zeros(capacity + 1)      # Best value, by used capacity upper bound
+        self.take = np.zeros((len(self.pieces), capacity + 1), dtype=bool)     # Whether a piece is taken
+        for i, (product, k) in enumerate(self.pieces):
+            w = product.weight * k
+            if w > capacity:
+                continue
+            candidate = self.best[:capacity + 1 - w] + value(product) * k
+            self.take[i, w:] = candidate > self.best[w:]
+            self.best[w:] = np.where(self.take[i, w:], candidate, self.best[w:])
+
+        # Value of taking the whole order
+        self.weight = sum(product.weight * order[product] for product in order)
+        self.value = sum(value(product) * order[product] for product in order)
+
+    def solution(self, order: Order, capacity: int) -> Inventory:
+        """
+        Reconstruct the optimal load for a given capacity
+        :param order:       The order the knapsack was built for
+        :param capacity:    Capacity (at most the capacity the knapsack was built for)
+        :return: Load, with products in the order iteration order
+        """
+        counts = {}
+        for i in range(len(self.pieces) - 1, -1, -1):
+            if self.take[i, capacity]:
+                product, k = self.pieces[i]
+                counts[product.index] = counts.get(product.index, 0) + k
+                capacity -= product.weight * k
+        ret = Inventory()
+        for product in order:
+            if product.index in counts:
+                ret.append(product, counts[product.index])
+        return ret
+
+def _fullestLoad(order: Order, capacity: int) -> Dict[int, int]:
+    """
+    The heaviest subset of an order that fits a weight capacity (subset sum). Solved with a bitset of reachable
+    weights, after checking whether a greedy heaviest-first load already fills the capacity
+    :param order:       Products to choose from
+    :param capacity:    Weight capacity
+    :return: Number of items to load, by product index
+    """
+    counts = {product.index: order[product] for product in order}
+    if sum(product.weight * counts[product.index] for product in order) <= capacity:     # The whole order fits
+        return counts
+    products = sorted(order, key=lambda product: product.weight, reverse=True)
+    greedy: Dict[int, int] = {}
+    w = capacity
+    for product in products:
+        n = min(counts[product.index], w // product.weight) if product.weight > 0 else counts[product.index]
+        if n > 0:
+            greedy[product.index] = n
+            w -= product.weight * n
+    if w == 0:
+        return greedy
+    greedyWeight = capacity - w
+
+    # Bitset of reachable weights, after each piece of items (binary splitting of item counts)
+    pieces: List[Tuple[Product, int]] = []
+    reachable = [1]
+    mask = (1 << (capacity + 1)) - 1
+    for product in products:
+        n = min(counts[product.index], capacity // product.weight) if product.weight > 0 else counts[product.index]
+        k = 1
+        while n > 0:
+            pieces.append((product, min(k, n)))
+            reachable.append((reachable[-1] | (reachable[-1] << (product.weight * min(k, n)))) & mask)
+            n -= min(k, n)
+            k *= 2
+    w = reachable[-1].bit_length() - 1
+    if w == greedyWeight:   # The greedy load is as heavy
+        return greedy
+
+    # Reconstruct - a piece is taken if the weight was not reachable without it
+    ret: Dict[int, int] = {}
+    for i in range(len(pieces) - 1, -1, -1):
+        if not (reachable[i] >> w) & 1:
+            product, k = pieces[i]
+            ret[product.index] = ret.get(product.index, 0) + k
+            w -= product.weight * k
+    return ret
+
+def optimizeLoad(order: Order, capacity: int, value: Value = None) -> Inventory:
+    """
+    Find the most valuable subset of an order that fits a weight capacity (bounded knapsack, solved exactly)
+    :param order:       Products to choose from (e.g., available products of a customer order)
+    :param capacity:    Weight capacity (e.g., drone remaining capacity)
+    :param value:       Value of an item of a product. Default is the product weight (fullest load)
+    :return: Load, with products in the order iteration order
+    """
+    if order.empty() or capacity <= 0:
+        return Inventory()
+    if value is not None:
+        return _OrderKnapsack(order, capacity, value).solution(order, capacity)
+    counts = _fullestLoad(order, capacity)
+    ret = Inventory()
+    for product in order:
+        if product.index in counts:
+            ret.append(product, counts[product.index])
+    return ret
+
+def optimizeLoads(orders: List[Order], capacity: int, value: Value = None, completionCredit: float = 0.) -> \
+        List[Inventory]:
+    """
+    Find the most valuable loads of several orders together (e.g., orders of several customers, delivered in a single
+    drone trip), that fit a weight capacity
+    :param orders:              Orders to choose from
+    :param capacity:            Weight capacity
+    :param value:               Value of an item of a product. Default is the product weight
+    :param completionCredit:    Additional value of loading an order entirely
+    :return: Load of each order
+    """
+    if value is None:
+        value = lambda product: product.weight
+    capacity = max(capacity, 0)
+    knapsacks = [_OrderKnapsack(order, capacity, value) for order in orders]
+
+    # Combine the orders - best value by capacity, over the first orders, and the capacity given to each order
+    best = np.zeros(capacity + 1)
+    used = np.arange(capacity + 1)
+    shares = np.zeros((len(orders), capacity + 1), dtype=np.int64)     # Capacity given to the last order
+    full = np.zeros((len(orders), capacity + 1), dtype=bool)           # Whether the last order is loaded entirely
+    for j, knapsack in enumerate(knapsacks):
+        orderBest = knapsack.best.copy()
+        orderFull = np.zeros(capacity + 1, dtype=bool)
+        if knapsack.weight <= capacity and completionCredit > 0:
+            orderFull[knapsack.weight:] = knapsack.value + completionCredit > orderBest[knapsack.weight:]
+            orderBest[orderFull] = knapsack.value + completionCredit
+        total = np.full((capacity + 1, capacity + 1), -np.inf)  # Capacity, and capacity given to the current order
+        mask = used[None, :] <= used[:, None]
+        total[mask] = (best[used[:, None] - used[None, :]] + orderBest[None, :])[mask]
+        shares[j] = np.argmax(total, axis=1)
+        full[j] = orderFull[shares[j]]
+        best = total[used, shares[j]]
+
+    # Reconstruct the loads, from the last order
+    ret: List[Inventory] = [Inventory() for order in orders]
+    for j in range(len(orders) - 1, -1, -1):
+        share = int(shares[j, capacity])
+        if full[j, capacity]:
+            ret[j] = Inventory()
+            for product in orders[j]:
+                ret[j].append(product, orders[j][product])
+        elif share > 0:
+            ret[j] = knapsacks[j].solution(orders[j], share)
+        capacity -= share
+    return ret
+
+class TestLoadOptimizer(unittest.TestCase):
+    def setUp(self):
+        self.products = [Product(0, 7), Product(1, 5), Product(2, 3)]
+
+    def __order(self, counts: List[int]) -> Inventory:
+        order = Inventory()
+        for product, n in zip(self.products, counts):
+            if n > 0:
+                order.append(product, n)
+        return order
+
+    def test_fullest_load(self):
+        load = optimizeLoad(self.__order([3, 1, 2]), 17)     # Greedy heaviest first loads 7 + 7 + 3 = 17 too
+        self.assertEqual(load.weight(), 17)
+        load = optimizeLoad(self.__order([2, 0, 3]), 16)     # Greedy loads 7 + 7 = 14, while 7 + 3 + 3 + 3 = 16
+        self.assertEqual(load.weight(), 16)
+        self.assertEqual(list(load), [self.products[0], self.products[2]])
+        self.assertTrue(optimizeLoad(self.__order([1, 0, 0]), 6).empty())
+        self.assertEqual(optimizeLoad(self.__order([50, 50, 50]), 200).weight(), 200)
+
+    def test_value(self):
+        load = optimizeLoad(self.__order([2, 0, 3]), 16, value = lambda product: 1)      # Most items
+        self.assertEqual(load.products(), {self.products[0]: 1, self.products[2]: 3})
+
+    def test_batch(self):
+        orders = [self.__order([1, 1, 0]), self.__order([0, 0, 2]), self.__order([1, 0, 0])]
+        loads = optimizeLoads(orders, 18)
+        self.assertEqual(sum(load.weight() for load in loads), 18)
+        for load, order in zip(loads, orders):
+            self.assertEqual(load.minimum(order).products(), load.products())
+        loads = optimizeLoads(orders, 13, completionCredit = 100)   # Two complete orders, rather than one
+        self.assertEqual([load.weight() for load in loads], [0, 6, 7])
+        loads = optimizeLoads(orders, 12, completionCredit = 100)   # 12 (complete) is better than 6 + 5 (partial)
+        self.assertEqual([load.weight() for load in loads], [12, 0, 0])
+
+if __name__ == '__main__':
+    unittest.main()
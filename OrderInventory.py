@@ -1,57 +1,219 @@
-from Definitions import Product
+from Definitions import Product, Products, Validation, ValidationLevel, validation
+import pickle
 import unittest
-from typing import Dict
+import numpy as np
+from typing import Dict, List
 
 class Order(object):
-    def __init__(self):
-        self._products: Dict[Product, int] = {}  # Dictionary for frequency of each product
+    """
+    Number of items of each product. Item counts are kept in a dense vector indexed by product index, which allows
+    vectorized arithmetic between orders (see counts(), minimum() and subtract())
+    """
+    def __init__(self, products: Products = None):
+        if products is None:
+            products = []
+        self._counts = np.zeros(len(products), dtype=np.int64)   # Number of items of each product, by product index
+        self._weights = np.array([product.weight for product in products], dtype=np.int64)  # Weights by product index
+        self._products: Dict[int, Product] = {}     # Products in the order, by product index (in insertion order)
 
     def __repr__(self):
-        return repr((self._products))
+        return repr((self.products()))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if '_counts' in state:      # Pickled sparse (e.g., in simulation checkpoints), since most counts are zero
+            counts = state['_counts']
+            indices = counts.nonzero()[0]
+            state['_counts'] = (len(counts), indices, counts[indices])
+        return state
+
+    def __setstate__(self, state):
+        if '_counts' in state:
+            size, indices, values = state['_counts']
+            state['_counts'] = np.zeros(size, dtype=np.int64)
+            state['_counts'][indices] = values
+        self.__dict__.update(state)
 
     def __str__(self):
         ret = "Order: "
-        for product in self._products:
-            ret += " (" + str(product) + "): " + str(self._products[product]) + "|"
+        for product in self:
+            ret += " (" + str(product) + "): " + str(self[product]) + "|"
         return ret
 
     def __iter__(self):
-        return iter(self._products)
+        return iter(self._products.values())
 
     def __getitem__(self, product: Product):
-        return self._products[product]
+        if product.index not in self._products:
+            raise KeyError(product)
+        return int(self._counts[product.index])
 
     def __setitem__(self, product: Product, n: int):
-        self._products[product] = n
+        self._register(product)
+        self._counts[product.index] = n
+        self._countsChanged()
 
     def __delitem__(self, product: Product):
-        del self._products[product]
+        del self._products[product.index]
+        self._counts[product.index] = 0
+        self._countsChanged()
+
+    def _reserve(self, size: int) -> None:
+        """
+        Make sure count and weight vectors can be indexed by product indices up to size - 1
+        :param size:
+        :return:
+        """
+        if size <= len(self._counts):
+            return
+        size = max(size, 2 * len(self._counts))
+        counts = np.zeros(size, dtype=np.int64)
+        counts[:len(self._counts)] = self._counts
+        weights = np.zeros(size, dtype=np.int64)
+        weights[:len(self._weights)] = self._weights
+        self._counts = counts
+        self._weights = weights
+
+    def _register(self, product: Product) -> None:
+        if product.index not in self._products:
+            self._reserve(product.index + 1)
+            self._products[product.index] = product
+            self._weights[product.index] = product.weight
+
+    def _fromCounts(self, counts: np.ndarray):
+        """
+        Create an order of the same type, with a given count vector. Products are taken from the current order (in
+        the current order insertion order)
+        :param counts:  Vector of counts by product index (same length as the current vectors)
+        :return:
+        """
+        ret = self._newOrder()
+        ret._counts = counts
+        ret._weights = self._weights        # Shared - a product index always refers to the same product weight
+        nonzero = counts.tolist()
+        ret._products = {index: product for index, product in self._products.items() if nonzero[index] > 0}
+        ret._countsChanged()
+        return ret
+
+    def _countsChanged(self) -> None:
+        """
+        Called after counts were set directly (not through append/remove)
+        :return:
+        """
+        pass
+
+    def _newOrder(self):
+        """
+        An uninitialized order, of the type of results of vectorized operations (see _fromCounts)
+        :return:
+        """
+        return self.__class__.__new__(self.__class__)
+
+    @classmethod
+    def fromCounts(cls, counts: np.ndarray, products: Products, weights: np.ndarray, indices: List[int] = None):
+        """
+        Create an order from a dense count vector
+        :param counts:      Vector of counts by product index
+        :param products:    All products, by product index
+        :param weights:     Vector of all product weights, by product index (shared between orders)
+        :param indices:     Product indices in insertion order. If not given, products with a non-zero count in
+                            product index order
+        :return:
+        """
+        ret = cls()
+        ret._counts = np.array(counts, dtype=np.int64)
+        ret._weights = weights
+        if indices is None:
+            indices = np.flatnonzero(ret._counts).tolist()
+        ret._products = {index: products[index] for index in indices}
+        ret._countsChanged()
+        return ret
+
+    def copy(self):
+        return self._fromCounts(self._counts.copy())
+
+    def _sortLike(self, other: 'Order') -> None:
+        """
+        Reorder the products to the insertion order of another order, which contains them all
+        :param other:   Reference order (e.g., the order a node available products are derived from)
+        :return:
+        """
+        self._products = {index: product for index, product in other._products.items() if index in self._products}
 
     def products(self) -> Dict[Product, int]:
-        return self._products
+        return {product: int(self._counts[index]) for index, product in self._products.items()}
+
+    def counts(self, size: int = None) -> np.ndarray:
+        """
+        Dense vector of item counts by product index
+        :param size:    Vector length (usually the number of products). If not given, the current vector length
+        :return: The count vector. A view when no padding is needed - should not be modified
+        """
+        if size is None or size == len(self._counts):
+            return self._counts
+        if size < len(self._counts):
+            return self._counts[:size]
+        counts = np.zeros(size, dtype=np.int64)
+        counts[:len(self._counts)] = self._counts
+        return counts
+
+    def minimum(self, other: 'Order', excluded: 'Order' = None):
+        """
+        Product-wise minimum of two orders
+        :param other:       Another order (e.g., warehouse available inventory)
+        :param excluded:    Products to exclude from the other order (e.g., trial bookings), contained in it
+        :return: An order of the same type as the current one, with the products of the current order available in
+                 the other order
+        """
+        counts = other.counts(len(self._counts))
+        if excluded is not None:
+            counts = counts - excluded.counts(len(self._counts))
+        return self._fromCounts(np.minimum(self._counts, counts))
+
+    def subtract(self, other: 'Order'):
+        """
+        Product-wise subtraction of two orders
+        :param other:   Another order, which is contained in the current one (e.g., booked products)
+        :return: An order of the same type as the current one
+        """
+        counts = self._counts - other.counts(len(self._counts))
+        if len(other._counts) > len(self._counts) and other._counts[len(self._counts):].any() or \
+                (counts < 0).any():
+            raise RuntimeError("Trying to subtract more products than exist")
+        return self._fromCounts(counts)
 
     def clear(self) -> None:
+        self._counts[:] = 0
         self._products.clear()
 
     def append(self, product: Product, n: int) -> None:
         if n < 0:
             raise RuntimeError ("Trying to append a negative number of items of product " + str(product))
-        if product in self._products:
-            self._products[product] += n
-        else:
-            self._products[product] = n
+        self._register(product)
+        self._counts[product.index] += n
 
-    def remove(self, product: Product, n: int) -> None:
-        if product in self._products and self._products [product] >= n:
-            self._products [product] -= n
+    def remove(self, product: Product, n: int) -> int:
+        """
+        Remove items of a product. With fast validation (see Definitions.validation()), the count is not compared -
+        removing more items than exist removes all of them
+        :param product:
+        :param n:
+        :return: Number of items removed (less than n only if the removal was clamped)
+        """
+        if product.index in self._products and (not Validation.strict or self._counts[product.index] >= n):
+            self._counts[product.index] -= n      # Fast validation skips the count comparison only
         else:
             raise RuntimeError ("Trying to remove more products " + str(product) + " than exist")
-        if self._products [product] == 0:
-            del self._products [product]
+        count = self._counts[product.index]
+        if count <= 0:
+            self._counts[product.index] = 0
+            del self._products[product.index]
+            return n + int(count)
+        return n
 
     def count(self, product: Product) -> int:
         if self.exist(product):
-            return self._products[product]
+            return int(self._counts[product.index])
         return 0
 
     def empty(self) -> bool:
@@ -60,36 +222,44 @@ class Order(object):
         return True
 
     def exist(self, product: Product) -> bool:
-        return product in self._products
+        return product.index in self._products
 
 class Inventory(Order):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, products: Products = None):
+        super().__init__(products)
         self.__weight = 0
 
     def __repr__(self):
-        return repr((self._products, self.__weight))
+        return repr((self.products(), self.weight()))
 
     def __str__(self):
         ret = "Inventory: "
-        for product in self._products:
-            ret += " (" + str(product) + "): " + str(self._products [product]) + "|"
-        ret += " total weight = " + str(self.__weight)
+        for product in self:
+            ret += " (" + str(product) + "): " + str(self[product]) + "|"
+        ret += " total weight = " + str(self.weight())
         return ret
 
+    def _countsChanged(self) -> None:
+        self.__weight = None    # Calculated on demand
+
     def clear (self) -> None:
         super().clear()
         self.__weight = 0
 
     def append (self, product: Product, n: int) -> None:
         super().append(product, n)
-        self.__weight += product.weight * n
+        if self.__weight is not None:
+            self.__weight += product.weight * n
 
-    def remove (self, product: Product, n: int) -> None:
-        super().remove(product, n)
-        self.__weight -= product.weight * n
+    def remove (self, product: Product, n: int) -> int:
+        removed = super().remove(product, n)
+        if self.__weight is not None:
+            self.__weight -= product.weight * removed
+        return removed
 
     def weight (self) -> int:
+        if self.__weight is None:
+            self.__weight = int(self._counts @ self._weights)
         return self.__weight
 
 class TestOrderInventory(unittest.TestCase):
@@ -105,5 +275,52 @@ class TestOrderInventory(unittest.TestCase):
         print(self.inventory)
         self.assertEqual(product0.weight * 3 + product1.weight * 1, self.inventory.weight())
 
+    def test_vectorized_operations(self):
+        products = [Product(0, 5), Product(1, 2), Product(2, 3)]
+        stock = Inventory(products)
+        stock.append(products[2], 4)
+        stock.append(products[0], 2)
+        order = Inventory()
+        order.append(products[1], 1)
+        order.append(products[0], 3)
+        available = order.minimum(stock)
+        self.assertEqual(list(available), [products[0]])
+        self.assertEqual(available[products[0]], 2)
+        self.assertEqual(available.weight(), 10)
+        remaining = stock.subtract(available)
+        self.assertEqual(list(remaining), [products[2]])
+        self.assertEqual(remaining.weight(), 12)
+        self.assertTrue(remaining.subtract(remaining).empty())
+        self.assertRaises(RuntimeError, available.subtract, stock)
+        self.assertEqual(stock.counts(4).tolist(), [2, 0, 4, 0])
+
+    def test_pickle(self):
+        products = [Product(0, 5), Product(1, 2), Product(2, 3)]
+        stock = Inventory(products)
+        stock.append(products[2], 4)
+        stock.append(products[0], 2)
+        copy = pickle.loads(pickle.dumps(stock))
+        self.assertEqual(list(copy), [products[2], products[0]])
+        self.assertEqual(copy.counts().tolist(), stock.counts().tolist())
+        self.assertEqual(copy.weight(), stock.weight())
+        copy.append(products[1], 1)
+        self.assertEqual(copy.weight(), stock.weight() + 2)
+
+    def test_remove(self):
+        products = [Product(0, 5), Product(1, 2)]
+        for level in ValidationLevel:
+            with validation(level):
+                stock = Inventory()
+                stock.append(products[0], 2)
+                self.assertRaises(RuntimeError, stock.remove, products[1], 1)     # Not in the inventory
+                if level == ValidationLevel.Strict:
+                    self.assertRaises(RuntimeError, stock.remove, products[0], 3)
+                else:
+                    stock.append(products[1], 1)
+                    self.assertEqual(stock.remove(products[0], 3), 2)      # Clamped
+                    self.assertEqual(list(stock), [products[1]])
+                    self.assertEqual(stock.weight(), 2)
+                    self.assertRaises(RuntimeError, stock.remove, products[0], 1)
+
 if __name__ == '__main__':
     unittest.main()
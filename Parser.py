@@ -2,57 +2,188 @@ from Definitions import Product
 from OrderInventory import Inventory, Order
 from WarehouseCustomer import Warehouse, Customer
 import unittest
+import numpy as np
+import hashlib
+import os
+import shutil
+import tempfile
 from typing import List
-import matplotlib.pyplot as plt
+
+class ProblemInstance:
+    """
+    Compact structure-of-arrays representation of a problem instance
+    """
+    def __init__(self, header: np.ndarray, productWeights: np.ndarray, warehouseLocations: np.ndarray,
+                 stock: np.ndarray, customerLocations: np.ndarray, orderItems: np.ndarray, orderOffsets: np.ndarray):
+        self.nRows, self.nColumns, self.nDrones, self.nTurns, self.maxPayload = (int(x) for x in header)
+        self.productWeights = productWeights            # Product weights, by product index (P)
+        self.warehouseLocations = warehouseLocations    # Warehouse locations (W x 2)
+        self.stock = stock                              # Warehouse stock (W x P)
+        self.customerLocations = customerLocations      # Customer locations (C x 2)
+        self.orderItems = orderItems                    # Product index of each ordered item, of all customers
+        self.orderOffsets = orderOffsets                # Offsets of each customer items in orderItems (C + 1)
+
+    def header(self) -> np.ndarray:
+        return np.array([self.nRows, self.nColumns, self.nDrones, self.nTurns, self.maxPayload], dtype=np.int64)
+
+    def demand(self) -> np.ndarray:
+        """
+        Number of items of each product ordered by each customer
+        :return: Matrix of demands (C x P)
+        """
+        nCustomers = len(self.customerLocations)
+        customers = np.repeat(np.arange(nCustomers), np.diff(self.orderOffsets))
+        demand = np.zeros((nCustomers, len(self.productWeights)), dtype=np.int32)
+        np.add.at(demand, (customers, self.orderItems), 1)
+        return demand
+
+    @staticmethod
+    def read(inputFilename: str) -> 'ProblemInstance':
+        """
+        Parse an input file. The file is read at once, and each block is parsed as a single vector of integers - the
+        header and warehouses, and the orders, whose locations, numbers of items and items are on alternating lines
+        :param inputFilename:
+        :return:
+        """
+        with open(inputFilename) as f:
+            lines = f.read().split('\n')
+        nWarehouses = int(lines[3])
+        nLines = 5 + 2 * nWarehouses    # Header, products, warehouses and number of orders
+        data = np.fromstring(' '.join(lines[:nLines]), dtype=np.int64, sep=' ')
+
+        ## Header and products
+        header = data[:5]
+        nProducts = int(data[5])
+        productWeights = data[6:6 + nProducts]
+        i = 6 + nProducts
+
+        ## Warehouses - a location followed by the stock of all products
+        warehouses = data[i + 1:i + 1 + nWarehouses * (2 + nProducts)].reshape(nWarehouses, 2 + nProducts)
+        i += 1 + nWarehouses * (2 + nProducts)
+        if i + 1 != len(data):
+            raise RuntimeError("Input file does not match its declared number of products and warehouses")
+
+        ## Orders - a location, number of items and item product indices
+        nOrders = int(data[i])
+        orderLines = lines[nLines:nLines + 3 * nOrders]
+        if len(orderLines) != 3 * nOrders or any(line.strip() for line in lines[nLines + 3 * nOrders:]):
+            raise RuntimeError("Input file does not match its declared number of warehouses and orders")
+        customerLocations = np.fromstring(' '.join(orderLines[0::3]), dtype=np.int64, sep=' ')
+        nItems = np.fromstring(' '.join(orderLines[1::3]), dtype=np.int64, sep=' ')
+        orderItems = np.fromstring(' '.join(orderLines[2::3]), dtype=np.int64, sep=' ')
+        if len(customerLocations) != 2 * nOrders or len(nItems) != nOrders or len(orderItems) != nItems.sum():
+            raise RuntimeError("Input file does not match its declared number of warehouses and orders")
+        customerLocations = customerLocations.reshape(nOrders, 2)
+        orderOffsets = np.zeros(nOrders + 1, dtype=np.int64)
+        np.cumsum(nItems, out=orderOffsets[1:])
+        if orderItems.size and (orderItems.min() < 0 or orderItems.max() >= nProducts):
+            raise RuntimeError("Item to add to order cannot be found in product list")
+
+        return ProblemInstance(header, productWeights, warehouses[:, :2].copy(), warehouses[:, 2:].copy(),
+                               customerLocations, orderItems, orderOffsets)
+
+    @staticmethod
+    def load(inputFilename: str, cacheFilename: str = None) -> 'ProblemInstance':
+        """
+        Load an instance from a binary cache file, which is memory mapped. The cache is (re)built from the input file
+        if it does not exist, or if the input file hash changed
+        :param inputFilename:
+        :param cacheFilename:   Cache file name. Default is input file name followed by '.cache.npy'
+        :return:
+        """
+        if cacheFilename is None:
+            cacheFilename = inputFilename + '.cache.npy'
+        with open(inputFilename, 'rb') as f:
+            sourceHash = np.frombuffer(hashlib.sha256(f.read()).digest(), dtype=np.int64)
+        try:
+            data = np.load(cacheFilename, mmap_mode='r')
+            if data.dtype == np.int64 and len(data) > ProblemInstance.__cacheHeader and \
+                    data[0] == ProblemInstance.__cacheVersion and (data[1:5] == sourceHash).all():
+                return ProblemInstance.__fromCache(data)
+        except (OSError, ValueError):
+            pass
+        instance = ProblemInstance.read(inputFilename)
+        try:
+            instance.__saveCache(cacheFilename, sourceHash)
+        except OSError:     # Cache is an optimization - e.g., input file directory may be read only
+            pass
+        return instance
+
+    __cacheVersion = 1
+    __cacheHeader = 9   # Version, source hash (4), number of products, warehouses, customers and items
+
+    def __saveCache(self, cacheFilename: str, sourceHash: np.ndarray) -> None:
+        """
+        Save the instance as a single int64 vector - a header followed by all arrays, flattened
+        :param cacheFilename:
+        :param sourceHash:  Hash of the input file
+        :return:
+        """
+        header = np.array([self.__cacheVersion, *sourceHash, len(self.productWeights), len(self.warehouseLocations),
+                           len(self.customerLocations), len(self.orderItems)], dtype=np.int64)
+        data = np.concatenate([header, self.header(), self.productWeights, self.warehouseLocations.ravel(),
+                               self.stock.ravel(), self.customerLocations.ravel(), self.orderItems,
+                               self.orderOffsets]).astype(np.int64)
+        # Written to a unique file in the cache directory, which replaces the cache at once. Never leaves a partially
+        # written cache, also when several processes build the same cache
+        fd, tmpFilename = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(cacheFilename) or '.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, data)
+            os.replace(tmpFilename, cacheFilename)
+        except BaseException:
+            try:
+                os.remove(tmpFilename)
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def __fromCache(data: np.ndarray) -> 'ProblemInstance':
+        nProducts, nWarehouses, nCustomers, nItems = (int(x) for x in data[5:ProblemInstance.__cacheHeader])
+        sizes = [5, nProducts, nWarehouses * 2, nWarehouses * nProducts, nCustomers * 2, nItems, nCustomers + 1]
+        arrays = np.split(data[ProblemInstance.__cacheHeader:], np.cumsum(sizes)[:-1])
+        return ProblemInstance(arrays[0], arrays[1], arrays[2].reshape(nWarehouses, 2),
+                               arrays[3].reshape(nWarehouses, nProducts), arrays[4].reshape(nCustomers, 2),
+                               arrays[5], arrays[6])
 
 class Parser:
-    def __init__(self, inputFilename, mapFilename = None):
-        f = open(inputFilename)
+    def __init__(self, inputFilename, mapFilename = None, instance: ProblemInstance = None, cache = True):
+        if instance is None and cache:
+            instance = ProblemInstance.load(inputFilename)
+        elif instance is None:
+            instance = ProblemInstance.read(inputFilename)
+        self.instance = instance
 
         ## Header
-        header = f.readline().split(' ')
-        self.nRows      = int(header[0])
-        self.nColumns   = int(header[1])
-        self.nDrones    = int(header[2])
-        self.nTurns     = int(header[3])
-        self.maxPayload = int(header[4])
+        self.nRows      = instance.nRows
+        self.nColumns   = instance.nColumns
+        self.nDrones    = instance.nDrones
+        self.nTurns     = instance.nTurns
+        self.maxPayload = instance.maxPayload
 
         ## Products
-        nProducts = int(f.readline())   # FIXME: Make sure all product weights appear on the same line
-        products = f.readline().split(' ')
-        self.products = []
-        for index, weight in enumerate(products):
-            product = Product (index, int(weight))
-            self.products.append(product)
+        weights = np.array(instance.productWeights, dtype=np.int64)
+        self.products = [Product(index, weight) for index, weight in enumerate(weights.tolist())]
 
         ## Warehouses
-        nWarehouses = int(f.readline())
         self.warehouses = []
-        for i in range(nWarehouses):
-            location = f.readline().split(' ')
-            inventory = f.readline().split(' ')
-            warehouseInventory = Inventory()
-            for j, quantity in enumerate(inventory):
-                if int(quantity) != 0:
-                    product = self.products[j]
-                    warehouseInventory.append(product, int(quantity))
-            self.warehouses.append(Warehouse((int(location[0]), int(location[1])), warehouseInventory, index = i))
+        for i, location in enumerate(instance.warehouseLocations.tolist()):
+            warehouseInventory = Inventory.fromCounts(instance.stock[i], self.products, weights)
+            self.warehouses.append(Warehouse(tuple(location), warehouseInventory, index = i))
 
         ## Orders
-        self.nOrders = int(f.readline())
+        self.nOrders = len(instance.customerLocations)
         self.customers: List[Customer] = []
-        for i in range(self.nOrders):
-            location = f.readline().split(' ')
-            nItems = int(f.readline())
-            items = f.readline().split(' ')
-            customerOrder = Inventory()
-            for item in items:
-                products = [prod for prod in self.products if prod.index == int(item)]
-                if len(products) == 0:
-                    raise RuntimeError("Item to add to order cannot be found in product list")
-                customerOrder.append(products[0], 1)
-            self.customers.append(Customer((int(location[0]), int(location[1])), customerOrder, index = i))
-        f.close()
+        nProducts = len(self.products)
+        offsets = instance.orderOffsets.tolist()
+        orderItems = np.asarray(instance.orderItems, dtype=np.int64)
+        orderItemsList = orderItems.tolist()
+        for i, location in enumerate(instance.customerLocations.tolist()):
+            customerOrder = Inventory.fromCounts(
+                np.bincount(orderItems[offsets[i]:offsets[i + 1]], minlength=nProducts), self.products, weights,
+                list(dict.fromkeys(orderItemsList[offsets[i]:offsets[i + 1]])))   # Products in order of appearance
+            self.customers.append(Customer(tuple(location), customerOrder, index = i))
 
         # Outputing a map
         if mapFilename is not None:
@@ -81,6 +212,7 @@ class Parser:
                 'Customers\n' + '---------\n' + customers)
 
     def __outputMap(self, mapFilename):
+        import matplotlib.pyplot as plt     # Loaded only when a map is requested - slow to import
         x = []
         y = []
         for customer in self.customers:
@@ -97,10 +229,50 @@ class Parser:
 
 class TestParser(unittest.TestCase):
     def setUp(self):
-        self.params = Parser('SmallInput.dat')
+        self.params = Parser('SmallInput.dat', cache = False)
 
     def test_parsing(self):
         print(self.params)
 
+    def test_instance(self):
+        instance = self.params.instance
+        self.assertEqual(instance.stock.tolist(), [[5, 1, 2], [0, 10, 2]])
+        self.assertEqual(instance.demand().tolist(), [[1, 0, 2], [1, 0, 0], [0, 0, 1]])
+        self.assertEqual([customer.order()[self.params.products[0]] for customer in self.params.customers[:2]], [1, 1])
+        self.assertEqual(list(self.params.customers[0].order()), [self.params.products[2], self.params.products[0]])
+        self.assertEqual(self.params.customers[0].order().weight(), 1000)
+
+    def test_cache(self):
+        with tempfile.TemporaryDirectory() as directory:
+            inputFilename = os.path.join(directory, 'input.dat')
+            shutil.copy('SmallInput.dat', inputFilename)
+            for i in range(2):      # Build the cache, then load it
+                instance = ProblemInstance.load(inputFilename)
+                self.assertTrue(os.path.exists(inputFilename + '.cache.npy'))
+                self.assertEqual(instance.stock.tolist(), self.params.instance.stock.tolist())
+                self.assertEqual(instance.orderItems.tolist(), self.params.instance.orderItems.tolist())
+            with open(inputFilename, 'a') as f:     # Source changed - cache should be rebuilt
+                f.write('\n')
+            instance = ProblemInstance.load(inputFilename)
+            self.assertEqual(repr(Parser(inputFilename, instance = instance)), repr(self.params))
+            with open(inputFilename) as f:
+                lines = f.read().split('\n')
+            lines[0] = '200 ' + lines[0].split(' ', 1)[1]     # Number of rows changed
+            with open(inputFilename, 'w') as f:
+                f.write('\n'.join(lines))
+            self.assertEqual(ProblemInstance.load(inputFilename).nRows, 200)
+            self.assertEqual(np.load(inputFilename + '.cache.npy')[ProblemInstance._ProblemInstance__cacheHeader], 200)
+            self.assertEqual(sorted(os.listdir(directory)), ['input.dat', 'input.dat.cache.npy'])   # No temporary files
+
+    def test_malformed(self):
+        with open('SmallInput.dat') as f:
+            lines = f.read().split('\n')
+        with tempfile.TemporaryDirectory() as directory:
+            inputFilename = os.path.join(directory, 'input.dat')
+            for malformed in [lines[:-3], lines[:-1] + ['2 2'], lines + ['1 1']]:
+                with open(inputFilename, 'w') as f:     # Missing order, extra item, and extra line
+                    f.write('\n'.join(malformed))
+                self.assertRaises(RuntimeError, ProblemInstance.read, inputFilename)
+
 if __name__ == '__main__':
     unittest.main()
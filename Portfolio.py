@@ -0,0 +1,131 @@
+from Parser import ProblemInstance
+from Simulations import CustomerPicking, createSimulation
+import multiprocessing
+import os
+import tempfile
+import time
+import unittest
+from typing import List, Tuple
+
+Configuration = Tuple[str, str]     # Model name, and customer picking (Model4 only)
+
+def configurations() -> List[Configuration]:
+    """
+    All model configurations - Model0-Model3, Model3 with batched assignment, Model4 with each customer picking, and
+    Model5
+    :return:
+    """
+    ret: List[Configuration] = [(model, '') for model in ['Model0', 'Model1', 'Model2', 'Model3']]
+    ret.append(('Model3', 'Batched'))
+    ret += [('Model4', customerPicking.value) for customerPicking in CustomerPicking]
+    ret.append(('Model5', ''))
+    return ret
+
+def configurationName(configuration: Configuration) -> str:
+    return configuration[0] + configuration[1]
+
+class PortfolioResult:
+    def __init__(self, configuration: Configuration, points: float, wallTime: float, commands: List[str]):
+        self.configuration = configuration
+        self.points = points
+        self.wallTime = wallTime
+        self.commands = commands
+
+class Worker:
+    """
+    Worker process state - set once per worker process (see initWorker()), and shared by all its runs
+    """
+    inputFilename: str = ''
+    instance: ProblemInstance = None    # Parsed instance
+    timeBudget: float = None            # Wall clock budget of each run, in seconds (see Simulations.run())
+    topK = 3                            # Number of best candidates of each randomized greedy choice (see Grasp)
+    best = None                         # Best score of the completed runs of all workers (multiprocessing.Value)
+
+def initWorker(inputFilename: str, instance: ProblemInstance, timeBudget: float = None, topK: int = 3,
+               best = None) -> None:
+    """
+    Worker process initializer (see multiprocessing.Pool)
+    :param inputFilename:   Input file
+    :param instance:        Parsed instance of the input file
+    :param timeBudget:      Wall clock budget of each run, in seconds
+    :param topK:            Number of best candidates of each randomized greedy choice
+    :param best:            Shared best score (multiprocessing.Value), for early stopping
+    :return:
+    """
+    Worker.inputFilename = inputFilename
+    Worker.instance = instance
+    Worker.timeBudget = timeBudget
+    Worker.topK = topK
+    Worker.best = best
+
+def writeCommands(outputFilename: str, commands: List[str]) -> None:
+    """
+    Write the commands of a run in the output file format
+    :param outputFilename:  Output file
+    :param commands:        Commands of a run
+    :return:
+    """
+    with open(outputFilename, 'w') as f:
+        f.write(f'{len(commands)}\n')
+        for cmd in commands:
+            f.write(f'{cmd}\n')
+
+def _runConfiguration(configuration: Configuration) -> PortfolioResult:
+    t = time.perf_counter()
+    sim = createSimulation(configuration[0], configuration[1], Worker.inputFilename, Worker.instance)
+    sim.runEventDriven(timeBudget = Worker.timeBudget)
+    return PortfolioResult(configuration, sim._points, time.perf_counter() - t, sim._d.getCommands())
+
+def runPortfolio(inputFilename: str, outputFilename: str, configs: List[Configuration] = None,
+                 processes: int = None, printouts = True, timeBudget: float = None) -> List[PortfolioResult]:
+    """
+    Run several model configurations in parallel, and write the commands of the best scoring one
+    :param inputFilename:   Input file
+    :param outputFilename:  Output file, for the best configuration commands
+    :param configs:         Configurations to run. Default is all configurations
+    :param processes:       Number of worker processes. Default is the number of CPUs
+    :param printouts:       Whether to print a score and wall time table
+    :param timeBudget:      Wall clock budget of each run, in seconds (see Simulations.run()). Default is no budget
+    :return: Results of all configurations, in the given configuration order
+    """
+    if configs is None:
+        configs = configurations()
+    if processes is None:
+        processes = os.cpu_count()
+    instance = ProblemInstance.load(inputFilename)      # Parsed once, and shared with all workers
+    with multiprocessing.Pool(min(processes, len(configs)), initWorker, (inputFilename, instance, timeBudget)) as pool:
+        results = pool.map(_runConfiguration, configs, chunksize=1)
+    best = max(results, key=lambda result: result.points)
+    writeCommands(outputFilename, best.commands)
+    if printouts:
+        print(f'{"Configuration":<32}{"Points":>10}{"Time [s]":>12}')
+        for result in results:
+            print(f'{configurationName(result.configuration):<32}{result.points:>10.0f}{result.wallTime:>12.2f}')
+        print("Best: " + configurationName(best.configuration) + ", points: " + str(best.points))
+    return results
+
+class TestPortfolio(unittest.TestCase):
+    def test_portfolio(self):
+        with tempfile.TemporaryDirectory() as directory:
+            outputFilename = os.path.join(directory, 'output.dat')
+            results = runPortfolio('SmallInput.dat', outputFilename, processes = 2, printouts = False)
+            self.assertEqual(len(results), len(configurations()))
+            best = max(results, key=lambda result: result.points)
+            with open(outputFilename) as f:
+                self.assertEqual(f.read().split('\n')[1:-1], best.commands)
+            sim = createSimulation('Model3', '', 'SmallInput.dat')
+            sim.runEventDriven()
+            self.assertEqual(results[3].points, sim._points)
+
+    def test_time_budget(self):
+        with tempfile.TemporaryDirectory() as directory:
+            outputFilename = os.path.join(directory, 'output.dat')
+            configs = [('Model3', ''), ('Model4', CustomerPicking.ClosestCurrent.value)]
+            results = runPortfolio('SmallInput.dat', outputFilename, configs, processes = 2, printouts = False,
+                                   timeBudget = 0.)      # Budget is exhausted from the start - runs are degraded
+            best = max(results, key=lambda result: result.points)
+            with open(outputFilename) as f:
+                self.assertEqual(f.read().split('\n')[1:-1], best.commands)
+
+if __name__ == '__main__':
+    unittest.main()
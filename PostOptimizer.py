@@ -0,0 +1,447 @@
+from Parser import ProblemInstance
+from Definitions import distance
+from Scorer import parseCommands, scoreCommands, CommandLoad, CommandDeliver
+import os
+import random
+import sys
+import tempfile
+import time as timer
+import unittest
+import numpy as np
+from typing import Dict, List, Tuple
+
+Stop = Tuple[int, List[Tuple[int, int]]]    # Customer index, and (product index, number of items) delivered to it
+
+class _Trip:
+    """
+    Loads from warehouses, followed by deliveries to customers. A trip of a schedule that passed repair delivers all it
+    loads, so it can be moved between drones and between positions in a drone timeline
+    """
+    def __init__(self, loads: List[Tuple[int, int, int]], stops: List[Stop], productWeights: np.ndarray):
+        self.loads = loads          # (warehouse index, product index, number of items), in load order
+        self.stops = stops          # Deliveries, in delivery order
+        self.weight = int(sum(productWeights[p] * n for w, p, n in loads))
+
+    def warehouse(self) -> int:
+        """
+        :return: The warehouse the trip loads from, or -1 if it loads from several warehouses
+        """
+        warehouses = {w for w, p, n in self.loads}
+        return warehouses.pop() if len(warehouses) == 1 else -1
+
+    def selfContained(self) -> bool:
+        loaded: Dict[int, int] = {}
+        for w, p, n in self.loads:
+            loaded[p] = loaded.get(p, 0) + n
+        for c, items in self.stops:
+            for p, n in items:
+                loaded[p] = loaded.get(p, 0) - n
+        return not any(loaded.values())
+
+class PostOptimizer:
+    """
+    Local search over a command schedule. The schedule is first repaired (commands that complete after the last turn
+    are dropped, with the loads they leave undelivered), and split to drone trips. Moves are then tried at random:
+    - Reordering the delivery stops of a trip
+    - Moving a trip to another drone (including an idle one), or to another position of the same drone
+    - Swapping trips of two drones
+    - Merging two trips that load from the same warehouse, when the combined load fits a drone
+    - Loading a trip from a warehouse closer to its customers, when the warehouse has the stock
+    A move is evaluated incrementally - only the timelines of the drones it changes are re-simulated, and only the
+    customers they deliver to are re-scored. Improving moves are kept, as well as moves that keep the score and
+    shorten the changed drone timelines. Schedules with unload commands are not supported (warehouse stock is then
+    time dependent)
+    """
+    __nearestWarehouses = 3         # Number of warehouses considered for a trip (closest to its first customer)
+
+    def __init__(self, instance: ProblemInstance, commands: np.ndarray, seed: int = 0):
+        """
+        :param instance:    Problem instance
+        :param commands:    Valid command matrix (see Scorer.parseCommands), except for commands that complete after
+                            the last turn
+        :param seed:        Random seed of the move selection
+        """
+        self.__instance = instance
+        self.__rng = random.Random(seed)
+        self.__productWeights = np.asarray(instance.productWeights)
+        self.__warehouseLocations = [tuple(location) for location in np.asarray(instance.warehouseLocations).tolist()]
+        self.__customerLocations = [tuple(location) for location in np.asarray(instance.customerLocations).tolist()]
+        if len(commands) and not np.isin(commands[:, 1], [CommandLoad, CommandDeliver]).all():
+            raise RuntimeError("Post optimization supports only load and deliver commands")
+
+        ## Drone trips, after repair
+        self.__trips: List[List[_Trip]] = [self.__parseTrips(commands[commands[:, 0] == d])
+                                           for d in range(instance.nDrones)]
+        self.__movable = [all(trip.selfContained() for trip in trips) for trips in self.__trips]
+
+        ## Remaining warehouse stock, and customers whose orders are completed by the schedule
+        self.__remaining = np.array(instance.stock, dtype=np.int64)
+        delivered = np.zeros((len(self.__customerLocations), len(self.__productWeights)), dtype=np.int64)
+        for trips in self.__trips:
+            for trip in trips:
+                for w, p, n in trip.loads:
+                    self.__remaining[w, p] -= n
+                for c, items in trip.stops:
+                    for p, n in items:
+                        delivered[c, p] += n
+        self.__complete = (delivered == instance.demand()).all(axis=1) & delivered.any(axis=1)
+
+        ## Drone timelines - deliveries (customer -> last delivery turn) and turn of the last command of each drone
+        self.__deliveries: List[Dict[int, int]] = []
+        self.__ends: List[int] = []
+        self.__customerDrones: Dict[int, Dict[int, int]] = {}   # Customer -> drone -> last delivery turn
+        for d, trips in enumerate(self.__trips):
+            deliveries, end = self.__simulate(trips)
+            self.__deliveries.append(deliveries)
+            self.__ends.append(end)
+            for c, turn in deliveries.items():
+                self.__customerDrones.setdefault(c, {})[d] = turn
+        self.__score = sum(self.__customerScore(c, self.__customerDrones[c]) for c in self.__customerDrones)
+        self.moves = {'reorder': 0, 'relocate': 0, 'swap': 0, 'merge': 0, 'warehouse': 0}   # Accepted moves
+
+    def __parseTrips(self, commands: np.ndarray) -> List[_Trip]:
+        """
+        Split the commands of a drone to trips. Commands that complete after the last turn are dropped, and loads of
+        the last trip that are left undelivered are dropped as well
+        :param commands:    Commands of the drone, in execution order
+        :return:
+        """
+        trips: List[Tuple[List[Tuple[int, int, int]], List[Stop]]] = []
+        location = self.__warehouseLocations[0]
+        turn = -1
+        for d, kind, target, p, n in commands.tolist():
+            destination = self.__warehouseLocations[target] if kind == CommandLoad else \
+                self.__customerLocations[target]
+            turn += distance(location, destination) + 1
+            location = destination
+            if turn >= self.__instance.nTurns:
+                break
+            if kind == CommandLoad:
+                if not trips or trips[-1][1]:   # A load after a delivery starts a new trip
+                    trips.append(([], []))
+                loads = trips[-1][0]
+                if loads and loads[-1][0] == target and loads[-1][1] == p:
+                    loads[-1] = (target, p, loads[-1][2] + n)
+                else:
+                    loads.append((target, p, n))
+            else:
+                if not trips:
+                    raise RuntimeError("Drone delivers before loading")
+                stops = trips[-1][1]
+                if not stops or stops[-1][0] != target:
+                    stops.append((target, []))
+                stops[-1][1].append((p, n))
+
+        ## Drop loads that are left on the drone at the end of its timeline (from the last loads of the last trip)
+        if trips:
+            leftover: Dict[int, int] = {}
+            for loads, stops in trips:
+                for w, p, n in loads:
+                    leftover[p] = leftover.get(p, 0) + n
+                for c, items in stops:
+                    for p, n in items:
+                        leftover[p] -= n
+            loads = trips[-1][0]
+            for i in range(len(loads) - 1, -1, -1):
+                w, p, n = loads[i]
+                k = min(n, max(leftover.get(p, 0), 0))
+                leftover[p] = leftover.get(p, 0) - k
+                loads[i] = (w, p, n - k)
+            trips[-1] = ([load for load in loads if load[2] > 0], trips[-1][1])
+            if not trips[-1][0] and not trips[-1][1]:
+                trips.pop()
+        return [_Trip(loads, stops, self.__productWeights) for loads, stops in trips]
+
+    def __simulate(self, trips: List[_Trip]) -> Tuple[Dict[int, int], int]:
+        """
+        Replay the timeline of a drone
+        :param trips:   Drone trips
+        :return: Turn of the last delivery to each customer, and turn in which the last command completes
+        """
+        location = self.__warehouseLocations[0]
+        turn = -1
+        deliveries: Dict[int, int] = {}
+        for trip in trips:
+            for w, p, n in trip.loads:
+                destination = self.__warehouseLocations[w]
+                turn += distance(location, destination) + 1
+                location = destination
+            for c, items in trip.stops:
+                destination = self.__customerLocations[c]
+                turn += distance(location, destination) + len(items)    # A command for each delivered product
+                location = destination
+                deliveries[c] = turn
+        return deliveries, turn
+
+    def __customerScore(self, c: int, droneTurns: Dict[int, int]) -> int:
+        if not self.__complete[c] or not droneTurns:
+            return 0
+        nTurns = self.__instance.nTurns
+        return -((max(droneTurns.values()) - nTurns) * 100 // nTurns)      # ceil((T - t) / T * 100)
+
+    def score(self) -> int:
+        return self.__score
+
+    def __tryMove(self, changes: Dict[int, List[_Trip]]) -> bool:
+        """
+        Evaluate a move, and apply it if it improves the schedule
+        :param changes: New trips of the drones the move changes
+        :return: Whether the move was applied
+        """
+        timelines = {}
+        for d, trips in changes.items():
+            timelines[d] = self.__simulate(trips)
+            if timelines[d][1] >= self.__instance.nTurns:
+                return False
+        customers = set()
+        for d in changes:
+            customers.update(self.__deliveries[d].keys(), timelines[d][0].keys())
+        delta = 0
+        updated: Dict[int, Dict[int, int]] = {}
+        for c in customers:
+            droneTurns = dict(self.__customerDrones.get(c, {}))
+            for d in changes:
+                droneTurns.pop(d, None)
+                if c in timelines[d][0]:
+                    droneTurns[d] = timelines[d][0][c]
+            updated[c] = droneTurns
+            delta += self.__customerScore(c, droneTurns) - self.__customerScore(c, self.__customerDrones.get(c, {}))
+        shorter = sum(timelines[d][1] for d in changes) < sum(self.__ends[d] for d in changes)
+        if delta < 0 or (delta == 0 and not shorter):
+            return False
+
+        ## Apply
+        for d, trips in changes.items():
+            self.__trips[d] = trips
+            self.__deliveries[d], self.__ends[d] = timelines[d]
+        for c, droneTurns in updated.items():
+            self.__customerDrones[c] = droneTurns
+        self.__score += delta
+        return True
+
+    def __randomTrip(self, movable: bool = False) -> Tuple[int, int]:
+        drones = [d for d in range(len(self.__trips)) if self.__trips[d] and (self.__movable[d] or not movable)]
+        if not drones:
+            return -1, -1
+        d = self.__rng.choice(drones)
+        return d, self.__rng.randrange(len(self.__trips[d]))
+
+    def __randomDrone(self) -> int:
+        """
+        :return: A random drone whose trips can be moved, including drones with no trips (e.g., drones left idle by a
+                 truncated schedule), or -1 if there is none
+        """
+        drones = [d for d in range(len(self.__trips)) if self.__movable[d]]
+        return self.__rng.choice(drones) if drones else -1
+
+    def __reorder(self) -> bool:
+        d, t = self.__randomTrip()
+        if d < 0 or len(self.__trips[d][t].stops) < 2:
+            return False
+        trip = self.__trips[d][t]
+        i, j = sorted(self.__rng.sample(range(len(trip.stops)), 2))
+        stops = list(trip.stops)
+        if self.__rng.random() < 0.5:
+            stops[i], stops[j] = stops[j], stops[i]
+        else:
+            stops[i:j + 1] = reversed(stops[i:j + 1])
+        trips = list(self.__trips[d])
+        trips[t] = _Trip(trip.loads, stops, self.__productWeights)
+        return self.__tryMove({d: trips})
+
+    def __relocate(self) -> bool:
+        a, t = self.__randomTrip(movable = True)
+        b = self.__randomDrone()
+        if a < 0:
+            return False
+        if a == b:
+            trips = list(self.__trips[a])
+            trip = trips.pop(t)
+            trips.insert(self.__rng.randrange(len(trips) + 1), trip)
+            return self.__tryMove({a: trips})
+        tripsA = list(self.__trips[a])
+        trip = tripsA.pop(t)
+        tripsB = list(self.__trips[b])
+        tripsB.insert(self.__rng.randrange(len(tripsB) + 1), trip)
+        return self.__tryMove({a: tripsA, b: tripsB})
+
+    def __swap(self) -> bool:
+        a, t = self.__randomTrip(movable = True)
+        b, u = self.__randomTrip(movable = True)
+        if a < 0 or a == b:
+            return False
+        tripsA = list(self.__trips[a])
+        tripsB = list(self.__trips[b])
+        tripsA[t], tripsB[u] = tripsB[u], tripsA[t]
+        return self.__tryMove({a: tripsA, b: tripsB})
+
+    def __merge(self) -> bool:
+        a, t = self.__randomTrip(movable = True)
+        if a < 0:
+            return False
+        trip = self.__trips[a][t]
+        w = trip.warehouse()
+        if w < 0:
+            return False
+        b = a if self.__rng.random() < 0.5 else self.__randomTrip(movable = True)[0]
+        candidates = [u for u, other in enumerate(self.__trips[b]) if (b != a or u != t) and other.warehouse() == w
+                      and trip.weight + other.weight <= self.__instance.maxPayload]
+        if not candidates:
+            return False
+        u = self.__rng.choice(candidates)
+        other = self.__trips[b][u]
+        loads: Dict[int, int] = {}
+        for load in trip.loads + other.loads:
+            loads[load[1]] = loads.get(load[1], 0) + load[2]
+        merged = _Trip([(w, p, n) for p, n in loads.items()], trip.stops + other.stops, self.__productWeights)
+        if a == b:
+            trips = list(self.__trips[a])
+            trips[t] = merged
+            del trips[u]
+            return self.__tryMove({a: trips})
+        tripsA = list(self.__trips[a])
+        tripsA[t] = merged
+        tripsB = list(self.__trips[b])
+        del tripsB[u]
+        return self.__tryMove({a: tripsA, b: tripsB})
+
+    def __changeWarehouse(self) -> bool:
+        d, t = self.__randomTrip()
+        if d < 0:
+            return False
+        trip = self.__trips[d][t]
+        w = trip.warehouse()
+        if w < 0 or not trip.stops:
+            return False
+        first = self.__customerLocations[trip.stops[0][0]]
+        nearest = sorted(range(len(self.__warehouseLocations)),
+                         key=lambda v: distance(self.__warehouseLocations[v], first))[:self.__nearestWarehouses]
+        v = self.__rng.choice(nearest)
+        if v == w or any(self.__remaining[v, p] < n for x, p, n in trip.loads):
+            return False
+        trips = list(self.__trips[d])
+        trips[t] = _Trip([(v, p, n) for x, p, n in trip.loads], trip.stops, self.__productWeights)
+        if not self.__tryMove({d: trips}):
+            return False
+        for x, p, n in trip.loads:
+            self.__remaining[w, p] += n
+            self.__remaining[v, p] -= n
+        return True
+
+    def optimize(self, timeBudget: float, maxMoves: int = None) -> int:
+        """
+        Run the local search
+        :param timeBudget:  Wall clock budget, in seconds
+        :param maxMoves:    Maximal number of tried moves. Unlimited if not given
+        :return: Score of the optimized schedule
+        """
+        moves = [('reorder', self.__reorder), ('relocate', self.__relocate), ('swap', self.__swap),
+                 ('merge', self.__merge), ('warehouse', self.__changeWarehouse)]
+        deadline = timer.perf_counter() + timeBudget
+        nMoves = 0
+        while timer.perf_counter() < deadline and (maxMoves is None or nMoves < maxMoves):
+            name, move = self.__rng.choice(moves)
+            if move():
+                self.moves[name] += 1
+            nMoves += 1
+        return self.__score
+
+    def commands(self) -> np.ndarray:
+        """
+        The current schedule, as a command matrix (commands of each drone in execution order, drone after drone)
+        :return:
+        """
+        rows: List[Tuple[int, int, int, int, int]] = []
+        for d, trips in enumerate(self.__trips):
+            for trip in trips:
+                for w, p, n in trip.loads:
+                    rows.append((d, CommandLoad, w, p, n))
+                for c, items in trip.stops:
+                    for p, n in items:
+                        rows.append((d, CommandDeliver, c, p, n))
+        return np.array(rows, dtype=np.int64).reshape(-1, 5)
+
+def formatCommands(commands: np.ndarray) -> List[str]:
+    """
+    Command matrix to command lines (see Delivery.getCommands)
+    :param commands:    Command matrix, with load and deliver commands only
+    :return:
+    """
+    letters = {CommandLoad: 'L', CommandDeliver: 'D'}
+    return [f'{d} {letters[kind]} {target} {p} {n}' for d, kind, target, p, n in commands.tolist()]
+
+def postOptimize(instance: ProblemInstance, commands: List[str], timeBudget: float, seed: int = 0) -> List[str]:
+    """
+    Improve the commands of a simulation (see PostOptimizer)
+    :param instance:    Problem instance
+    :param commands:    Command lines
+    :param timeBudget:  Wall clock budget, in seconds
+    :param seed:        Random seed
+    :return: Optimized command lines. Valid (see Scorer), with a score at least that of the repaired input commands
+    """
+    matrix = parseCommands(('\n'.join([str(len(commands))] + commands) + '\n').encode())
+    optimizer = PostOptimizer(instance, matrix, seed)
+    points = optimizer.optimize(timeBudget)
+    optimized = optimizer.commands()
+    report = scoreCommands(instance, optimized)
+    if report.violation is not None or report.score != points:
+        raise RuntimeError("Post optimization produced an inconsistent schedule: " + str(report))
+    return formatCommands(optimized)
+
+class TestPostOptimizer(unittest.TestCase):
+    def test_optimize(self):
+        from Simulations import createSimulation
+        instance = ProblemInstance.load('SmallInput.dat')
+        sim = createSimulation('Model0', '', 'SmallInput.dat', instance)
+        sim.runEventDriven()
+        commands = sim._d.getCommands()
+        optimized = postOptimize(instance, commands, timeBudget = 1.)
+        with tempfile.TemporaryDirectory() as directory:
+            commandFilename = os.path.join(directory, 'output.dat')
+            with open(commandFilename, 'w') as f:
+                f.write('\n'.join([str(len(optimized))] + optimized) + '\n')
+            from Scorer import score
+            report = score('SmallInput.dat', commandFilename)
+        self.assertIsNone(report.violation)
+        self.assertGreaterEqual(report.score, sim._points)
+
+    def test_relocate(self):
+        # All trips on drone 0, whose last delivery completes after the last turn. Relocating trips to the idle drones
+        # completes all orders earlier
+        instance = ProblemInstance.load('SmallInput.dat')
+        lines = ['0 L 0 0 1', '0 D 1 0 1', '0 L 0 2 1', '0 D 2 2 1', '0 L 0 0 1', '0 D 0 0 1', '0 L 0 2 1', '0 D 0 2 1',
+                 '0 L 1 2 1', '0 D 0 2 1']
+        optimizer = PostOptimizer(instance, parseCommands(('\n'.join([str(len(lines))] + lines) + '\n').encode()))
+        before = optimizer.score()
+        after = optimizer.optimize(timeBudget = 1., maxMoves = 2000)
+        self.assertGreater(optimizer.moves['relocate'], 0)
+        self.assertGreater(after, before)
+        self.assertGreater(len(set(optimizer.commands()[:, 0].tolist())), 1)
+        report = scoreCommands(instance, optimizer.commands())
+        self.assertIsNone(report.violation)
+        self.assertEqual(report.score, after)
+
+    def test_merge(self):
+        # Two trips from warehouse 0, of an item of product 0 each, to customers 1 and 0. Merging them saves a return to
+        # the warehouse
+        instance = ProblemInstance.load('SmallInput.dat')
+        lines = ['0 L 0 0 1', '0 D 1 0 1', '0 L 0 0 1', '0 D 0 0 1']
+        before = scoreCommands(instance, parseCommands(('\n'.join([str(len(lines))] + lines) + '\n').encode()))
+        optimized = postOptimize(instance, lines, timeBudget = 0.5)
+        after = scoreCommands(instance, parseCommands(('\n'.join([str(len(optimized))] + optimized) + '\n').encode()))
+        self.assertIsNone(after.violation)
+        self.assertGreaterEqual(after.score, before.score)
+        self.assertEqual(sum(line.split()[1] == 'L' for line in optimized), 1)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 3:   # Optimize a command file: PostOptimizer.py <input> <commands> <output> [seconds]
+        instance = ProblemInstance.load(sys.argv[1])
+        with open(sys.argv[2]) as f:
+            commands = f.read().split('\n')[1:]
+        commands = [line for line in commands if line.strip()]
+        optimized = postOptimize(instance, commands, float(sys.argv[4]) if len(sys.argv) > 4 else 10.)
+        with open(sys.argv[3], 'w') as f:
+            f.write('\n'.join([str(len(optimized))] + optimized) + '\n')
+        print(scoreCommands(instance, parseCommands(open(sys.argv[3], 'rb').read())))
+        sys.exit()
+    unittest.main()
@@ -0,0 +1,285 @@
+from Parser import ProblemInstance
+import numpy as np
+import os
+import sys
+import tempfile
+import unittest
+from typing import List, Tuple
+
+## Command type codes
+CommandLoad = 0
+CommandUnload = 1
+CommandDeliver = 2
+CommandWait = 3
+
+class Violation:
+    def __init__(self, turn: int, command: int, message: str):
+        self.turn = turn            # Turn in which the violation occurs
+        self.command = command      # Index of the violating command (0 based, in file order)
+        self.message = message
+
+    def __str__(self):
+        return "Command " + str(self.command) + " (turn " + str(self.turn) + "): " + self.message
+
+class ScoreReport:
+    def __init__(self, score: int, completedOrders: int, nCommands: int, violation: Violation = None):
+        self.score = score                      # Total score (0 if the commands are not valid)
+        self.completedOrders = completedOrders
+        self.nCommands = nCommands
+        self.violation = violation              # First violation found, None if the commands are valid
+
+    def __str__(self):
+        if self.violation is not None:
+            return "Invalid commands. " + str(self.violation)
+        return "Score: " + str(self.score) + ", completed orders: " + str(self.completedOrders) + ", commands: " + \
+               str(self.nCommands)
+
+def parseCommands(text: bytes) -> np.ndarray:
+    """
+    Parse a command file into a matrix. Each command is a row of (drone, type, target, product, number of items).
+    Wait commands are (drone, CommandWait, number of turns, 0, 0). The file is parsed at once with NumPy
+    :param text:    Command file content
+    :return: Command matrix (N x 5)
+    """
+    buf = np.frombuffer(text, dtype=np.uint8)
+    valid = np.zeros(256, dtype=bool)
+    valid[list(b'0123456789LUDW \t\r\n')] = True
+    if not valid[buf].all():
+        raise RuntimeError("Command file contains invalid characters")
+
+    ## All tokens as a single vector. Command letters are translated to their type codes
+    values = np.fromstring(text.translate(bytes.maketrans(b'LUDW', b'0123')), dtype=np.int64, sep=' ')
+    if len(values) == 0:
+        raise RuntimeError("Command file is empty")
+    nCommands = int(values[0])
+
+    ## Commands have 5 tokens, except for wait commands that have 3. Wait commands are found by their line number
+    if text.find(b'W') == -1:
+        if len(values) != 1 + 5 * nCommands:
+            raise RuntimeError("Command file does not match its declared number of commands")
+        commands = values[1:].reshape(-1, 5)
+        if (commands[:, 1] == CommandWait).any():
+            raise RuntimeError("Command file contains malformed commands")
+        return commands
+    isWait = np.zeros(nCommands, dtype=bool)
+    waitLines = np.searchsorted(np.flatnonzero(buf == ord('\n')), np.flatnonzero(buf == ord('W')))
+    if len(waitLines) and (waitLines.min() < 1 or waitLines.max() > nCommands):
+        raise RuntimeError("Command file does not match its declared number of commands")
+    isWait[waitLines - 1] = True
+    nTokens = np.where(isWait, 3, 5)
+    if len(values) != 1 + nTokens.sum():
+        raise RuntimeError("Command file does not match its declared number of commands")
+    offsets = 1 + np.cumsum(nTokens) - nTokens
+    commands = np.zeros((nCommands, 5), dtype=np.int64)
+    for j in range(3):
+        commands[:, j] = values[offsets + j]
+    commands[~isWait, 3] = values[offsets[~isWait] + 3]
+    commands[~isWait, 4] = values[offsets[~isWait] + 4]
+    if ((commands[:, 1] == CommandWait) != isWait).any():
+        raise RuntimeError("Command file contains malformed commands")
+    return commands
+
+def _segmentedCumsum(values: np.ndarray, segmentStart: np.ndarray) -> np.ndarray:
+    """
+    Cumulative sum that restarts at the beginning of each segment
+    :param values:          Values, sorted by segment
+    :param segmentStart:    Boolean mask of first element of each segment
+    :return:
+    """
+    total = np.cumsum(values)
+    starts = np.flatnonzero(segmentStart)
+    offsets = np.repeat(total[starts] - values[starts], np.diff(np.append(starts, len(values))))
+    return total - offsets
+
+def _segmentStarts(keys: np.ndarray) -> np.ndarray:
+    starts = np.ones(len(keys), dtype=bool)
+    starts[1:] = keys[1:] != keys[:-1]
+    return starts
+
+def _first(commands: np.ndarray, turns: np.ndarray) -> int:
+    """
+    The earliest of a set of commands - by completion turn, and then by command index
+    :param commands:    Command indices
+    :param turns:       Completion turns of all commands
+    :return: Command index
+    """
+    commandTurns = turns[commands]
+    return int(commands[commandTurns == commandTurns.min()].min())
+
+def scoreCommands(instance: ProblemInstance, commands: np.ndarray) -> ScoreReport:
+    """
+    Replay commands of all drones, check their validity and calculate their score
+    :param instance:    Problem instance
+    :param commands:    Command matrix (see parseCommands)
+    :return:
+    """
+    nCommands = len(commands)
+    productWeights = np.asarray(instance.productWeights)
+    warehouseLocations = np.asarray(instance.warehouseLocations)
+    customerLocations = np.asarray(instance.customerLocations)
+    nProducts = len(instance.productWeights)
+    nWarehouses = len(instance.warehouseLocations)
+    nCustomers = len(instance.customerLocations)
+    violations: List[Tuple[int, int, str]] = []     # (turn, command, message)
+    drone, kind, target, product, nItems = np.ascontiguousarray(commands.T)     # Column vectors
+    if nCommands == 0:
+        return ScoreReport(0, 0, 0)
+
+    ## Malformed commands
+    malformed = (drone < 0) | (drone >= instance.nDrones) | (kind < 0) | (kind > CommandWait)
+    isWait = kind == CommandWait
+    isWarehouse = (kind == CommandLoad) | (kind == CommandUnload)
+    isDeliver = kind == CommandDeliver
+    malformed |= isWait & (target < 0)
+    malformed |= isWarehouse & ((target < 0) | (target >= nWarehouses))
+    malformed |= isDeliver & ((target < 0) | (target >= nCustomers))
+    malformed |= ~isWait & ((product < 0) | (product >= nProducts) | (nItems <= 0))
+    if malformed.any():
+        i = int(np.argmax(malformed))
+        return ScoreReport(0, 0, nCommands, Violation(0, i, "Malformed command"))
+
+    ## Drone timelines - commands of each drone are executed one after the other
+    order = np.argsort(drone.astype(np.int16) if instance.nDrones < 2 ** 15 else drone, kind='stable')
+    sDrone, sWait = drone[order], isWait[order]
+    start = _segmentStarts(sDrone)
+    sites = np.concatenate((warehouseLocations, customerLocations))    # Warehouses followed by customers
+    site = np.where(isDeliver, target + nWarehouses, np.where(isWait, 0, target))[order]
+    positions = np.arange(nCommands)
+    lastMove = np.maximum.accumulate(np.where(~sWait, positions, -1))   # Last command that moved the drone
+    previous = np.empty(nCommands, dtype=np.int64)
+    previous[0] = -1
+    previous[1:] = lastMove[:-1]
+    segmentFirst = np.maximum.accumulate(np.where(start, positions, 0))
+    atStart = previous < segmentFirst       # No earlier move of the same drone - drone is at the first warehouse
+    origin = np.where(atStart, 0, site[np.maximum(previous, 0)])
+    dx = sites[site, 0] - sites[origin, 0]
+    dy = sites[site, 1] - sites[origin, 1]
+    dist = np.ceil(np.sqrt(dx * dx + dy * dy)).astype(np.int64)
+    durations = np.where(sWait, target[order], dist + 1)
+    turns = np.empty(nCommands, dtype=np.int64)
+    turns[order] = _segmentedCumsum(durations, start) - 1     # Turn in which each command completes
+    late = np.flatnonzero(turns >= instance.nTurns)
+    if len(late):
+        i = _first(late, turns)
+        violations.append((int(turns[i]), i, "Command completes after the last turn"))
+
+    ## Drone payload
+    weights = productWeights[product] * nItems * np.where(kind == CommandLoad, 1, -1) * ~isWait
+    payload = _segmentedCumsum(weights[order], start)
+    overweight = np.flatnonzero(payload > instance.maxPayload)
+    if len(overweight):
+        i = _first(order[overweight], turns)
+        violations.append((int(turns[i]), i, "Drone payload exceeds maximal payload"))
+
+    ## Drone inventory of each product can not become negative
+    items = ~isWait
+    index = np.flatnonzero(items)
+    keys = drone[index] * nProducts + product[index]
+    byKey = np.argsort(keys, kind='stable')
+    deltas = (nItems * np.where(kind == CommandLoad, 1, -1))[index][byKey]
+    held = _segmentedCumsum(deltas, _segmentStarts(keys[byKey]))
+    negative = np.flatnonzero(held < 0)
+    if len(negative):
+        i = _first(index[byKey][negative], turns)
+        violations.append((int(turns[i]), i, "Drone does not carry the products it unloads/delivers"))
+
+    ## Warehouse stock - by turn, where loads of the same turn are taken before unloads are added
+    index = np.flatnonzero(isWarehouse)
+    keys = target[index] * nProducts + product[index]
+    byKey = np.argsort((keys * (instance.nTurns + 1) + turns[index]) * 2 + kind[index])
+    keys = keys[byKey]
+    deltas = (nItems * np.where(kind == CommandLoad, -1, 1))[index][byKey]
+    stock = _segmentedCumsum(deltas, _segmentStarts(keys)) + np.asarray(instance.stock).ravel()[keys]
+    negative = np.flatnonzero(stock < 0)
+    if len(negative):
+        i = _first(index[byKey][negative], turns)
+        violations.append((int(turns[i]), i, "Warehouse does not have the products to load"))
+
+    ## Deliveries can not exceed customer orders
+    demandCustomers = np.repeat(np.arange(nCustomers), np.diff(instance.orderOffsets))
+    demandKeys, demand = np.unique(demandCustomers * nProducts + instance.orderItems, return_counts=True)
+    index = np.flatnonzero(isDeliver)
+    keys = target[index] * nProducts + product[index]
+    byKey = np.argsort(keys * (instance.nTurns + 1) + turns[index])
+    keys = keys[byKey]
+    delivered = _segmentedCumsum(nItems[index][byKey], _segmentStarts(keys))
+    position = np.minimum(np.searchsorted(demandKeys, keys), len(demandKeys) - 1)
+    ordered = np.where(demandKeys[position] == keys, demand[position], 0)
+    excess = np.flatnonzero(delivered > ordered)
+    if len(excess):
+        i = _first(index[byKey][excess], turns)
+        violations.append((int(turns[i]), i, "Delivery exceeds customer order"))
+
+    if violations:
+        turn, i, message = min(violations)
+        return ScoreReport(0, 0, nCommands, Violation(turn, i, message))
+
+    ## Scoring - an order is complete once all its items are delivered
+    deliveredTotal = np.zeros(len(demandKeys), dtype=np.int64)
+    np.add.at(deliveredTotal, position, np.where(demandKeys[position] == keys, nItems[index][byKey], 0))
+    missing = np.zeros(nCustomers, dtype=np.int64)
+    np.add.at(missing, demandKeys // nProducts, demand - deliveredTotal)
+    completionTurn = np.full(nCustomers, -1, dtype=np.int64)
+    np.maximum.at(completionTurn, target[index], turns[index])
+    complete = (missing == 0) & (completionTurn >= 0)
+    nTurns = instance.nTurns
+    score = int(np.sum(-((completionTurn[complete] - nTurns) * 100 // nTurns)))    # ceil((T - t) / T * 100)
+    return ScoreReport(score, int(complete.sum()), nCommands)
+
+def score(inputFilename: str, commandFilename: str) -> ScoreReport:
+    """
+    Check and score a command file
+    :param inputFilename:   Problem input file
+    :param commandFilename: Command file
+    :return:
+    """
+    with open(commandFilename, 'rb') as f:
+        commands = parseCommands(f.read())
+    return scoreCommands(ProblemInstance.load(inputFilename), commands)
+
+class TestScorer(unittest.TestCase):
+    def setUp(self):
+        self.instance = ProblemInstance.read('SmallInput.dat')
+
+    def __score(self, lines: List[str]) -> ScoreReport:
+        return scoreCommands(self.instance, parseCommands(('\n'.join([str(len(lines))] + lines) + '\n').encode()))
+
+    def test_simulation_commands(self):
+        from Simulations import createSimulation
+        for model, param in [('Model0', ''), ('Model2', ''), ('Model3', ''), ('Model3', 'Batched')]:
+            sim = createSimulation(model, param, 'SmallInput.dat')
+            sim.runEventDriven()
+            with tempfile.TemporaryDirectory() as directory:
+                commandFilename = os.path.join(directory, 'output.dat')
+                sim.writeCommands(commandFilename)
+                report = score('SmallInput.dat', commandFilename)
+            self.assertIsNone(report.violation)
+            self.assertGreaterEqual(report.score, sim._points)     # Simulation leaves idle turns between missions
+
+    def test_score(self):
+        # Customer 1 (at (3, 3)) orders one item of product 0. Drone loads at warehouse 0 in turn 0, flies 5 turns
+        # and delivers in turn 6
+        report = self.__score(['0 L 0 0 1', '0 D 1 0 1'])
+        self.assertIsNone(report.violation)
+        self.assertEqual(report.completedOrders, 1)
+        self.assertEqual(report.score, int(np.ceil((50 - 6) / 50 * 100)))
+        report = self.__score(['1 L 0 0 1', '1 W 3', '1 D 1 0 1'])
+        self.assertEqual(report.score, int(np.ceil((50 - 9) / 50 * 100)))
+
+    def test_violations(self):
+        self.assertEqual(self.__score(['0 L 0 1 2']).violation.message, "Warehouse does not have the products to load")
+        self.assertEqual(self.__score(['0 L 0 2 2']).violation.message, "Drone payload exceeds maximal payload")
+        self.assertEqual(self.__score(['0 D 1 0 1']).violation.message,
+                         "Drone does not carry the products it unloads/delivers")
+        self.assertEqual(self.__score(['0 L 0 0 2', '0 D 1 0 2']).violation.message, "Delivery exceeds customer order")
+        self.assertEqual(self.__score(['0 W 60']).violation.message, "Command completes after the last turn")
+        self.assertEqual(self.__score(['5 W 1']).violation.message, "Malformed command")
+        self.assertEqual(self.__score(['0 W 1', '0 L 0 0 1', '1 L 0 0 5']).violation.command, 1)   # Stock taken by
+                                                                                                # drone 1 in turn 0
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:      # Score a command file: Scorer.py <input file> <command file>
+        report = score(sys.argv[1], sys.argv[2])
+        print(report)
+        sys.exit(0 if report.violation is None else 1)
+    unittest.main()
@@ -1,15 +1,30 @@
 import unittest
-from Parser import Parser
+from Parser import Parser, ProblemInstance
 from Delivery import Delivery, MissionType
-from Drone import Drone, DroneStatus
-from typing import List, Dict, Set, Tuple
+from Drone import Drone, DroneFleet, DroneStatus
+from typing import Callable, List, Dict, Set, Tuple, TypeVar
 from OrderInventory import Order, Inventory
 from WarehouseCustomer import Warehouse, Customer
 from Definitions import distance, Products
+from Distances import DistanceTable
+from SpatialIndex import SpatialIndex
+from StockIndex import StockIndex
+from LoadOptimizer import optimizeLoad
+from CustomerQueue import CustomerQueue
+from TripSearch import Trip, TripSearch
+from Instrumentation import Instrumentation
 import numpy as np
-from itertools import cycle
+from itertools import chain, cycle, islice
 from enum import Enum, auto
-import copy
+import heapq
+import bisect
+import os
+import pickle
+import random
+import tempfile
+import time as timer
+
+Candidate = TypeVar('Candidate')
 
 class SimulationPrintouts(Enum):
     Nothing = auto()
@@ -17,50 +32,314 @@ class SimulationPrintouts(Enum):
     Progress = auto()
 
 class Simulations:
-    def __init__(self, inputFilename):
-        self.params = Parser(inputFilename)
+    def __init__(self, inputFilename, instance: ProblemInstance = None):
+        self.params = Parser(inputFilename, instance = instance)
+        self._distances = DistanceTable([warehouse.location() for warehouse in self.params.warehouses],
+                                        [customer.location() for customer in self.params.customers])
+        self._maxDistance = distance((0, 0), (self.params.nRows, self.params.nColumns))
+        self._warehouseIndex = SpatialIndex([warehouse.location() for warehouse in self.params.warehouses])
+        self._customerIndex = SpatialIndex([customer.location() for customer in self.params.customers])
+        self._customersByIndex: List[Customer] = list(self.params.customers)   # Not filtered nor sorted
+        self._stockIndex = StockIndex(self.params.warehouses, self._distances, len(self.params.products))
+        self._fleet = DroneFleet(self.params.nDrones, len(self.params.products))
         self.drones: List[Drone] = []
         for i in range(self.params.nDrones):
-            self.drones.append(
-                Drone(self.params.warehouses[0].location(), self.params.maxPayload, Inventory(), index = i))
+            self.drones.append(Drone(self.params.warehouses[0].location(), self.params.maxPayload, Inventory(),
+                                     index = i, distances = self._distances, fleet = self._fleet))
         self._points = 0
+        self._time = 0      # Current turn
         self._completedOrders: Set[Customer] = set()
+        self._nIncompleteOrders = 0
+        self._completedInTurn = False   # Whether any order was completed in the current turn
+        for customer in self.params.customers:
+            customer.onComplete = self._orderCompleted
+            if not customer.isComplete():
+                self._nIncompleteOrders += 1
         self._d = Delivery()
-
-    def run(self, printouts = SimulationPrintouts.Nothing) -> None:
+        self._service: Dict[Drone, Warehouse] = {}      # Warehouse each drone loads from, in its planned missions
+        self._missionPlan: Dict[Drone, List[DroneMission]] = {}    # Planned missions of each drone (see _planTrip())
+        self._degraded = False      # Whether planning should be cheaper, to keep within the time budget (see run())
+        self.phaseTimes: Dict[str, float] = {}      # Wall clock time of each phase of the last run, in seconds
+        self.degradedTurns = 0      # Number of turns planned in degraded mode, in the last run
+        self.exhaustedTurn: int = None      # Turn in which the time budget was exhausted, in the last run
+        self._rng: random.Random = None     # Random generator of randomized greedy choices (see randomize())
+        self._topK = 1
+        self.earlyStop: Callable[[int], bool] = None    # Called at the end of each processed turn - the run stops if
+                                                        # it returns True (e.g., see scoreUpperBound())
+        self.printInterval = 1.     # Minimal wall clock time between progress printouts, in seconds
+        self.__lastPrint = -np.inf
+        self.__instrumentation: Instrumentation = None
+
+    def run(self, printouts = SimulationPrintouts.Nothing, checkpointFilename: str = None,
+            checkpointInterval: int = 10000, timeBudget: float = None,
+            instrumentation: Instrumentation = None) -> None:
+        """
+        Run the simulation, turn by turn
+        :param printouts:           Printouts level
+        :param checkpointFilename:  If given, a checkpoint is written to this file every checkpoint interval (see
+                                    resumeSimulation())
+        :param checkpointInterval:  Number of turns between checkpoints
+        :param timeBudget:          Wall clock budget of the run, in seconds. Unlimited if not given. A run that uses
+                                    more than its share of the budget for the turns simulated so far (with a margin)
+                                    plans in degraded mode - models prune their candidates harder. Once the budget is
+                                    exhausted, no new trips are planned, and drones only complete the missions they were
+                                    already given or planned. Time used by each phase is kept in phaseTimes
+        :param instrumentation:     If given, hot path methods are counted and timed during the run (see
+                                    Instrumentation)
+        :return:
+        """
         self._points = 0
+        self.__setCheckpoints(checkpointFilename, checkpointInterval)
+        self.__setTimeBudget(timeBudget)
+        start = timer.perf_counter()
         self._timeStepZero()        # Model specific initialization (zero time step)
+        self.phaseTimes['initialization'] += timer.perf_counter() - start
+        self.__attach(instrumentation)
+        try:
+            self.__runTurns(0, printouts)
+        finally:
+            self.__detach()
+
+    def __runTurns(self, start: int, printouts: SimulationPrintouts) -> None:
 
         ### Main loop over time steps
-        for time in range(self.params.nTurns):
+        for time in range(start, self.params.nTurns):
+            if time >= self.__nextCheckpoint:
+                self.__saveCheckpoint(('run', time))
+            self._time = time
+            if self.__instrumentation is not None:
+                self.__instrumentation.beginTurn(time)
 
             ## Model specific time step
-            self._timeStep(time)
+            self.__planTurn(time)
 
             ## Sample all drone for current time
+            phaseStart = timer.perf_counter()
             for drone in self.drones:
                 if self._d.isInMission(drone):
                     self._d.sampleDrone(drone, time)
 
-            ## Update scoring
-            for customer in self.params.customers:
-                if customer.isComplete():
-                    self._points += self._score(time)
-                    self._completedOrders.add(customer)     # Register completed order, to not count them again
+            ## Scoring and printouts
+            self._endOfTurn(time, printouts)
+            self.phaseTimes['execution'] += timer.perf_counter() - phaseStart
 
-            # Removing completed customers
-            self.params.customers[:] = [x for x in self.params.customers if not x.isComplete()]
+            # Return if all orders completed, or if nothing is left to do after the time budget was exhausted
+            if self._allOrdersCompleted() or (self.earlyStop is not None and self.earlyStop(time)):
+                return
+            if self.exhaustedTurn is not None and not self._missionPlan and \
+                    not any(self._d.isInMission(drone) for drone in self.drones):
+                return
+
+    def runEventDriven(self, printouts = SimulationPrintouts.Nothing, checkpointFilename: str = None,
+                       checkpointInterval: int = 10000, timeBudget: float = None,
+                       instrumentation: Instrumentation = None) -> None:
+        """
+        An alternative to run(), which produces the same commands. Instead of stepping through every turn, the
+        simulation jumps between turns in which a drone completes its current task, or in which an idle drone may be
+        given a new mission
+        :param printouts:           Printouts level. Printouts are issued only at processed turns
+        :param checkpointFilename:  If given, a checkpoint is written to this file every checkpoint interval, before
+                                    the first processed turn of the interval (see resumeSimulation())
+        :param checkpointInterval:  Number of turns between checkpoints
+        :param timeBudget:          Wall clock budget of the run, in seconds (see run())
+        :param instrumentation:     If given, hot path methods are counted and timed during the run (see run())
+        :return:
+        """
+        self._points = 0
+        self.__setCheckpoints(checkpointFilename, checkpointInterval)
+        self.__setTimeBudget(timeBudget)
+        self._d.sampleEveryStep = False     # Drones are sampled only when their current task completes
+        start = timer.perf_counter()
+        self._timeStepZero()        # Model specific initialization (zero time step)
+        self.phaseTimes['initialization'] += timer.perf_counter() - start
+        self.__attach(instrumentation)
+        try:
+            self.__runEvents([(0, -1)], -1, printouts)
+        finally:
+            self.__detach()
+
+    def __runEvents(self, events: List[Tuple[int, int]], time: int, printouts: SimulationPrintouts) -> None:
+        """
+        Main loop of runEventDriven()
+        :param events:      Priority queue of (completion time, drone index)
+        :param time:        Last processed turn
+        :param printouts:   Printouts level
+        :return:
+        """
+        while events:
+            if self.__nextCheckpoint <= events[0][0] < self.params.nTurns:
+                self.__saveCheckpoint(('runEventDriven', events, time))
+            nextTime = heapq.heappop(events)[0]
+            if nextTime <= time:        # Event of a turn that was already processed
+                continue
+            time = nextTime
+            if time >= self.params.nTurns:
+                return
+            self._time = time
+            if self.__instrumentation is not None:
+                self.__instrumentation.beginTurn(time)
+
+            ## Model specific time step
+            self.__planTurn(time)
+
+            ## Sample drones that start a new mission, or whose current task completes at this turn
+            phaseStart = timer.perf_counter()
+            active = False
+            for i in np.flatnonzero(self._fleet.ready(time)).tolist():
+                drone = self.drones[i]
+                if not self._d.isInMission(drone):
+                    continue
+                self._d.sampleDrone(drone, time)
+                active = True
+                if self._d.isInMission(drone):
+                    heapq.heappush(events, (drone.task.time + drone.task.duration, i))
 
-            ## Printouts
-            if printouts == SimulationPrintouts.Inventories:
-                self._printInventories(time)
-            elif printouts == SimulationPrintouts.Progress:
-                self._printProgress(time)
+            ## Scoring and printouts
+            self._endOfTurn(time, printouts)
+            self.phaseTimes['execution'] += timer.perf_counter() - phaseStart
 
             # Return if all orders completed
-            if self._allOrdersCompleted():
+            if self._allOrdersCompleted() or (self.earlyStop is not None and self.earlyStop(time)):
                 return
 
+            # Idle drones are given a chance to plan in the next turn, if anything changed in the current one
+            if active and any(not self._d.isInMission(drone) for drone in self.drones):
+                heapq.heappush(events, (time + 1, -1))
+
+    def __setCheckpoints(self, checkpointFilename: str, checkpointInterval: int) -> None:
+        if checkpointFilename is not None and checkpointInterval <= 0:
+            raise RuntimeError("Checkpoint interval should be positive")
+        self.__checkpointFilename = checkpointFilename
+        self.__checkpointInterval = checkpointInterval
+        self.__nextCheckpoint = checkpointInterval if checkpointFilename is not None else np.inf
+        self.__loopState = None
+
+    def __attach(self, instrumentation: Instrumentation) -> None:
+        self.__instrumentation = instrumentation
+        if instrumentation is not None:
+            instrumentation.attach(self)
+
+    def __detach(self) -> None:
+        if self.__instrumentation is not None:
+            self.__instrumentation.detach(self._time)
+            self.__instrumentation = None
+
+    def __setTimeBudget(self, timeBudget: float) -> None:
+        if timeBudget is not None and timeBudget < 0:
+            raise RuntimeError("Time budget should not be negative")
+        self.__timeBudget = timeBudget
+        self.phaseTimes = {'initialization': 0., 'planning': 0., 'execution': 0., 'checkpoints': 0.}
+        self.degradedTurns = 0
+        self.exhaustedTurn = None
+        self._degraded = False
+
+    def __planTurn(self, time: int) -> None:
+        """
+        Model specific time step, within the time budget. The elapsed time is the sum of the phase times, so that a
+        run resumed from a checkpoint keeps the budget of the original run
+        :param time:    Current time
+        :return:
+        """
+        start = timer.perf_counter()
+        if self.__timeBudget is not None and self.exhaustedTurn is None:
+            elapsed = sum(self.phaseTimes.values())
+            if elapsed >= self.__timeBudget:
+                self.exhaustedTurn = time
+            self._degraded = elapsed > self.__timeBudget * min(time / self.params.nTurns + 0.1, 1.)
+        if self.exhaustedTurn is not None:
+            self._continuePlans(time)
+        else:
+            self.degradedTurns += self._degraded
+            self._timeStep(time)
+        self.phaseTimes['planning'] += timer.perf_counter() - start
+
+    def _continuePlans(self, time: int) -> None:
+        """
+        Time step after the time budget is exhausted - idle drones are given the next missions of their planned trips
+        (see _planTrip()), and no new trips are planned
+        :param time:    Current time
+        :return:
+        """
+        for drone in self.drones:
+            if not self._d.isInMission(drone) and drone in self._missionPlan:
+                self._setNextDroneMission(drone, time)
+
+    def __saveCheckpoint(self, loopState: Tuple) -> None:
+        """
+        Write the whole simulation to the checkpoint file, at the start of a turn. The file is replaced atomically by a
+        uniquely named temporary file, so a crash while writing leaves the previous checkpoint intact
+        :param loopState:   Main loop state to resume from - ('run', turn) or ('runEventDriven', events, last turn)
+        :return:
+        """
+        start = timer.perf_counter()
+        self.__loopState = loopState
+        turn = loopState[1] if loopState[0] == 'run' else loopState[1][0][0]
+        self.__nextCheckpoint = (turn // self.__checkpointInterval + 1) * self.__checkpointInterval
+        fd, tmpFilename = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(self.__checkpointFilename) or '.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(self, f, protocol = pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpFilename, self.__checkpointFilename)
+        except BaseException:
+            try:
+                os.remove(tmpFilename)
+            except OSError:
+                pass
+            raise
+        finally:
+            self.__loopState = None
+        self.phaseTimes['checkpoints'] += timer.perf_counter() - start
+
+    def _resume(self, printouts: SimulationPrintouts) -> None:
+        """
+        Continue the main loop of a simulation loaded from a checkpoint
+        :param printouts:   Printouts level
+        :return:
+        """
+        if self.__loopState is None:
+            raise RuntimeError("Simulation was not loaded from a checkpoint")
+        loopState = self.__loopState
+        self.__loopState = None
+        try:
+            if loopState[0] == 'run':
+                self.__runTurns(loopState[1], printouts)
+            else:
+                self.__runEvents(loopState[1], loopState[2], printouts)
+        finally:
+            self.__detach()     # Instrumentation of the original run, if any
+
+    def _endOfTurn(self, time: int, printouts: SimulationPrintouts) -> None:
+        """
+        Remove completed customers (scoring is done on completion - see _orderCompleted) and print the turn summary
+        :param time:        Current time
+        :param printouts:   Printouts level
+        :return:
+        """
+
+        # Removing completed customers
+        if self._completedInTurn:
+            self.params.customers[:] = [x for x in self.params.customers if not x.isComplete()]
+            self._completedInTurn = False
+
+        ## Printouts. Progress is printed at most once in a print interval
+        if printouts == SimulationPrintouts.Inventories:
+            self._printInventories(time)
+        elif printouts == SimulationPrintouts.Progress and timer.perf_counter() - self.__lastPrint >= self.printInterval:
+            self.__lastPrint = timer.perf_counter()
+            self._printProgress(time)
+
+    def _orderCompleted(self, customer: Customer) -> None:
+        """
+        Called by a customer, when its order is completed. Updates scoring
+        :param customer:    The customer
+        :return:
+        """
+        self._points += self._score(self._time)
+        self._completedOrders.add(customer)
+        self._nIncompleteOrders -= 1
+        self._completedInTurn = True
+        self._customerIndex.remove(customer.index())
+
     def _orderWeightOriginal(self) -> Dict[Customer, float]:
         orderWeights: Dict[Customer, int] = {}
         for customer in self.params.customers:
@@ -98,38 +377,59 @@ class Simulations:
     def _printProgress(self, time: int) -> None:
 
         # Drone operations
-        nDronesIdle = 0
-        nDronesTraveling = 0
-        nDronesLoading = 0
-        nDronesUnloading = 0
-        averageDroneWeight = 0
-        for drone in self.drones:
-            averageDroneWeight += drone.inventory(time).weight()
-            if drone.task.status == DroneStatus.Traveling:
-                nDronesTraveling += 1
-            elif drone.task.status == DroneStatus.Load:
-                nDronesLoading += 1
-            elif drone.task.status == DroneStatus.Unload:
-                nDronesUnloading += 1
-            else:
-                nDronesIdle += 1
-        averageDroneWeight /= len(self.drones)
+        self._fleet.refresh(time)
+        statusCounts = self._fleet.statusCounts()
+        averageDroneWeight = self._fleet.payloads.mean()
 
         print("Time: " + str(time) + "/" + str(self.params.nTurns) + 
               ": Completed orders: " + str(len(self._completedOrders)) + "/" + str(self.params.nOrders),
               " Drones (Idle, Traveling, Loading, Unloading): " +
-              str(nDronesIdle), str(nDronesTraveling), str(nDronesLoading), str(nDronesUnloading),
+              str(statusCounts[DroneStatus.Idle.value]), str(statusCounts[DroneStatus.Traveling.value]),
+              str(statusCounts[DroneStatus.Load.value]), str(statusCounts[DroneStatus.Unload.value]),
               " Ave. drone weight: ", str(averageDroneWeight),
               " Points: ", str(self._points))
 
     def _score(self, time) -> int:
             return np.ceil((self.params.nTurns - time) / self.params.nTurns * 100)
 
+    def scoreUpperBound(self, time: int) -> float:
+        """
+        Upper bound of the final score, at the end of a turn - as if all incomplete orders were completed in the next
+        turn
+        :param time:    Current time
+        :return:
+        """
+        return self._points + self._nIncompleteOrders * self._score(time + 1)
+
+    def randomize(self, seed: int, topK: int = 3) -> None:
+        """
+        Randomize the greedy choices of the model (Model3 and Model4) - instead of the best candidate, one of the topK
+        best candidates is picked, with ties to the last of them. Should be called before the run
+        :param seed:    Random seed
+        :param topK:    Number of best candidates to pick from
+        :return:
+        """
+        if topK < 1:
+            raise RuntimeError("Number of candidates to pick from should be positive")
+        self._rng = random.Random(seed)
+        self._topK = topK
+
+    def _pickCandidate(self, candidates: List[Tuple[float, Candidate]]) -> Candidate:
+        """
+        Pick one of the candidates of a greedy choice. The first candidate is picked, unless the model is randomized
+        (see randomize())
+        :param candidates:  Non empty list of (cost, candidate), sorted by cost (lowest first). Should include the topK
+                            first candidates, and the candidates tied with them
+        :return:
+        """
+        if self._rng is None:
+            return candidates[0][1]
+        cost = candidates[min(self._topK, len(candidates)) - 1][0]
+        n = bisect.bisect_right([c for c, candidate in candidates], cost)
+        return candidates[self._rng.randrange(n)][1]
+
     def _allOrdersCompleted(self) -> bool:
-        for customer in self.params.customers:
-            if not customer.isComplete():
-                return False
-        return True
+        return self._nIncompleteOrders == 0
 
     def _closestServingWarehouse(self, customer: Customer) -> Tuple[Warehouse, Inventory]:
         """
@@ -138,22 +438,57 @@ class Simulations:
         :return:
         """
 
-        ## Find minimal distance between customer and warehouse that can serve
+        ## Find the closest warehouse that has any of the customer remaining products
         order = customer.getProductsMinusBookings()
-        warehouses = self.params.warehouses
-        minDist = distance((0, 0), (self.params.nRows, self.params.nColumns))
-        closestWarehouse = warehouses[0]
-        closestAvailableOrder = Inventory()
-        for warehouse in warehouses:
-            availableOrder = warehouse.createAvailableOrder(order)  # What can the warehouse offer to the customer?
-            if availableOrder.empty():  # If nothing, ignore this warehouse
-                continue
-            d = distance(warehouse.location(), customer.location())
-            if d < minDist:
-                minDist = d
-                closestWarehouse = warehouse
-                closestAvailableOrder = availableOrder
-        return closestWarehouse, closestAvailableOrder
+        for w in self._stockIndex.servingWarehouses(customer.index(), order):
+            closestWarehouse = self.params.warehouses[w]
+            return closestWarehouse, closestWarehouse.createAvailableOrder(order)
+        return self.params.warehouses[0], Inventory()
+
+    def _warehouseServes(self, w: int, i: int) -> bool:
+        """
+        Whether a warehouse can offer any product to an incomplete customer (considering bookings)
+        :param w:   Warehouse index
+        :param i:   Customer index
+        :return:
+        """
+        customer = self._customersByIndex[i]
+        return not customer.isComplete(True) and \
+            any(w in self._stockIndex.warehousesStocking(product) for product in customer.getProductsMinusBookings())
+
+    def _planTrip(self, drone: Drone, warehouse: Warehouse, warehouseOrder: Inventory, customers: List[Customer],
+                  customerOrders: List[Inventory]) -> None:
+        """
+        Book a trip, and plan its missions - loading from a warehouse, followed by deliveries to customers. Missions are
+        set one after the other, by _setNextDroneMission()
+        :param drone:           The drone
+        :param warehouse:       Warehouse to load from
+        :param warehouseOrder:  Products to load
+        :param customers:       Customers to deliver to
+        :param customerOrders:  Products to deliver to each customer
+        :return:
+        """
+        warehouse.book(warehouseOrder)
+        self._service[drone] = warehouse
+        self._missionPlan[drone] = [DroneMission(MissionType.Load, warehouseOrder)]
+        for (customer, customerOrder) in zip(customers, customerOrders):
+            customer.book(customerOrder)
+            self._missionPlan[drone].append(DroneMission(MissionType.Deliver, customerOrder, customer = customer))
+
+    def _setNextDroneMission(self, drone: Drone, time: int) -> None:
+        missionType = self._missionPlan[drone][0].missionType
+        products = self._missionPlan[drone][0].products
+
+        # Set relevant mission. Don't book, because booking was already set during mission planning
+        if missionType == MissionType.Load:
+            warehouse = self._service[drone]
+            self._d.setLoadMission(drone, warehouse, products, time, book = False)
+        elif missionType == MissionType.Deliver:
+            customer = self._missionPlan[drone][0].customer
+            self._d.setDeliverMission(drone, customer, products, time, book = False)
+        self._missionPlan[drone].pop(0)   # Pop the mission that was set
+        if len(self._missionPlan[drone]) == 0:
+            del self._missionPlan[drone]
 
     def writeCommands(self, outputFilename: str) -> None:
         f = open(outputFilename, 'w')
@@ -165,76 +500,44 @@ class Simulations:
 
     def _maximalPossibleLoad(self, drone: Drone, order: Order, time: int) -> Inventory:
         """
-        Find an order which is a subset of a given order, which fits a drone maximal capacity constraint
+        Find an order which is a subset of a given order, which fits a drone maximal capacity constraint. The fullest
+        such order is found (see LoadOptimizer)
         :param drone:   Input drone
         :param order:   Order of which a weight limited order should be created
         :return:
         """
-        if order.empty():
-            return Inventory()
-        products: Products = []     # A list of product in the order - expansion of order to single repeating items
-        for product in order:
-            for i in range(order[product]):
-                products.append(product)
-        products.sort(key=lambda product: product.weight, reverse=True)     # Sort product form the heaviest first
-        w = drone.inventory(time).weight()
-        maxWeight = drone.maxWeight
-        maxOrder = Inventory()
-        i = 0
-        for product in products:        # Try to load the heaviest first
-            if w + product.weight > maxWeight:
-                break
-            maxOrder.append(product, 1)
-            w += product.weight
-            i += 1
-        del products[:i + 1]        # Delete heaviest products that cannot be added to the drone
-        for product in reversed(products):  # Try and add lighter products, if there is room in the drone
-            if w + product.weight > maxWeight:
-                break
-            maxOrder.append(product, 1)
-            w += product.weight
-        return maxOrder
+        return optimizeLoad(order, drone.maxWeight - drone.weight(time))
 
-    def _customerWarehouseDistances(self) -> Dict[Tuple[Warehouse, Customer], int]:
+    def _customerWarehouseDistances(self) -> np.ndarray:
         """
-        Calculates all distances between warehouses and customers
-        :return:
+        Distances between all warehouses and customers
+        :return: Matrix of distances (warehouse index x customer index)
         """
-        dist: Dict[Tuple[Warehouse, Customer], int] = {}
-        for warehouse in self.params.warehouses:
-            for customer in self.params.customers:
-                dist[(warehouse, customer)] = distance(warehouse.location(), customer.location())
-        return dist
+        return self._distances.warehouseCustomer
 
-    def _customerWarehouseDistances2(self) -> Dict[Tuple[Warehouse, Customer], int]:
+    def _customerWarehouseDistances2(self) -> np.ndarray:
         """
-        Calculates all distances between warehouses and customers
-        :return:
+        Squared distances between all warehouses and customers
+        :return: Matrix of squared distances (warehouse index x customer index)
         """
-        dist: Dict[Tuple[Warehouse, Customer], int] = {}
-        for warehouse in self.params.warehouses:
-            for customer in self.params.customers:
-                d = distance(warehouse.location(), customer.location())
-                dist[(warehouse, customer)] = d * d
-        return dist
+        dist = self._distances.warehouseCustomer.astype(np.int64)
+        return dist * dist
 
-    def _weightedCustomerWarehouseDistances(self) -> Dict[Tuple[Warehouse, Customer], int]:
+    def _weightedCustomerWarehouseDistances(self) -> np.ndarray:
         """
         Calculates all distances between warehouses and customers, weighted by the total weight of customer initial
         orders. Affects heaviers customer to be served first
-        :return:
+        :return: Matrix of weighted distances (warehouse index x customer index)
 
         """
-        dist: Dict[Tuple[Warehouse, Customer], int] = {}
-        for warehouse in self.params.warehouses:
-            for customer in self.params.customers:
-                dist[(warehouse, customer)] = distance(warehouse.location(), customer.location()) * \
-                                              customer.order().weight()
-        return dist
+        weights = np.zeros(len(self._distances.customerLocations), dtype=np.int64)
+        for customer in self.params.customers:
+            weights[customer.index()] = customer.order().weight()
+        return self._distances.warehouseCustomer * weights
 
 class Model0(Simulations):
-    def __init__(self, inputFilename):
-        super().__init__(inputFilename)
+    def __init__(self, inputFilename, instance: ProblemInstance = None):
+        super().__init__(inputFilename, instance)
         self.__service: Dict[Drone, List[Customer]] = {}   # A list of customers each drone services
 
     def _timeStepZero(self) -> None:
@@ -282,8 +585,8 @@ class Model0(Simulations):
         return Customer()
 
 class Model1(Simulations):
-    def __init__(self, inputFilename):
-        super().__init__(inputFilename)
+    def __init__(self, inputFilename, instance: ProblemInstance = None):
+        super().__init__(inputFilename, instance)
 
     def _timeStepZero(self) -> None:
         pass
@@ -301,7 +604,7 @@ class Model1(Simulations):
                 continue
 
             # Find the warehouse that has most of what the customer needs
-            warehouse, availableOrder = self.__mostSuitableWarehouse(drone, lighestCustomer)
+            warehouse, availableOrder = self.__mostSuitableWarehouse(drone, lighestCustomer, time)
 
             # Load and deliver between chosen warehouse and customer
             self._d.setLoadAndDeliverMission(drone, warehouse, lighestCustomer, availableOrder, time)
@@ -318,32 +621,34 @@ class Model1(Simulations):
                 lighestCustomer = customer
         return lighestCustomer
 
-    def __mostSuitableWarehouse(self, drone: Drone, customer: Customer) -> Tuple[Warehouse, Inventory]:
+    def __mostSuitableWarehouse(self, drone: Drone, customer: Customer, time: int) -> Tuple[Warehouse, Inventory]:
         maxWeight: int = 0
-        minDist = distance((0, 0), (self.params.nRows, self.params.nColumns))
+        dists = self._distances.warehouseCustomer[:, customer.index()].tolist()
+        minDist = self._maxDistance
         bestWarehouse = Warehouse()
         bestAvailableOrder = Inventory()
-        for warehouse in self.params.warehouses:
-            customerRemainingOrder = customer.getProductsMinusBookings()
+        customerRemainingOrder = customer.getProductsMinusBookings()
+        for w in self._stockIndex.servingWarehouses(customer.index(), customerRemainingOrder):    # Closest first
+            warehouse = self.params.warehouses[w]
+            d = dists[w]
+            if d > minDist:
+                break
             availableOrder = warehouse.createAvailableOrder(customerRemainingOrder)
-            if availableOrder.empty():
-                continue
-            availableOrder = self._maximalPossibleLoad(drone, availableOrder)
-            d = distance(warehouse.location(), customer.location())
+            availableOrder = self._maximalPossibleLoad(drone, availableOrder, time)
             if d < minDist:
                 maxWeight = 0
                 minDist = d
                 bestWarehouse = warehouse
                 bestAvailableOrder = availableOrder
-            elif d == minDist and availableOrder.weight() > maxWeight:
+            elif availableOrder.weight() > maxWeight:
                 maxWeight = availableOrder.weight()
                 bestWarehouse = warehouse
                 bestAvailableOrder = availableOrder
         return bestWarehouse, bestAvailableOrder
 
 class Model2(Simulations):
-    def __init__(self, inputFilename):
-        super().__init__(inputFilename)
+    def __init__(self, inputFilename, instance: ProblemInstance = None):
+        super().__init__(inputFilename, instance)
 
     def _timeStepZero(self) -> None:
         pass
@@ -364,35 +669,44 @@ class Model2(Simulations):
             self._d.setLoadAndDeliverMission(drone, warehouse, customer, products, time)
 
     def __findOptimalCustomerWarehouse(self, drone: Drone, time: int) -> Tuple[Warehouse, Customer, Inventory]:
-        minDist = distance((0, 0), (self.params.nRows, self.params.nColumns))   # Minimal distance of customer to drone
-        closestWarehouse = Warehouse()
-        closestCustomer = Customer()
-        closestAvailableOrder = Inventory()
-        for customer in self.params.customers:
-            if customer.isComplete():
+        """
+        Find the closest customer to the drone that can be served by some warehouse. Customers are visited from the
+        closest one. As in a scan of the customers list that only considers customers closer than all the previous
+        ones, a customer is skipped if a customer of a lower index is at least as close
+        :param drone:   An idle drone
+        :param time:    Current time
+        :return:
+        """
+        customers = self._customersByIndex
+        minIndex = len(customers)   # Minimal index of the customers visited so far
+        for d, i in self._customerIndex.iterNearest(drone.location(time)):
+            if i > minIndex or customers[i].isComplete():
+                continue
+            minIndex = i
+            warehouse, availableOrder = self._closestServingWarehouse(customers[i])
+            if availableOrder.empty():
                 continue
-            d = distance(drone.location(time), customer.location())
-            if d < minDist:
-                minDist = d
-                warehouse, availableOrder = self._closestServingWarehouse(customer)
-                if availableOrder.empty():
-                    continue
-
-                # Adjusting order to current drone weight limits
-                closestAvailableOrder = self._maximalPossibleLoad(drone, availableOrder, time)
 
-                closestCustomer = customer
-                closestWarehouse = warehouse
-        return closestWarehouse, closestCustomer, closestAvailableOrder
+            # Adjusting order to current drone weight limits
+            return warehouse, customers[i], self._maximalPossibleLoad(drone, availableOrder, time)
+        return Warehouse(), Customer(), Inventory()
 
 class Model3(Simulations):
-    def __init__(self, inputFilename):
-        super().__init__(inputFilename)
+    def __init__(self, inputFilename, instance: ProblemInstance = None, batched: bool = False):
+        """
+        :param batched: Assign missions to all idle drones of a turn together, as a minimal cost assignment of drones
+                        to routes, rather than drone after drone (not in degraded mode - see run())
+        """
+        super().__init__(inputFilename, instance)
+        self.__batched = batched
 
     def _timeStepZero(self) -> None:
         pass
 
     def _timeStep(self, time: int) -> None:
+        if self.__batched and not self._degraded:
+            self.__assignIdleDrones(time)
+            return
 
         ## Set mission to idle drones
         for drone in self.drones:
@@ -408,28 +722,109 @@ class Model3(Simulations):
             self._d.setLoadAndDeliverMission(drone, warehouse, customer, products, time)
 
     def __findOptimalCustomerWarehouse(self, drone: Drone, time: int) -> Tuple[Warehouse, Customer, Inventory]:
-        optimalWarehouse = Warehouse()
-        optimalCustomer = Customer()
-        optimalProducts = Inventory()
-        minPath = 2 * distance((0, 0), (self.params.nRows, self.params.nColumns))
-        for customer in self.params.customers:
-            if customer.isComplete(True):
+        """
+        Find the warehouse-customer pair with the shortest drone route (drone to warehouse to customer), for which the
+        warehouse can offer products to the customer. Routes are visited from the shortest, by merging the nearest
+        customers of all warehouses. Ties are broken by customer index and then by warehouse index. A randomized model
+        picks one of the shortest routes (see randomize())
+        :param drone:   An idle drone
+        :param time:    Current time
+        :return:
+        """
+        customers = self._customersByIndex
+        dDroneWarehouses = self._distances.toWarehouses(drone.location(time))
+        notComplete = lambda i: not customers[i].isComplete(True)
+        routes = []     # Heap of (route length, customer index, warehouse index, nearest customers iterator)
+        for warehouse in self.params.warehouses:
+            nearest = self._customerIndex.iterNearest(warehouse.location(), notComplete)
+            for d, i in nearest:
+                routes.append((dDroneWarehouses[warehouse.index()] + d, i, warehouse.index(), nearest))
+                break
+        heapq.heapify(routes)
+        found: List[Tuple[int, Tuple[Warehouse, Customer, Inventory]]] = []     # Routes the warehouse can serve
+        while routes:
+            path, i, w, nearest = routes[0]
+            if len(found) >= self._topK and path > found[self._topK - 1][0]:
+                break
+            warehouse = self.params.warehouses[w]
+            availableOrder = warehouse.createAvailableOrder(customers[i].getProductsMinusBookings())  # What can the
+                                                                                    # warehouse offer to the customer?
+            availableOrder = self._maximalPossibleLoad(drone, availableOrder, time)
+            if not availableOrder.empty():
+                found.append((path, (warehouse, customers[i], availableOrder)))
+                if self._rng is None:
+                    break
+            for d, i in nearest:    # Next customer of the same warehouse
+                heapq.heapreplace(routes, (dDroneWarehouses[w] + d, i, w, nearest))
+                break
+            else:
+                heapq.heappop(routes)
+        if found:
+            return self._pickCandidate(found)
+        return Warehouse(), Customer(), Inventory()
+
+    def __candidateRoutes(self, nRoutes: int) -> Tuple[List[int], List[int], np.ndarray]:
+        """
+        Candidate warehouse-customer routes for an assignment - for each warehouse, its nearest incomplete customers
+        that it can offer products to. Since a route cost is the drone to warehouse distance plus the warehouse to
+        customer distance, an assignment of n drones uses only the n nearest customers of each warehouse
+        :param nRoutes: Maximal number of routes from each warehouse (number of drones to assign)
+        :return: Warehouse indices, customer indices and warehouse to customer distances of the routes
+        """
+        warehouseIndices: List[int] = []
+        customerIndices: List[int] = []
+        dWarehouseCustomer: List[int] = []
+        for warehouse in self.params.warehouses:
+            w = warehouse.index()
+            if warehouse.getProductsMinusBookings().empty():
+                continue
+            serves = lambda i: self._warehouseServes(w, i)
+            for d, i in islice(self._customerIndex.iterNearest(warehouse.location(), serves), nRoutes):
+                warehouseIndices.append(w)
+                customerIndices.append(i)
+                dWarehouseCustomer.append(d)
+        return warehouseIndices, customerIndices, np.array(dWarehouseCustomer, dtype=np.int64)
+
+    def __assignIdleDrones(self, time: int) -> None:
+        """
+        Set missions to all idle drones together. The cost of a drone-route pair is the route length (drone to warehouse
+        to customer), and drones are assigned to distinct routes with minimal total cost. Assigned routes are set in
+        the order of their cost, and a drone whose route can no longer be served (since the warehouse stock or the
+        customer order were taken by a cheaper route to the same customer) falls back to its shortest route
+        :param time:    Current time
+        :return:
+        """
+        drones = [drone for drone in self.drones if not self._d.isInMission(drone)]
+        if not drones:
+            return
+        warehouseIndices, customerIndices, dWarehouseCustomer = self.__candidateRoutes(len(drones))
+        assignment: List[Tuple[int, Drone, int]] = []      # (route cost, drone, route)
+        if customerIndices:
+            from scipy.optimize import linear_sum_assignment    # Imported only when used (slow to load)
+            dDroneWarehouse = np.array([self._distances.toWarehouses(drone.location(time)) for drone in drones],
+                                       dtype=np.int64)
+            cost = dDroneWarehouse[:, warehouseIndices] + dWarehouseCustomer[None, :]
+            rows, columns = linear_sum_assignment(cost)
+            assignment = sorted((int(cost[r, c]), int(r), int(c)) for r, c in zip(rows, columns))
+        assigned: Set[int] = set()
+        for routeCost, r, route in assignment:
+            drone = drones[r]
+            warehouse = self.params.warehouses[warehouseIndices[route]]
+            customer = self._customersByIndex[customerIndices[route]]
+            availableOrder = warehouse.createAvailableOrder(customer.getProductsMinusBookings())
+            availableOrder = self._maximalPossibleLoad(drone, availableOrder, time)
+            if availableOrder.empty():
+                continue
+            self._d.setLoadAndDeliverMission(drone, warehouse, customer, availableOrder, time)
+            assigned.add(r)
+
+        ## Drones without a route
+        for r, drone in enumerate(drones):
+            if r in assigned:
                 continue
-            order = customer.getProductsMinusBookings()
-            for warehouse in self.params.warehouses:
-                dWarehouseCustomer = distance(warehouse.location(), customer.location())
-                dDroneWarehouse = distance(warehouse.location(), drone.location(time))
-                if dWarehouseCustomer + dDroneWarehouse < minPath:
-                    availableOrder = warehouse.createAvailableOrder(order)  # What can the warehouse offer to the
-                                                                            # customer?
-                    availableOrder = self._maximalPossibleLoad(drone, availableOrder, time)
-                    if not availableOrder.empty():
-                        minPath = dWarehouseCustomer + dDroneWarehouse
-                        optimalWarehouse = warehouse
-                        optimalCustomer = customer
-                        optimalProducts = availableOrder
-
-        return optimalWarehouse, optimalCustomer, optimalProducts
+            warehouse, customer, products = self.__findOptimalCustomerWarehouse(drone, time)
+            if not products.empty():
+                self._d.setLoadAndDeliverMission(drone, warehouse, customer, products, time)
 
 class DroneMission:
     def __init__(self, missionType: MissionType, products: Inventory, customer: Customer = None):
@@ -447,17 +842,41 @@ class CustomerPicking(Enum):        # How to give precedence to customers
     WeightedClosest2tCurrent = "WeightedClosest2tCurrent"
     RatioClosestCurrent = "RatioClosestCurrent"
 
+class CustomerPickingKey:
+    """
+    Customer picking priority of customers from a warehouse (lower first)
+    """
+    def __init__(self, customerPicking: CustomerPicking, dist: List[float], orderWeights: Dict[Customer, int]):
+        """
+        :param customerPicking: Customer picking
+        :param dist:            Customer picking distances from the warehouse, by customer index
+        :param orderWeights:    Customer original order weights
+        """
+        self.customerPicking = customerPicking
+        self.dist = dist
+        self.orderWeights = orderWeights
+
+    def __call__(self, x: Customer) -> float:
+        if self.customerPicking == CustomerPicking.WeightedClosestCurrent or \
+                self.customerPicking == CustomerPicking.WeightedClosest2tCurrent:     # Based on current weight
+            return self.dist[x.index()] * x.order().weight()
+        elif self.customerPicking == CustomerPicking.Weighted2ClosestCurrent:
+            return self.dist[x.index()] * x.order().weight() * x.order().weight()
+        elif self.customerPicking == CustomerPicking.RatioClosestCurrent:
+            return self.dist[x.index()] * self.orderWeights[x] / x.order().weight()
+        return self.dist[x.index()]     # Based on weights and distances at time 0
+
 class Model4(Simulations):
-    def __init__(self, inputFilename, customerPicking: CustomerPicking):
-        super().__init__(inputFilename)
-        self.__service: Dict[Drone, Warehouse] = {}     # Warehouse each drone serves (assuming 1 warehousee is served
-                                                        # by number of drones)
-        self.__missionPlan: Dict[Drone, List[DroneMission]] = {}
-        self.__dist: Dict[Tuple[Warehouse, Customer], int] = {}
+    def __init__(self, inputFilename, customerPicking: CustomerPicking, instance: ProblemInstance = None):
+        super().__init__(inputFilename, instance)
+        self.__dist: np.ndarray = None  # Customer picking distances (warehouse index x customer index)
         self.__warehousesToExclude: Dict[Drone, List[Warehouse]] = {}
         self.__customerPicking = customerPicking
         print(self.__customerPicking)
         self.orderWeights = self._orderWeightOriginal()
+        self.__queues: Dict[int, CustomerQueue] = {}    # Customers by picking priority, for each warehouse index (lazy)
+        for customer in self.params.customers:
+            customer.onDelivery = self._customerDelivered
 
     def _timeStepZero(self) -> None:
         # self.__assignWarehousesToDrones()                   # Assign for each warehouse, the drones that will serve it
@@ -472,23 +891,23 @@ class Model4(Simulations):
             self.__dist = self._weightedCustomerWarehouseDistances()
 
     def __assignWarehousesToDrones(self) -> None:
-        self.__service.clear()
+        self._service.clear()
         warehouse_cycle = cycle(self.params.warehouses)
         itWarehouse = iter(warehouse_cycle)
         for drone in self.drones:
             warehouse = next(itWarehouse)
-            if drone in self.__service:
+            if drone in self._service:
                 raise RuntimeError("Cannot assign a drone to more than one warehouse")
-            self.__service[drone] = warehouse
+            self._service[drone] = warehouse
 
     def _timeStep(self, time: int) -> None:
 
         ## Send idle drones to warehouse
         for drone in self.drones:
-            # warehouse = self.__service[drone]
+            # warehouse = self._service[drone]
 
             ## Planing drone mission
-            if not self._d.isInMission(drone) and drone not in self.__missionPlan:
+            if not self._d.isInMission(drone) and drone not in self._missionPlan:
 
                 # Pick warehouse closest to the drone - exclude closer ones that were picked before, but couldn't serve
                 bestWarehouse = Warehouse()
@@ -496,9 +915,10 @@ class Model4(Simulations):
                 bestCustomers: List[Customer] = []
                 bestCustomerOrder: List[Inventory] = []
                 maxWeightCustomerOrders = 0
-                while True:
-                    if drone not in self.__warehousesToExclude:
-                        self.__warehousesToExclude[drone] = []
+                candidates = []     # (-warehouse order weight, trip), from the closest warehouse (randomized model)
+                if drone not in self.__warehousesToExclude:
+                    self.__warehousesToExclude[drone] = []
+                while len(self.__warehousesToExclude[drone]) < len(self.params.warehouses):     # Until all are tried
                     warehouse = self.__closestWarehouseToDrone(drone, time)
                     if warehouse.order().empty():
                         self.__warehousesToExclude[drone].append(warehouse)
@@ -508,6 +928,9 @@ class Model4(Simulations):
                     customers, customerOrders, warehouseOrder = \
                         self._composeDeliverredCustomers(drone, warehouse, time)
 
+                    if self._rng is not None and warehouseOrder.weight() > 0:
+                        candidates.append((-warehouseOrder.weight(),
+                                           (warehouse, warehouseOrder, customers, customerOrders)))
                     if warehouseOrder.weight() > maxWeightCustomerOrders:
                         maxWeightCustomerOrders = warehouseOrder.weight()
                         bestWarehouse = warehouse
@@ -515,165 +938,288 @@ class Model4(Simulations):
                         bestCustomerOrder = customerOrders
                         bestWarehouseOrder = warehouseOrder
                     self.__warehousesToExclude[drone].append(warehouse)
-                    if len(self.__warehousesToExclude[drone]) == len(self.params.warehouses):
-                        break
+                    if self._degraded and maxWeightCustomerOrders > 0:     # Degraded mode (see run()) - the closest
+                        break                                               # warehouse that can serve customers
                 self.__warehousesToExclude[drone].clear()
+                if candidates:      # Randomized model - one of the heaviest trips
+                    candidates.sort(key=lambda candidate: candidate[0])
+                    bestWarehouse, bestWarehouseOrder, bestCustomers, bestCustomerOrder = \
+                        self._pickCandidate(candidates)
 
-                # First mission is to load from a warehouse
-                bestWarehouse.book(bestWarehouseOrder)
-                self.__service[drone] = bestWarehouse
-                self.__missionPlan[drone] = []
-                self.__missionPlan[drone].append(DroneMission(MissionType.Load, bestWarehouseOrder))
-
-                # Append delivery missions to chosen customers
-                for (customer, customerOrder) in zip(bestCustomers, bestCustomerOrder):
-                    customer.book(customerOrder)
-                    self.__missionPlan[drone].append(
-                        DroneMission(MissionType.Deliver, customerOrder, customer = customer))
+                # First mission is to load from a warehouse, followed by delivery missions to chosen customers
+                self._planTrip(drone, bestWarehouse, bestWarehouseOrder, bestCustomers, bestCustomerOrder)
 
             # Set next drone sub-mission, and pop it from the drone mission list
-            if not self._d.isInMission(drone) and len(self.__missionPlan[drone]) > 0:
+            if not self._d.isInMission(drone) and len(self._missionPlan[drone]) > 0:
                 self._setNextDroneMission(drone, time)
 
     def __closestWarehouseToDrone(self, drone: Drone, time: int) -> Warehouse:
-        minDist = distance((0, 0), (self.params.nRows, self.params.nColumns))
-        closetWarehouse = Warehouse()
-        for warehouse in self.params.warehouses:
-            if warehouse in self.__warehousesToExclude[drone]:
-                continue
-            d = distance(drone.location(time), warehouse.location())
-            if d < minDist:
-                minDist = d
-                closetWarehouse = warehouse
-        return closetWarehouse
+        excluded = {warehouse.index() for warehouse in self.__warehousesToExclude[drone]}
+        closest = self._warehouseIndex.nearest(drone.location(time), predicate = lambda i: i not in excluded)
+        if not closest:
+            return Warehouse()
+        return self.params.warehouses[closest[0]]
 
     def _composeDeliverredCustomers(self, drone: Drone, warehouse: Warehouse, time: int) ->\
         Tuple[List[Customer], List[Inventory], Inventory]:
         """
-        Creates lists of orders to load from a warehouse and deliver to a list of customers - mission planing
+        Creates lists of orders to load from a warehouse and deliver to a list of customers - mission planing. A
+        randomized model (see randomize()) starts from one of the topK first customers
         :param warehouse:
         :return:
         """
 
-        ## Sort customers to increasing distance from warehouse (closest first)
-        if self.__customerPicking == CustomerPicking.WeightedClosestCurrent or\
-                self.__customerPicking == CustomerPicking.WeightedClosest2tCurrent:    # Based on current weight
-            self.params.customers.sort(key=lambda x: self.__dist[(warehouse, x)] * x.order().weight())
-        elif self.__customerPicking == CustomerPicking.Weighted2ClosestCurrent:
-            self.params.customers.sort(key=lambda x: self.__dist[(warehouse, x)] *
-                                                     x.order().weight() * x.order().weight())
-        elif self.__customerPicking == CustomerPicking.RatioClosestCurrent:
-            self.params.customers.sort(key=lambda x: self.__dist[(warehouse, x)] *
-                                                     self.orderWeights[x] / x.order().weight())
-        else:       # Based on weights and distances at time 0
-            self.params.customers.sort(key=lambda x: self.__dist[(warehouse, x)])
-
         ## Iterating of customers, starting from the closest - adding customers that can be served by the warehouse
         customersToDeliver: List[Customer] = []          # List of customers that will be delivered
         customerOrders: List[Inventory] = []    # List of products each customer will receive
-        droneTmp = copy.deepcopy(drone)         # A temp drone copy to simulate future drone loadings
-        warehouseOrder = Inventory()            # The total warehouse order
-        warehouseTmp = copy.deepcopy(warehouse)
-        for i in range(len(self.params.customers)):
-            customer = self.params.customers[i] # copy.deepcopy(self.params.customers[i])
-            if customer.isComplete():
-                continue
-            customerOrder = customer.getProductsMinusBookings()     # Get its updated order (minus booking)
-            availableOrder = warehouseTmp.createAvailableOrder(customerOrder)       # Consider warehouse availability
-            availableOrder = self._maximalPossibleLoad(droneTmp, availableOrder, time)    # Consider drone capacity
-            if availableOrder.empty():      # Skip to te next customer, if no available order is found
-                continue
-            customersToDeliver.append(customer) # append(self.params.customers[i])
-            customerOrders.append(availableOrder)
-            for product in availableOrder:  # Add products to warehouse order
-                warehouseOrder.append(product, availableOrder[product])
-                droneTmp.inventory(time).append(product, availableOrder[product])   # Load dummy drone to consider its
-                                                                                    # capacity for the next customer
-            warehouseTmp.book(availableOrder)   # Prevent future over-booking by other customers in current loop
+        capacity = drone.maxWeight - drone.weight(time)
+        stock = warehouse.getProductsMinusBookings().weight()
+        lightest = min((product.weight for product in warehouse.getProductsMinusBookings()), default=0)
+        queue = self.__customerQueue(warehouse).iterOrdered()
+        customers = queue
+        if self._rng is not None:
+            first = list(islice(queue, self._topK))
+            if first:
+                first.insert(0, first.pop(self._rng.randrange(len(first))))
+            customers = chain(first, queue)
+        drone.beginPlanning()                   # Simulate future drone loadings, and warehouse bookings
+        warehouse.beginPlanning()
+        try:
+            for customer in customers:
+                loaded = drone.plannedLoad().weight()
+                if capacity - loaded < max(lightest, 1) or loaded >= stock:     # No available product fits the drone,
+                    break                                                       # or the warehouse has nothing more
+                customerOrder = customer.getProductsMinusBookings()     # Get its updated order (minus booking)
+                availableOrder = warehouse.createAvailableOrder(customerOrder)    # Consider warehouse availability
+                availableOrder = self._maximalPossibleLoad(drone, availableOrder, time)    # Consider drone capacity
+                if availableOrder.empty():      # Skip to te next customer, if no available order is found
+                    continue
+                customersToDeliver.append(customer)
+                customerOrders.append(availableOrder)
+                for product in availableOrder:  # Trial load, to consider drone capacity for the next customer
+                    drone.load(product, availableOrder[product], time)
+                warehouse.book(availableOrder)  # Prevent future over-booking by other customers in current loop
+            warehouseOrder = drone.plannedLoad()    # The total warehouse order
+        finally:
+            queue.close()
+            drone.discardPlanning()
+            warehouse.discardPlanning()
 
         return customersToDeliver, customerOrders, warehouseOrder
 
-    def _setNextDroneMission(self, drone: Drone, time: int) -> None:
-        missionType = self.__missionPlan[drone][0].missionType
-        products = self.__missionPlan[drone][0].products
+    def __customerQueue(self, warehouse: Warehouse) -> CustomerQueue:
+        """
+        Customers of a warehouse, by the customer picking priority (lowest first)
+        :param warehouse:
+        :return:
+        """
+        if warehouse.index() not in self.__queues:
+            key = CustomerPickingKey(self.__customerPicking, self.__dist[warehouse.index()].tolist(), self.orderWeights)
+            self.__queues[warehouse.index()] = CustomerQueue(self.params.customers, key)
+        return self.__queues[warehouse.index()]
 
-        # Set relevant mission. Don't book, because booking was already set during mission planning
-        if missionType == MissionType.Load:
-            warehouse = self.__service[drone]
-            self._d.setLoadMission(drone, warehouse, products, time, book = False)
-        elif missionType == MissionType.Deliver:
-            customer = self.__missionPlan[drone][0].customer
-            self._d.setDeliverMission(drone, customer, products, time, book = False)
-        self.__missionPlan[drone].pop(0)   # Pop the mission that was set
-        if len(self.__missionPlan[drone]) == 0:
-            del self.__missionPlan[drone]
+    def _customerDelivered(self, customer: Customer) -> None:
+        """
+        Called by a customer, when items are delivered to it. The customer is re-keyed by all warehouse queues
+        :param customer:
+        :return:
+        """
+        for queue in self.__queues.values():
+            queue.invalidate(customer)
 
 class Model5(Simulations):
-    def __init__(self, inputFilename):
-        super().__init__(inputFilename)
-        self.customersTmp: List[Customer] = []
-        self.customerOrdersTmp: List[Inventory] = []
-        self.optimalCustomers: List[Customer] = []
-        self.optimalOrders: List[Inventory] = []
+    """
+    Multi-customer trips, searched by branch and bound (see TripSearch). An idle drone goes to the closest warehouse
+    with available products, and takes the trip that delivers the largest sum of fractions of customer orders, among
+    trips that start at the customers closest to the warehouse and continue to neighbouring customers
+    """
+    degradedNodesFactor = 10
+    def __init__(self, inputFilename, instance: ProblemInstance = None, maxNodes: int = 200, timeLimit: float = None,
+                 neighbourRadius: int = 20):
+        """
+        :param maxNodes:        Search budget of a single trip, in search nodes (customer visits). Cut by
+                                degradedNodesFactor in degraded mode (see run())
+        :param timeLimit:       Search budget of a single trip, in seconds (results then depend on machine speed)
+        :param neighbourRadius: Maximal distance between consecutive customers of a trip
+        """
+        super().__init__(inputFilename, instance)
         self.orderWeights = self._orderWeightOriginal()
+        self.maxNodes = maxNodes
+        self.timeLimit = timeLimit
+        self.__search = TripSearch(self._customersByIndex, self.orderWeights, neighbourRadius)
 
-    def optimizeCustomers(self,
-                          drone: Drone,
-                          time: int,
-                          warehouse: Warehouse,
-                          optimalCustomers: List[Customer],
-                          optimalOrders: List[Inventory]):
-        self.__maxSumOfRatios = 0
-        self.customersTmp.clear()
-        self.customerOrdersTmp.clear()
-        self.optimalCustomers.clear()
-        self.optimalOrders.clear()
-        drone.task.status = DroneStatus.Load
-        for customer in self.params.customers:
-            self.__optimizeCustomersUtil(drone, time, customer, warehouse, 0)
-
-    def __optimizeCustomersUtil(self,
-                                drone: Drone,
-                                time: int,
-                                customer: Customer,
-                                warehouse: Warehouse,
-                                sumOfRatios: float) -> None:
-        customerOrder = customer.getProductsMinusBookings()
-        availableOrder = warehouse.createAvailableOrder(customerOrder)
-        availableOrder = self._maximalPossibleLoad(drone, availableOrder, time)
-        if availableOrder.empty():
-            return
-        for product in availableOrder:
-            drone.inventory(time).append(product, availableOrder[product])
-        self.customersTmp.append(customer)
-        self.customerOrdersTmp.append(availableOrder)
-        sumOfRatios += availableOrder.weight() / self.orderWeights[customer]
-        if sumOfRatios > self.__maxSumOfRatios:
-            self.__maxSumOfRatios = sumOfRatios
-            self.optimalCustomers = self.customersTmp
-            self.optimalOrders = self.customerOrdersTmp
-        for nextCustomer in self.params.customers:
-            if nextCustomer in self.customersTmp:
-                continue
-            if distance(customer.location(), nextCustomer.location()) > 20:     # FIXME: Arbitrary
-                continue
-            self.__optimizeCustomersUtil(drone, time, nextCustomer, warehouse, sumOfRatios)
-        for product in availableOrder:
-            drone.inventory(time).remove(product, availableOrder[product])
-        self.customersTmp.pop()
-        self.customerOrdersTmp.pop()
+    def _timeStepZero(self) -> None:
+        pass
+
+    def _timeStep(self, time: int) -> None:
+        for drone in self.drones:
+
+            ## Planing drone mission - the closest warehouse that can serve a trip
+            if not self._d.isInMission(drone) and drone not in self._missionPlan:
+                hasStock = lambda w: not self.params.warehouses[w].getProductsMinusBookings().empty()
+                for d, w in self._warehouseIndex.iterNearest(drone.location(time), hasStock):
+                    trip = self.optimizeCustomers(drone, time, self.params.warehouses[w])
+                    if trip.customers:
+                        self._planTrip(drone, self.params.warehouses[w], trip.load(), trip.customers, trip.orders)
+                        break
+
+            # Set next drone sub-mission
+            if not self._d.isInMission(drone) and drone in self._missionPlan:
+                self._setNextDroneMission(drone, time)
+
+    def optimizeCustomers(self, drone: Drone, time: int, warehouse: Warehouse) -> Trip:
+        """
+        Search for the best trip of a drone from a warehouse. Trips start at the customers that the warehouse can serve,
+        from the closest to the warehouse
+        :param drone:       The drone (its remaining capacity is considered)
+        :param time:        Current time
+        :param warehouse:   Warehouse to load from
+        :return: Best trip found within the search budget
+        """
+        serves = lambda i: self._warehouseServes(warehouse.index(), i)
+        starts = (i for d, i in self._customerIndex.iterNearest(warehouse.location(), serves))
+        maxNodes = max(self.maxNodes // self.degradedNodesFactor, 1) if self._degraded else self.maxNodes
+        return self.__search.search(warehouse, drone.maxWeight - drone.weight(time), starts, maxNodes, self.timeLimit)
+
+def createSimulation(model: str, param: str, inputFilename: str, instance: ProblemInstance = None) -> Simulations:
+    """
+    Create a simulation by model name
+    :param model:           Model name (Model0 - Model5)
+    :param param:           Customer picking of Model4, or 'Batched' for batched assignment of Model3 (ignored by
+                            other models)
+    :param inputFilename:   Input file
+    :param instance:        Parsed input file. If not given, the input file is parsed
+    :return:
+    """
+    if model == 'Model1':
+        return Model1(inputFilename, instance)
+    elif model == 'Model2':
+        return Model2(inputFilename, instance)
+    elif model == 'Model3':
+        return Model3(inputFilename, instance, batched = param == 'Batched')
+    elif model == 'Model4':
+        return Model4(inputFilename, CustomerPicking(param), instance)
+    elif model == 'Model5':
+        return Model5(inputFilename, instance)
+    return Model0(inputFilename, instance)
+
+def resumeSimulation(checkpointFilename: str, printouts = SimulationPrintouts.Nothing) -> Simulations:
+    """
+    Load a simulation from a checkpoint (see Simulations.run()), and run it to the end. The commands are the same as
+    those of an uninterrupted run. Checkpoints continue to be written, as in the original run
+    :param checkpointFilename:  Checkpoint file
+    :param printouts:           Printouts level
+    :return: The simulation
+    """
+    with open(checkpointFilename, 'rb') as f:
+        simulation: Simulations = pickle.load(f)
+    simulation._resume(printouts)
+    return simulation
+
+class TestEventDriven(unittest.TestCase):
+    def __commands(self, simulation: Simulations, eventDriven: bool) -> List[str]:
+        if eventDriven:
+            simulation.runEventDriven()
+        else:
+            simulation.run()
+        return simulation._d.getCommands()
+
+    def test_same_commands(self):
+        for model in [Model0, Model1, Model2, Model3, Model5]:
+            self.assertEqual(self.__commands(model('SmallInput.dat'), False),
+                             self.__commands(model('SmallInput.dat'), True))
+        self.assertEqual(self.__commands(Model3('SmallInput.dat', batched = True), False),
+                         self.__commands(Model3('SmallInput.dat', batched = True), True))
+        for customerPicking in CustomerPicking:
+            self.assertEqual(self.__commands(Model4('SmallInput.dat', customerPicking), False),
+                             self.__commands(Model4('SmallInput.dat', customerPicking), True))
+
+class TestCheckpoint(unittest.TestCase):
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for model, param in [('Model0', ''), ('Model4', CustomerPicking.WeightedClosestCurrent.value)]:
+                for engine in ['run', 'runEventDriven']:
+                    reference = createSimulation(model, param, 'SmallInput.dat')
+                    getattr(reference, engine)()
+                    sim = createSimulation(model, param, 'SmallInput.dat')
+                    checkpointFilename = os.path.join(directory, model + engine + '.pkl')
+                    getattr(sim, engine)(checkpointFilename = checkpointFilename, checkpointInterval = 5)
+                    self.assertEqual(sim._d.getCommands(), reference._d.getCommands())
+                    resumed = resumeSimulation(checkpointFilename)
+                    self.assertEqual(resumed._d.getCommands(), reference._d.getCommands())
+                    self.assertEqual(resumed._points, reference._points)
+            self.assertRaises(RuntimeError, reference._resume, SimulationPrintouts.Nothing)
+            self.assertEqual([name for name in os.listdir(directory) if not name.endswith('.pkl')], [])
+
+class TestTimeBudget(unittest.TestCase):
+    def test_budget(self):
+        for model, param in [('Model2', ''), ('Model4', CustomerPicking.WeightedClosestCurrent.value), ('Model5', '')]:
+            for engine in ['run', 'runEventDriven']:
+                reference = createSimulation(model, param, 'SmallInput.dat')
+                getattr(reference, engine)()
+                sim = createSimulation(model, param, 'SmallInput.dat')
+                getattr(sim, engine)(timeBudget = 1000.)
+                self.assertEqual(sim._d.getCommands(), reference._d.getCommands())
+                self.assertEqual(sim.degradedTurns, 0)
+                self.assertIsNone(sim.exhaustedTurn)
+                self.assertEqual(set(sim.phaseTimes), {'initialization', 'planning', 'execution', 'checkpoints'})
+                sim = createSimulation(model, param, 'SmallInput.dat')
+                getattr(sim, engine)(timeBudget = 0.)
+                self.assertEqual(sim.exhaustedTurn, 0)
+                self.assertEqual(sim._d.getCommands(), [])
+        self.assertRaises(RuntimeError, sim.run, timeBudget = -1.)
+
+    def test_degraded(self):
+        sim = Model4('SmallInput.dat', CustomerPicking.WeightedClosestCurrent)
+        sim._timeStepZero()
+        sim._degraded = True
+        sim._timeStep(0)
+        self.assertTrue(all(sim._d.isInMission(drone) for drone in sim.drones))
+
+class TestModel4(unittest.TestCase):
+    def test_empty_warehouses(self):
+        sim = Model4('SmallInput.dat', CustomerPicking.WeightedClosestCurrent)
+        sim._timeStepZero()
+        for warehouse in sim.params.warehouses:
+            warehouse.order().clear()
+        sim._timeStep(0)        # Terminates, although no warehouse can serve
+        self.assertEqual(sim._nIncompleteOrders, len(sim.params.customers))
+
+class TestBatchedAssignment(unittest.TestCase):
+    def test_all_drones_assigned(self):
+        sim = Model3('SmallInput.dat', batched = True)
+        sim._timeStepZero()
+        sim._timeStep(0)
+        self.assertTrue(all(sim._d.isInMission(drone) for drone in sim.drones))
+        booked = [customer for customer in sim.params.customers
+                  if customer.getProductsMinusBookings().weight() < customer.order().weight()]
+        self.assertEqual(len(booked), len(sim.drones))      # Distinct routes, as there are enough customers
 
 class TestModel5(unittest.TestCase):
     def setUp(self):
         self.sim = Model5('busy_day.in')
         self.drone = self.sim.drones[0]
         self.warehouse = self.sim.params.warehouses[1]
-        pass
 
     def test_optimize_customers(self):
-        optimalCustomers: List[Customer] = []
-        optimalOrders: List[Inventory] = []
-        self.sim.optimizeCustomers(self.drone, 0, self.warehouse, optimalCustomers, optimalOrders)
+        trip = self.sim.optimizeCustomers(self.drone, 0, self.warehouse)
+        self.assertGreater(len(trip.customers), 1)
+        self.assertLessEqual(trip.nodes, self.sim.maxNodes)
+        self.assertLessEqual(trip.load().weight(), self.drone.maxWeight)
+        self.assertEqual(trip.load().minimum(self.warehouse.order()).products(), trip.load().products())
+        for customer, order in zip(trip.customers, trip.orders):
+            self.assertEqual(order.minimum(customer.order()).products(), order.products())
+
+    def test_degraded(self):
+        self.sim._degraded = True
+        trip = self.sim.optimizeCustomers(self.drone, 0, self.warehouse)
+        self.assertGreater(len(trip.customers), 0)
+        self.assertLessEqual(trip.nodes, self.sim.maxNodes // Model5.degradedNodesFactor)
+
+    def test_run(self):
+        sim = Model5('SmallInput.dat')
+        sim.runEventDriven()
+        self.assertEqual(sim._nIncompleteOrders, 0)
 
 if __name__ == '__main__':
     unittest.main()
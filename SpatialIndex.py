@@ -0,0 +1,161 @@
+from Definitions import Location, distance
+import heapq
+import math
+import random
+import unittest
+from itertools import islice, takewhile
+from typing import Callable, Dict, Iterator, List, Tuple
+
+class SpatialIndex:
+    """
+    A uniform grid over a set of locations (e.g., all customers or all warehouses), for nearest neighbour and radius
+    queries. Locations are referred by their index in the list the index was built from. Distances are in number of
+    turns (see Definitions.distance). Query results are ordered by distance and then by index - the same result as a
+    linear scan in index order that keeps the first strict minimum
+    """
+    __pointsPerCell = 2         # Average number of locations in a grid cell, when cell size is not given
+
+    def __init__(self, locations: List[Location], cellSize: int = None):
+        self.__rows = [int(location[0]) for location in locations]
+        self.__columns = [int(location[1]) for location in locations]
+        self.__alive = [True] * len(locations)
+        self.__size = len(locations)
+        if cellSize is None:
+            area = 1
+            if locations:
+                area = (max(self.__rows) - min(self.__rows) + 1) * (max(self.__columns) - min(self.__columns) + 1)
+            cellSize = max(1, math.ceil(math.sqrt(self.__pointsPerCell * area / max(1, len(locations)))))
+        self.__cellSize = cellSize
+        self.__cells: Dict[Tuple[int, int], List[int]] = {}     # Grid cell -> indices of locations in the cell
+        for i in range(len(locations)):
+            self.__cells.setdefault(self.__cell(self.__rows[i], self.__columns[i]), []).append(i)
+        self.__cellRange = (0, -1, 0, -1)       # Grid cells bounding box - minimal row, maximal row, minimal column...
+        if locations:
+            self.__cellRange = (min(self.__rows) // cellSize, max(self.__rows) // cellSize,
+                                min(self.__columns) // cellSize, max(self.__columns) // cellSize)
+
+    def __len__(self):
+        return self.__size
+
+    def __contains__(self, index: int):
+        return 0 <= index < len(self.__alive) and self.__alive[index]
+
+    def __cell(self, row: int, column: int) -> Tuple[int, int]:
+        return row // self.__cellSize, column // self.__cellSize
+
+    def __ring(self, cellRow: int, cellColumn: int, ring: int) -> Iterator[Tuple[int, int]]:
+        """
+        Grid cells in a square ring around a cell (only cells inside the grid bounding box)
+        :param ring:    Ring radius, in cells (0 is the center cell itself)
+        :return:
+        """
+        minRow, maxRow, minColumn, maxColumn = self.__cellRange
+        for row in range(max(cellRow - ring, minRow), min(cellRow + ring, maxRow) + 1):
+            if row == cellRow - ring or row == cellRow + ring:
+                for column in range(max(cellColumn - ring, minColumn), min(cellColumn + ring, maxColumn) + 1):
+                    yield row, column
+            else:
+                if cellColumn - ring >= minColumn:
+                    yield row, cellColumn - ring
+                if ring > 0 and cellColumn + ring <= maxColumn:
+                    yield row, cellColumn + ring
+
+    def remove(self, index: int) -> None:
+        """
+        Remove a location from the index (e.g., of a customer whose order was completed)
+        :param index:   Location index
+        :return:
+        """
+        if index not in self:
+            raise RuntimeError("Trying to remove location " + str(index) + " which is not in the index")
+        self.__cells[self.__cell(self.__rows[index], self.__columns[index])].remove(index)
+        self.__alive[index] = False
+        self.__size -= 1
+
+    def iterNearest(self, location: Location, predicate: Callable[[int], bool] = None) -> Iterator[Tuple[int, int]]:
+        """
+        Iterate over the locations in the index, from the nearest to a given location. The grid is scanned lazily,
+        ring by ring, so stopping the iteration early costs only the rings around the location
+        :param location:    Query location
+        :param predicate:   Filter over location indices (e.g., warehouse stocks a product). Evaluated only for the
+                            locations that are reached by the iteration
+        :return: Iterator of (distance, index)
+        """
+        if self.__size == 0:
+            return
+        row, column = int(location[0]), int(location[1])
+        cellRow, cellColumn = self.__cell(row, column)
+        minRow, maxRow, minColumn, maxColumn = self.__cellRange
+        nRings = max(cellRow - minRow, maxRow - cellRow, cellColumn - minColumn, maxColumn - cellColumn) + 1
+        candidates: List[Tuple[int, int]] = []      # Heap of (distance, index)
+        for ring in range(nRings):
+            for cell in self.__ring(cellRow, cellColumn, ring):
+                for i in self.__cells.get(cell, ()):
+                    heapq.heappush(candidates, (math.ceil(math.sqrt((self.__rows[i] - row) ** 2 +
+                                                                    (self.__columns[i] - column) ** 2)), i))
+
+            # Locations beyond the current ring are at least ring * cellSize + 1 away
+            bound = ring * self.__cellSize
+            while candidates and candidates[0][0] <= bound:
+                d, i = heapq.heappop(candidates)
+                if self.__alive[i] and (predicate is None or predicate(i)):
+                    yield d, i
+        while candidates:
+            d, i = heapq.heappop(candidates)
+            if self.__alive[i] and (predicate is None or predicate(i)):
+                yield d, i
+
+    def nearest(self, location: Location, k: int = 1, predicate: Callable[[int], bool] = None) -> List[int]:
+        """
+        The k nearest locations to a given location
+        :param location:    Query location
+        :param k:           Number of locations
+        :param predicate:   Filter over location indices
+        :return: Indices of (up to) k nearest locations, nearest first
+        """
+        return [i for d, i in islice(self.iterNearest(location, predicate), k)]
+
+    def withinRadius(self, location: Location, radius: int, predicate: Callable[[int], bool] = None) -> List[int]:
+        """
+        All locations up to a given distance from a location
+        :param location:    Query location
+        :param radius:      Maximal distance (inclusive)
+        :param predicate:   Filter over location indices
+        :return: Indices of locations, nearest first
+        """
+        return [i for d, i in takewhile(lambda x: x[0] <= radius, self.iterNearest(location, predicate))]
+
+class TestSpatialIndex(unittest.TestCase):
+    def setUp(self):
+        rng = random.Random(0)
+        self.locations = [(rng.randrange(100), rng.randrange(150)) for i in range(300)]
+        self.locations += self.locations[:20]       # Duplicate locations, to test tie breaking by index
+        self.index = SpatialIndex(self.locations)
+
+    def __linearScan(self, location: Location, predicate = lambda i: True) -> List[Tuple[int, int]]:
+        return sorted((distance(location, self.locations[i]), i) for i in range(len(self.locations))
+                      if i in self.index and predicate(i))
+
+    def test_nearest(self):
+        for location in [(0, 0), (50, 75), (99, 149), (-20, 300), self.locations[5]]:
+            self.assertEqual(list(self.index.iterNearest(location)), self.__linearScan(location))
+            self.assertEqual(self.index.nearest(location, 3), [i for d, i in self.__linearScan(location)[:3]])
+            self.assertEqual(self.index.withinRadius(location, 20),
+                             [i for d, i in self.__linearScan(location) if d <= 20])
+
+    def test_filtered_nearest(self):
+        even = lambda i: i % 2 == 0
+        self.assertEqual(self.index.nearest((40, 40), 5, even),
+                         [i for d, i in self.__linearScan((40, 40), even)[:5]])
+
+    def test_remove(self):
+        for i in range(0, len(self.locations), 3):
+            self.index.remove(i)
+        self.assertEqual(len(self.index), len(self.locations) - len(range(0, len(self.locations), 3)))
+        self.assertNotIn(0, self.index)
+        self.assertRaises(RuntimeError, self.index.remove, 0)
+        self.assertEqual(list(self.index.iterNearest((30, 60))), self.__linearScan((30, 60)))
+        self.assertEqual(SpatialIndex([]).nearest((0, 0)), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+from Definitions import Product
+from Distances import DistanceTable
+from OrderInventory import Inventory, Order
+from WarehouseCustomer import Warehouse
+import unittest
+import numpy as np
+from typing import Dict, Iterator, List, Set
+
+class StockIndex:
+    """
+    Inverted index from product to the warehouses that currently have unbooked stock of it. Warehouses report changes
+    in their available products (booking, unbooking and removal), so the index is always up to date. Serving warehouses
+    of a customer are visited in the order of distance from the customer, and then by warehouse index
+    """
+    def __init__(self, warehouses: List[Warehouse], distances: DistanceTable, nProducts: int):
+        self.__distances = distances
+        self.__stocked: List[Set[int]] = [set() for i in range(nProducts)]     # Product index -> warehouse indices
+        self.__byDistance: Dict[int, List[int]] = {}    # Customer index -> warehouse indices from closest (lazy)
+        for warehouse in warehouses:
+            for product in warehouse.getProductsMinusBookings():
+                self.__stocked[product.index].add(warehouse.index())
+            warehouse.stockIndex = self
+
+    def __deepcopy__(self, memo):
+        return None     # Temporary warehouse copies (e.g., for mission planning) are not tracked
+
+    def update(self, warehouse: Warehouse, product: Product) -> None:
+        """
+        Called by a warehouse when its available amount of a product has changed
+        :param warehouse:   The warehouse
+        :param product:     The product
+        :return:
+        """
+        if warehouse.getProductsMinusBookings().exist(product):
+            self.__stocked[product.index].add(warehouse.index())
+        else:
+            self.__stocked[product.index].discard(warehouse.index())
+
+    def warehousesStocking(self, product: Product) -> Set[int]:
+        """
+        Warehouses that have unbooked stock of a product
+        :param product:
+        :return: Warehouse indices - should not be modified
+        """
+        return self.__stocked[product.index]
+
+    def servingWarehouses(self, customerIndex: int, order: Order) -> Iterator[int]:
+        """
+        Warehouses that can offer at least one product of an order, from the closest to a customer
+        :param customerIndex:   Customer index
+        :param order:           Order (usually, the customer remaining order)
+        :return: Iterator of warehouse indices
+        """
+        candidates: Set[int] = set()
+        for product in order:
+            candidates |= self.__stocked[product.index]
+        if not candidates:
+            return
+        if customerIndex not in self.__byDistance:
+            self.__byDistance[customerIndex] = \
+                np.argsort(self.__distances.warehouseCustomer[:, customerIndex], kind='stable').tolist()
+        for w in self.__byDistance[customerIndex]:
+            if w in candidates:
+                yield w
+
+class TestStockIndex(unittest.TestCase):
+    def test_serving_warehouses(self):
+        products = [Product(0, 5), Product(1, 2), Product(2, 3)]
+        warehouses = []
+        for i, location in enumerate([(0, 0), (0, 10), (0, 5)]):
+            stock = Inventory(products)
+            stock.append(products[i], 2)
+            warehouses.append(Warehouse(location, stock, index = i))
+        distances = DistanceTable([warehouse.location() for warehouse in warehouses], [(0, 9)])
+        index = StockIndex(warehouses, distances, len(products))
+        order = Inventory(products)
+        order.append(products[0], 1)
+        order.append(products[1], 1)
+        self.assertEqual(list(index.servingWarehouses(0, order)), [1, 0])
+        booking = Inventory(products)
+        booking.append(products[1], 2)
+        warehouses[1].book(booking)
+        self.assertEqual(index.warehousesStocking(products[1]), set())
+        self.assertEqual(list(index.servingWarehouses(0, order)), [0])
+        warehouses[1].unbook(booking)
+        self.assertEqual(list(index.servingWarehouses(0, order)), [1, 0])
+        warehouses[0].remove(products[0], 2)
+        self.assertEqual(list(index.servingWarehouses(0, order)), [1])
+
+if __name__ == '__main__':
+    unittest.main()
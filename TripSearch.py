@@ -0,0 +1,268 @@
+from Definitions import Product
+from OrderInventory import Inventory
+from WarehouseCustomer import Warehouse, Customer
+from SpatialIndex import SpatialIndex
+from LoadOptimizer import optimizeLoad
+import time as timer
+import unittest
+import numpy as np
+from typing import Dict, FrozenSet, Iterable, List, Tuple
+
+class Trip:
+    """
+    A drone trip from a warehouse - customers to deliver to (in delivery order), and the products for each customer
+    """
+    def __init__(self, customers: List[Customer] = None, orders: List[Inventory] = None, value: float = 0.):
+        self.customers: List[Customer] = customers if customers is not None else []
+        self.orders: List[Inventory] = orders if orders is not None else []
+        self.value = value          # Sum of delivered fractions of the customers original orders (sum of ratios)
+        self.nodes = 0              # Number of search nodes visited
+        self.exhausted = False      # Whether the search space was exhausted within budget (the trip is the best one)
+
+    def load(self) -> Inventory:
+        """
+        Total load of the trip, to load from the warehouse
+        :return:
+        """
+        ret = Inventory()
+        for order in self.orders:
+            for product in order:
+                ret.append(product, order[product])
+        return ret
+
+class TripSearch:
+    """
+    Branch and bound search for the most valuable multi-customer trip from a warehouse. A trip starts at a customer
+    and continues to neighbouring customers (up to a radius from the previous customer). Each customer is given the
+    fullest load that the warehouse can offer it and that fits the remaining drone capacity, and contributes the
+    delivered fraction of its original order (its ratio). The search is pruned by:
+    - An upper bound - the ratios that the remaining capacity may still add, if it were filled fractionally with the
+      customers with the lightest original orders
+    - Memoization - a trip that reaches the same set of customers and ends at the same customer, with no more value, no
+      more remaining capacity and no less warehouse products taken than a trip visited before, is not extended (it
+      cannot have a better extension)
+    - A budget of search nodes and of time, after which the best trip found so far is returned
+    """
+    def __init__(self, customers: List[Customer], orderWeights: Dict[Customer, int], neighbourRadius: int = 20):
+        """
+        :param customers:       All customers, by index
+        :param orderWeights:    Original order weight of each customer
+        :param neighbourRadius: Maximal distance between consecutive customers of a trip
+        """
+        self.__customers = customers
+        self.__originalWeights = np.array([max(orderWeights[customer], 1) for customer in customers], dtype=np.float64)
+        self.__index = SpatialIndex([customer.location() for customer in customers])
+        self.__neighbourRadius = neighbourRadius
+        self.__neighbours: Dict[int, List[int]] = {}     # Customer index -> neighbour indices, closest first (lazy)
+
+    def neighbours(self, i: int) -> List[int]:
+        """
+        Customers that may follow a customer in a trip
+        :param i:   Customer index
+        :return: Customer indices, from the closest (completed customers are included)
+        """
+        if i not in self.__neighbours:
+            self.__neighbours[i] = [j for j in self.__index.withinRadius(self.__customers[i].location(),
+                                                                         self.__neighbourRadius) if j != i]
+        return self.__neighbours[i]
+
+    def search(self, warehouse: Warehouse, capacity: int, starts: Iterable[int], maxNodes: int = None,
+               timeLimit: float = None) -> Trip:
+        """
+        Search for the most valuable trip
+        :param warehouse:   Warehouse to load from (its available products are considered)
+        :param capacity:    Drone capacity
+        :param starts:      Indices of customers to start a trip from, in the order to try them (may be lazy)
+        :param maxNodes:    Maximal number of search nodes (customer visits). Unlimited if not given
+        :param timeLimit:   Maximal search time, in seconds. Unlimited if not given
+        :return: Best trip found
+        """
+        self.__available = warehouse.getProductsMinusBookings()
+        self.__taken = Inventory()          # Products loaded by the current partial trip
+        self.__path: List[Tuple[Customer, Inventory]] = []
+        self.__visited: List[int] = []
+        # (Customers, last customer) -> (value, remaining capacity, products taken) of a visited partial trip
+        self.__memo: Dict[Tuple[FrozenSet[int], int], Tuple[float, int, Dict[Product, int]]] = {}
+        self.__best = Trip()
+        self.__nodes = 0
+        self.__maxNodes = maxNodes
+        self.__deadline = timer.perf_counter() + timeLimit if timeLimit is not None else None
+        self.__stopped = False
+        self.__bound = None
+        for i in starts:
+            if self.__bound is None:
+                self.__initBound(capacity)
+            if self.__best.value >= self.__upperBound(capacity):
+                break
+            self.__visit(i, capacity, 0.)
+            if self.__stopped:
+                break
+        self.__best.nodes = self.__nodes
+        self.__best.exhausted = not self.__stopped
+        self.__memo.clear()     # Only meaningful within a search
+        return self.__best
+
+    def __initBound(self, capacity: int) -> None:
+        """
+        Prefix sums of the upper bound - customers by decreasing ratio per delivered weight unit (lightest original
+        order first), each with its remaining order weight
+        :param capacity:    Drone capacity
+        :return:
+        """
+        remaining = np.array([customer.getProductsMinusBookings().weight() for customer in self.__customers],
+                             dtype=np.float64)
+        density = 1. / self.__originalWeights
+        order = np.argsort(-density, kind='stable')
+        order = order[remaining[order] > 0]
+        self.__boundWeights = np.cumsum(np.minimum(remaining[order], capacity))
+        self.__boundValues = np.cumsum(np.minimum(remaining[order], capacity) * density[order])
+        self.__boundDensities = density[order]
+        self.__bound = True
+
+    def __upperBound(self, capacity: int) -> float:
+        """
+        Upper bound of the value that a remaining capacity may add to a trip
+        :param capacity:    Remaining capacity
+        :return:
+        """
+        k = int(np.searchsorted(self.__boundWeights, capacity, side='right'))   # Customers that fit entirely
+        if k == 0:
+            return capacity * self.__boundDensities[0] if len(self.__boundDensities) > 0 else 0.
+        value = float(self.__boundValues[k - 1])
+        if k < len(self.__boundDensities):
+            value += (capacity - self.__boundWeights[k - 1]) * self.__boundDensities[k]
+        return value
+
+    def __outOfBudget(self) -> bool:
+        if self.__maxNodes is not None and self.__nodes >= self.__maxNodes:
+            self.__stopped = True
+        elif self.__deadline is not None and timer.perf_counter() > self.__deadline:
+            self.__stopped = True
+        return self.__stopped
+
+    @staticmethod
+    def __dominates(a: Tuple[float, int, Dict[Product, int]], b: Tuple[float, int, Dict[Product, int]]) -> bool:
+        """
+        Whether a partial trip is at least as good as another - no less value and remaining capacity, and no more of any
+        product taken from the warehouse (the same products remain for its extensions)
+        :param a:   (value, remaining capacity, products taken)
+        :param b:   (value, remaining capacity, products taken)
+        :return:
+        """
+        return a[0] >= b[0] and a[1] >= b[1] and all(n <= b[2].get(product, 0) for product, n in a[2].items())
+
+    def __visit(self, i: int, capacity: int, value: float) -> None:
+        """
+        Extend the current partial trip with a customer, and search all its extensions
+        :param i:           Customer index
+        :param capacity:    Remaining drone capacity
+        :param value:       Value of the current partial trip
+        :return:
+        """
+        if self.__outOfBudget():
+            return
+        self.__nodes += 1
+        customer = self.__customers[i]
+        load = optimizeLoad(customer.getProductsMinusBookings().minimum(self.__available, self.__taken), capacity)
+        if load.empty():
+            return
+        value += load.weight() / self.__originalWeights[i]
+        capacity -= load.weight()
+        self.__path.append((customer, load))
+        self.__visited.append(i)
+        for product in load:
+            self.__taken.append(product, load[product])
+        if value > self.__best.value:
+            self.__best = Trip([c for c, o in self.__path], [o for c, o in self.__path], value)
+
+        # Extend, unless dominated by a visited trip, or bounded by the best trip
+        key = (frozenset(self.__visited), i)
+        visited = self.__memo.get(key)
+        current = (value, capacity, self.__taken.products())
+        if (visited is None or not self.__dominates(visited, current)) and \
+                value + self.__upperBound(capacity) > self.__best.value:
+            if visited is None or self.__dominates(current, visited):
+                self.__memo[key] = current
+            for j in self.neighbours(i):
+                if j in key[0] or self.__customers[j].isComplete(True):
+                    continue
+                self.__visit(j, capacity, value)
+                if self.__stopped or value + self.__upperBound(capacity) <= self.__best.value:
+                    break
+
+        for product in load:
+            self.__taken.remove(product, load[product])
+        self.__visited.pop()
+        self.__path.pop()
+
+class TestTripSearch(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.products = [Product(i, int(w)) for i, w in enumerate(rng.integers(1, 30, 6))]
+        stock = Inventory(self.products)
+        for product in self.products:
+            stock.append(product, 4)
+        self.warehouse = Warehouse((0, 0), stock, index = 0)
+        self.customers = []
+        for i in range(9):
+            order = Inventory()
+            for p in rng.integers(0, len(self.products), rng.integers(1, 4)):
+                order.append(self.products[p], 1)
+            self.customers.append(Customer((int(rng.integers(0, 12)), int(rng.integers(0, 12))), order, index = i))
+        self.orderWeights = {customer: customer.order().weight() for customer in self.customers}
+        self.search = TripSearch(self.customers, self.orderWeights, neighbourRadius = 8)
+
+    def __bruteForce(self, capacity: int) -> float:
+        """
+        Best trip value, by enumerating all trips along neighbours
+        """
+        best = 0.
+        def extend(path: List[int], taken: Inventory, capacity: int, value: float):
+            nonlocal best
+            best = max(best, value)
+            candidates = self.search.neighbours(path[-1]) if path else range(len(self.customers))
+            for j in candidates:
+                if j in path:
+                    continue
+                customer = self.customers[j]
+                load = optimizeLoad(customer.order().minimum(self.warehouse.order(), taken), capacity)
+                if load.empty():
+                    continue
+                for product in load:
+                    taken.append(product, load[product])
+                extend(path + [j], taken, capacity - load.weight(), value + load.weight() / self.orderWeights[customer])
+                for product in load:
+                    taken.remove(product, load[product])
+        extend([], Inventory(), capacity, 0.)
+        return best
+
+    def test_optimal_trip(self):
+        for capacity in [20, 50, 120]:
+            trip = self.search.search(self.warehouse, capacity, range(len(self.customers)))
+            self.assertTrue(trip.exhausted)
+            self.assertAlmostEqual(trip.value, self.__bruteForce(capacity))
+            self.assertLessEqual(trip.load().weight(), capacity)
+            for customer, order in zip(trip.customers, trip.orders):
+                self.assertEqual(order.minimum(customer.order()).products(), order.products())
+            for a, b in zip(trip.customers, trip.customers[1:]):
+                self.assertIn(b.index(), self.search.neighbours(a.index()))
+
+    def test_scarce_stock(self):
+        # Orderings of the same customers take different products, and leave different stock for the next customers
+        stock = Inventory(self.products)
+        for product in self.products:
+            stock.append(product, 1)
+        self.warehouse = Warehouse((0, 0), stock, index = 0)
+        for capacity in [20, 50, 120]:
+            trip = self.search.search(self.warehouse, capacity, range(len(self.customers)))
+            self.assertTrue(trip.exhausted)
+            self.assertAlmostEqual(trip.value, self.__bruteForce(capacity))
+
+    def test_budget(self):
+        trip = self.search.search(self.warehouse, 120, range(len(self.customers)), maxNodes = 3)
+        self.assertFalse(trip.exhausted)
+        self.assertLessEqual(trip.nodes, 3)
+        self.assertGreater(trip.value, 0)
+
+if __name__ == '__main__':
+    unittest.main()
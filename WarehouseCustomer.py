@@ -1,5 +1,8 @@
-from Definitions import Product, Location
+from Definitions import Product, Location, Validation
 from OrderInventory import Inventory, Order
+import unittest
+import numpy as np
+from typing import Callable
 
 class Node:
     def __init__(self, location: Location = (0, 0), order: Inventory = None, index = -1):
@@ -8,6 +11,8 @@ class Node:
         self._location = location
         self._order = order
         self._booked = Order ()
+        self._available = order.copy()  # Order minus booking - kept up to date by book(), unbook() and remove()
+        self._planned: Order = None     # Trial bookings of a planning transaction (see beginPlanning())
         self.__index = index
 
     def __repr__(self):
@@ -49,31 +54,48 @@ class Node:
         :param considerBooking:
         :return:
         """
-        self._checkProducts(product, nToRemove)
         if considerBooking:
-            if product not in self._booked:
-                raise RuntimeError("Product to be removed from node (warehouse/customer) has not been booked in "
-                                   "advance")
-            if self._booked[product] < nToRemove:
-                raise RuntimeError("Trying to remove more products from node (warehouse/customer) than were booked in "
-                                   "advance")
+            if Validation.strict:       # Booked products were checked when booked
+                self._checkProducts(product, nToRemove)
+                if product not in self._booked:
+                    raise RuntimeError("Product to be removed from node (warehouse/customer) has not been booked in "
+                                       "advance")
+                if self._booked[product] < nToRemove:
+                    raise RuntimeError("Trying to remove more products from node (warehouse/customer) than were "
+                                       "booked in advance")
             self._booked[product] -= nToRemove
             if self._booked[product] == 0:
                 del self._booked[product]
+        else:
+            self._checkProducts(product, nToRemove)
+            if self._available.count(product) < nToRemove:
+                raise RuntimeError("Trying to remove products from node (warehouse/customer) that were booked by "
+                                   "others")
+            self._available.remove(product, nToRemove)
+            self._availableChanged(product)
         self._order.remove(product, nToRemove)
 
     def book(self, orderToBook: Inventory):
 
         # Check that booked order exists in invetory
         orderToBookMinusExistingBooking = self.createAvailableOrder(orderToBook)
-        for product in orderToBookMinusExistingBooking:
-            self._checkProducts(product, orderToBookMinusExistingBooking[product])
+        if Validation.strict:       # Available products are always a part of the order
+            for product in orderToBookMinusExistingBooking:
+                self._checkProducts(product, orderToBookMinusExistingBooking[product])
+
+        # Bookings during planning are only recorded
+        if self._planned is not None:
+            for product in orderToBookMinusExistingBooking:
+                self._planned.append(product, orderToBookMinusExistingBooking[product])
+            return
 
         # Append order to warehouse book
         for product in orderToBookMinusExistingBooking:
             if product not in self._booked:
                 self._booked[product] = 0
             self._booked[product] += orderToBookMinusExistingBooking[product]
+            self._available.remove(product, orderToBookMinusExistingBooking[product])
+            self._availableChanged(product)
 
     def unbook(self, orderToUnbook: Inventory):
         for product in orderToUnbook:
@@ -85,21 +107,74 @@ class Node:
             self._booked[product] -= orderToUnbook[product]
             if self._booked[product] == 0:
                 del self._booked[product]
+            reinserted = not self._available.exist(product)
+            self._available.append(product, orderToUnbook[product])
+            if reinserted:
+                self._available._sortLike(self._order)
+            self._availableChanged(product)
 
     def clearBook(self):
         self._booked.clear()
+        self._available = self._order.copy()
+        for product in self._available:
+            self._availableChanged(product)
+
+    def beginPlanning(self) -> None:
+        """
+        Start a planning transaction. Until the transaction is committed or discarded, bookings are recorded as trial
+        bookings, which are considered by the available products queries but do not change the node
+        :return:
+        """
+        if self._planned is not None:
+            raise RuntimeError("Planning has already begun")
+        self._planned = Order()
+
+    def commitPlanning(self) -> None:
+        """
+        End a planning transaction, and book its trial bookings
+        :return:
+        """
+        planned = self._planned
+        self._planned = None
+        if planned is None:
+            raise RuntimeError("Trying to commit planning that has not begun")
+        self.book(planned)
+
+    def discardPlanning(self) -> None:
+        """
+        End a planning transaction, and drop its trial bookings
+        :return:
+        """
+        self._planned = None
+
+    def __availableNow(self) -> Inventory:
+        if self._planned is None or self._planned.empty():
+            return self._available
+        return self._available.subtract(self._planned)
+
+    def _availableChanged(self, product: Product) -> None:
+        """
+        Called after the available amount (booking considered) of a product has changed
+        :param product:
+        :return:
+        """
+        pass
 
     def getProductsMinusBookings(self) -> Inventory:
         """
         Get products in the warehouse inverntory/customer order after deducting the current booking
-        :return: Order of warehouse available products/order available for customer
+        :return: Order of warehouse available products/order available for customer (trial bookings considered).
+                 Kept up to date by the node - should not be modified
+        """
+        return self.__availableNow()
+
+    def availableCounts(self, size: int = None) -> np.ndarray:
+        """
+        Vector of available item counts (booking considered), by product index
+        :param size:    Vector length (usually the number of products)
+        :return: The count vector - should not be modified
         """
-        ret = Inventory()
-        for product in self._order:
-            ret.append(product, self._order[product])
-            if product in self._booked:
-                ret.remove(product, self._booked[product])
-        return ret
+        return self.__availableNow().counts(size)
 
     def createAvailableOrder(self, order: Inventory) -> Inventory:
         """
@@ -107,16 +182,16 @@ class Node:
         :param order: An input required order
         :return: An output order of products from the input order that are available in the warehouse/customer
         """
-        availableInventory = self.getProductsMinusBookings()
-        availableOrder = Inventory()
-        for product in order:
-            if product in availableInventory.products():
-                availableOrder.append(product, min(order[product], availableInventory[product]))
-        return availableOrder
+        return order.minimum(self._available, self._planned)
 
 class Warehouse(Node):
     def __init__(self, location: Location = (0, 0), order: Inventory = None, index = -1):
         super().__init__(location, order, index)
+        self.stockIndex = None      # Product to warehouses index, that tracks this warehouse available products
+
+    def _availableChanged(self, product: Product) -> None:
+        if self.stockIndex is not None:
+            self.stockIndex.update(self, product)
 
     def _checkProducts(self, product: Product, nToLoad: int) -> None:
         if not self._order.exist(product):
@@ -127,6 +202,15 @@ class Warehouse(Node):
 class Customer(Node):
     def __init__(self, location: Location = (0, 0), order: Inventory = None, index = -1):
         super().__init__(location, order, index)
+        self.onComplete: Callable[['Customer'], None] = None    # Called once, when the last ordered item is delivered
+        self.onDelivery: Callable[['Customer'], None] = None    # Called whenever ordered items are delivered
+
+    def remove(self, product: Product, nToRemove: int, considerBooking = False) -> None:
+        super().remove(product, nToRemove, considerBooking)
+        if self.onDelivery is not None:
+            self.onDelivery(self)
+        if self.onComplete is not None and self._order.empty():
+            self.onComplete(self)
 
     def _checkProducts(self, product: Product, nToDeliver: int) -> None:
         if not self._order.exist(product):
@@ -138,6 +222,62 @@ class Customer(Node):
 
     def isComplete(self, considerBooking = False) -> bool:
         if considerBooking:
-            return self.getProductsMinusBookings().empty()
+            return self._available.empty()
         return self._order.empty()
 
+
+class TestNode(unittest.TestCase):
+    def test_available_products(self):
+        products = [Product(0, 5), Product(1, 2), Product(2, 3)]
+        stock = Inventory(products)
+        for product in products:
+            stock.append(product, 3)
+        warehouse = Warehouse((0, 0), stock, index = 0)
+        order = Inventory()
+        order.append(products[0], 3)
+        order.append(products[2], 1)
+        warehouse.book(order)
+        self.assertEqual(warehouse.getProductsMinusBookings().products(), {products[1]: 3, products[2]: 2})
+        self.assertEqual(warehouse.getProductsMinusBookings().weight(), 12)
+        warehouse.remove(products[0], 2, considerBooking = True)
+        warehouse.remove(products[1], 1)
+        self.assertRaises(RuntimeError, warehouse.remove, products[2], 3)
+        warehouse.unbook(order.minimum(warehouse.order()))
+        self.assertEqual(list(warehouse.getProductsMinusBookings()), products)      # Original product order
+        self.assertEqual(warehouse.availableCounts().tolist(), warehouse.order().counts().tolist())
+
+    def test_planning(self):
+        product = Product(0, 5)
+        stock = Inventory()
+        stock.append(product, 3)
+        warehouse = Warehouse((0, 0), stock, index = 0)
+        order = Inventory()
+        order.append(product, 2)
+        warehouse.beginPlanning()
+        warehouse.book(order)
+        self.assertEqual(warehouse.createAvailableOrder(order)[product], 1)
+        self.assertRaises(RuntimeError, warehouse.beginPlanning)
+        warehouse.discardPlanning()
+        self.assertEqual(warehouse.createAvailableOrder(order)[product], 2)
+        warehouse.beginPlanning()
+        warehouse.book(order)
+        warehouse.commitPlanning()
+        self.assertEqual(warehouse.getProductsMinusBookings()[product], 1)
+
+    def test_completion_event(self):
+        product = Product(0, 5)
+        order = Inventory()
+        order.append(product, 2)
+        customer = Customer((0, 0), order, index = 0)
+        completed = []
+        delivered = []
+        customer.onComplete = completed.append
+        customer.onDelivery = delivered.append
+        customer.remove(product, 1)
+        self.assertEqual(completed, [])
+        customer.remove(product, 1)
+        self.assertEqual(completed, [customer])
+        self.assertEqual(delivered, [customer, customer])
+
+if __name__ == '__main__':
+    unittest.main()